@@ -0,0 +1,94 @@
+"""
+Benchmark the streaming combiner (pre_process.combine_files) against the previous pd.concat based combine on a
+synthetic group of preprocessed Labtrac files, half of them with a product_category column.
+
+Run from the repository root:
+    python -m benchmarks.bench_combine --files 200 --rows 5000
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils import pre_process
+
+
+def generate_group(folder: Path, files: int, rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    file_paths = []
+    for i in range(files):
+        df = pd.DataFrame(
+            {
+                "order_uuid": [f"{i:04d}-{j:08d}" for j in range(rows)],
+                "order_invoiced_date": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+                "system_source": "Labtrac",
+                "als_lab": f"Lab {i % 20}",
+                "practice_name": rng.choice(["Smile Practice", "High Street Dental", "Park Dental"], rows),
+                "customer_id": rng.integers(1, 5000, rows),
+                "customer_name": rng.choice(["Dr A", "Dr B", "Dr C", "Dr D"], rows),
+                "product_code": rng.choice(["CR01", "BR02", "DN03", "IM04"], rows),
+                "product_description": rng.choice(["Crown", "Bridge", "Denture", "Implant"], rows),
+                "quantity": rng.integers(1, 5, rows),
+                "net_sales": rng.random(rows).round(2) * 200,
+                "nhs_or_private": rng.choice(["NHS", "Private"], rows),
+            }
+        )
+        if i % 2 == 0:
+            df.insert(12, "product_category", rng.choice(["Fixed", "Removable"], rows))
+        df["unit_net_price"] = df["net_sales"] / df["quantity"]
+
+        file_path = folder / f"lab_{i:04d}.csv"
+        df.to_csv(file_path, index=False)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def concat_combine(input_files, output_file):
+    """The combine loop used before combine_files, kept here as the benchmark baseline."""
+    combine_df = pd.DataFrame()
+    for file in input_files:
+        df = pd.read_csv(file, encoding="utf-8")
+        combine_df = pd.concat([combine_df, df])
+    combine_df.to_csv(output_file, index=False)
+
+
+def measure(func, *args):
+    # Time and memory are measured in separate runs, as tracemalloc slows allocation heavy code down considerably
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=5000, help="Rows per file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        input_folder = tmp / "labtrac"
+        input_folder.mkdir()
+        print(f"Generating {args.files} files of {args.rows} rows")
+        input_files = generate_group(input_folder, args.files, args.rows)
+
+        results = {
+            "concat": measure(concat_combine, input_files, tmp / "combined_concat.csv"),
+            "streaming": measure(pre_process.combine_files, input_files, tmp / "combined_streaming.csv"),
+        }
+
+    print(f"{'method':<10} {'seconds':>10} {'peak MB':>10}")
+    for method, (elapsed, peak) in results.items():
+        print(f"{method:<10} {elapsed:>10.2f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
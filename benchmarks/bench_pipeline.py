@@ -0,0 +1,315 @@
+"""
+Benchmark the ingest, preprocess, combine and tagging stages of the pipeline on synthetic data for every known
+schema (Schema_1 to Schema_12) plus the Ashford and Densign Excel layouts, recording the throughput and peak memory of
+each case so that results can be compared across commits.
+
+Each case runs in a fresh process, so its peak RSS is its own and no cache (date formats, encodings) carries over
+from the previous case. Cases are repeated and the fastest run is kept.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --rows 100000 --output benchmarks/results/before.json
+    python -m benchmarks.bench_pipeline --rows 100000 --output benchmarks/results/after.json
+    python -m benchmarks.bench_pipeline --compare benchmarks/results/before.json benchmarks/results/after.json
+
+Generated data is kept in --data-dir and reused by later runs with the same --rows and --seed, as generating tens of
+millions of rows takes a while. Excel sources are capped at one sheet (about a million rows) per workbook.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+import pandas as pd
+from benchmarks import generators
+from utils import schema_utils, mysettings
+
+STAGES = ["ingest", "preprocess", "combine", "tagging"]
+# Stages whose outputs a stage reads
+PREREQUISITES = {"combine": ["preprocess"], "tagging": ["preprocess"]}
+LAB = "Bench Lab"
+RAW_FOLDER = Path(mysettings.RAW_FOLDER_PATH)
+
+
+def get_schema_file(schema_type):
+    return RAW_FOLDER / LAB / f"raw_{schema_type}.csv"
+
+
+def generate_data(rows, seed, months):
+    """
+    Write the synthetic raw data into the current directory, in the folders the pipeline reads from.
+    """
+    marker = Path("generated.json")
+    settings = {"rows": rows, "seed": seed, "months": months}
+    if marker.exists() and json.loads(marker.read_text()) == settings:
+        print("Reusing generated data")
+        return
+
+    for folder in ["data", "files"]:
+        shutil.rmtree(folder, ignore_errors=True)
+    for i, schema_type in enumerate(schema_utils.lookup_schema()):
+        print(f"Generating {rows} rows of {schema_type}")
+        generators.write_schema_file(schema_type, get_schema_file(schema_type), rows, seed + i)
+    print(f"Generating Ashford and {months} months of Densign")
+    generators.write_ashford_sources(mysettings.ASHFORD_FOLDER_PATH, rows, seed)
+    generators.write_densign_months(mysettings.DENSIGN_FOLDER_PATH, months, max(rows // months, 1), seed)
+    marker.write_text(json.dumps(settings))
+
+
+def clear_snapshots():
+    shutil.rmtree(mysettings.SNAPSHOT_FOLDER_PATH, ignore_errors=True)
+    shutil.rmtree("files", ignore_errors=True)
+
+
+def ingest_schema(schema_type):
+    from utils import pre_process_function, encoding
+
+    func = pre_process_function.lookup_preprocess_function[schema_type]
+    dtype = schema_utils.lookup_schema_dtypes().get(schema_type)
+    file_path = get_schema_file(schema_type)
+    return len(encoding.read_csv(file_path, **pre_process_function.get_read_kwargs(file_path, func, dtype)))
+
+
+def ingest_ashford():
+    from utils import pre_process_function, snapshot
+
+    return sum(
+        len(snapshot.read_source(source["file_path"], header=0 if source.get("header", True) else None))
+        for source in pre_process_function.get_ashford_sources()
+    )
+
+
+def ingest_densign():
+    from utils import pre_process_function
+
+    return sum(
+        len(pre_process_function.clean_densign_month(file_path))
+        for file_path in pre_process_function.get_densign_files()
+    )
+
+
+def preprocess_schema(schema_type, chunksize=None):
+    from utils import pre_process
+
+    record = pre_process.preprocess_file(get_schema_file(schema_type), schema_type, LAB, chunksize=chunksize)
+    if record["status"] != "processed":
+        raise RuntimeError(f"{schema_type} failed: {record['error']}")
+    return [record["output_file"]]
+
+
+def preprocess_ashford():
+    from utils import pre_process
+
+    return [pre_process.preprocess_ashford()]
+
+
+def preprocess_densign():
+    from utils import pre_process
+
+    return [pre_process.preprocess_densign()]
+
+
+def combine():
+    from utils import pre_process, io_utils
+
+    pre_process.combine_preprocess(incremental=False)
+    return [file for file in Path(mysettings.COMBINED_FOLDER_PATH).iterdir() if io_utils.is_data_file(file)]
+
+
+def tag_ashford():
+    from utils import nhs_mapping, io_utils
+
+    prep_data = io_utils.read_frame(io_utils.get_output_file("data/pre_processed/sales/Ashford/ashford_preprocess"))
+    price_list = generators.write_ashford_price_list()
+    return len(nhs_mapping.nhs_private_tag_ashford(prep_data, mysettings.ALS_LABS_POSTCODES_DIC, price_list))
+
+
+def count_rows(result) -> int:
+    """
+    Returns the rows produced by a case: its result if it is a number, otherwise the rows of the output files it
+    returned. Counted after the case is timed.
+    """
+    if isinstance(result, int):
+        return result
+    rows = 0
+    for file in result:
+        if Path(file).suffix.lower() == ".parquet":
+            import pyarrow.parquet as pq
+
+            rows += pq.ParquetFile(file).metadata.num_rows
+        else:
+            rows += len(pd.read_csv(file, usecols=[0]))
+    return rows
+
+
+def get_cases(stages, chunksize=None):
+    """
+    Returns (stage, case, function, args, setup) for each benchmark case. Setup runs untimed before the case, in the
+    same process.
+    """
+    schemas = list(schema_utils.lookup_schema())
+    cases = []
+    if "ingest" in stages:
+        cases += [("ingest", schema_type, ingest_schema, (schema_type,), None) for schema_type in schemas]
+        cases += [("ingest", "ashford", ingest_ashford, (), None), ("ingest", "densign", ingest_densign, (), None)]
+    if "preprocess" in stages:
+        cases += [
+            ("preprocess", schema_type, preprocess_schema, (schema_type, chunksize), None) for schema_type in schemas
+        ]
+        cases += [
+            ("preprocess", "ashford", preprocess_ashford, (), clear_snapshots),
+            ("preprocess", "ashford_cached", preprocess_ashford, (), None),
+            ("preprocess", "densign", preprocess_densign, (), clear_snapshots),
+            ("preprocess", "densign_cached", preprocess_densign, (), None),
+        ]
+    if "combine" in stages:
+        cases.append(("combine", "all", combine, (), None))
+    if "tagging" in stages:
+        cases.append(("tagging", "ashford", tag_ashford, (), None))
+    return cases
+
+
+def run_case(func, args, setup, queue):
+    """
+    Run one benchmark case in a worker process and put (rows, seconds, cpu seconds, peak RSS MB, error) on the queue.
+    """
+    from utils import profiling
+
+    try:
+        if setup is not None:
+            setup()
+        baseline_rss = profiling.get_peak_rss_mb()
+        start, cpu = time.perf_counter(), time.process_time()
+        result = func(*args)
+        seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu
+        peak_rss = profiling.get_peak_rss_mb()
+        queue.put((count_rows(result), seconds, cpu_seconds, peak_rss, baseline_rss, None))
+    except Exception as e:
+        queue.put((None, None, None, None, None, str(e) or repr(e)))
+
+
+def run_benchmarks(stages, repeat, chunksize=None):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for stage, case, func, args, setup in get_cases(stages, chunksize):
+        runs = []
+        for _ in range(repeat):
+            queue = context.Queue()
+            process = context.Process(target=run_case, args=(func, args, setup, queue))
+            process.start()
+            runs.append(queue.get())
+            process.join()
+
+        error = next((run[5] for run in runs if run[5] is not None), None)
+        result = {"stage": stage, "case": case, "error": error}
+        if error is None:
+            best = min(runs, key=lambda run: run[1])
+            result.update({
+                "rows": best[0],
+                "seconds": best[1],
+                "seconds_all": [run[1] for run in runs],
+                "cpu_seconds": best[2],
+                "rows_per_second": best[0] / best[1] if best[1] else None,
+                "peak_rss_mb": max(run[3] or 0 for run in runs) or None,
+                "baseline_rss_mb": best[4],
+            })
+            print(f"{stage:<11} {case:<16} {best[1]:>9.2f}s {result['rows_per_second']:>12,.0f} rows/s {result['peak_rss_mb'] or 0:>9.1f} MB")
+        else:
+            print(f"{stage:<11} {case:<16} error: {error}")
+        results.append(result)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_file, after_file):
+    before = json.loads(Path(before_file).read_text())
+    after = json.loads(Path(after_file).read_text())
+    before_cases = {(result["stage"], result["case"]): result for result in before["cases"]}
+
+    print(f"{before.get('label') or before.get('commit')} -> {after.get('label') or after.get('commit')}")
+    print(f"{'stage':<11} {'case':<16} {'before s':>9} {'after s':>9} {'speedup':>8} {'before MB':>10} {'after MB':>10}")
+    for result in after["cases"]:
+        old = before_cases.get((result["stage"], result["case"]))
+        if old is None or old["error"] or result["error"]:
+            print(f"{result['stage']:<11} {result['case']:<16} {'error' if old and old['error'] else '-':>9} {'error' if result['error'] else '-':>9}")
+            continue
+        print(
+            f"{result['stage']:<11} {result['case']:<16} {old['seconds']:>9.2f} {result['seconds']:>9.2f} "
+            f"{old['seconds'] / result['seconds']:>7.2f}x {old['peak_rss_mb'] or 0:>10.1f} {result['peak_rss_mb'] or 0:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="Rows per schema file, and in total for Ashford and Densign")
+    parser.add_argument("--months", type=int, default=24, help="Number of monthly Densign reports")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the fastest is kept")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--chunksize", type=int, default=None, help="Preprocess the schema files in chunks")
+    parser.add_argument("--data-dir", default=None, help="Folder for the generated data (default: a temporary folder)")
+    parser.add_argument("--label", default=None, help="Name of the run in the results, e.g. the change being measured")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two results files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    output = Path(args.output).resolve() if args.output else None
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    # The pipeline reads and writes relative to the working directory, as it does from the repository root
+    os.chdir(data_dir)
+    try:
+        generate_data(args.rows, args.seed, args.months)
+        stages = [stage for stage in STAGES if stage in args.stages]
+        prerequisites = {
+            prerequisite for stage in stages for prerequisite in PREREQUISITES.get(stage, []) if prerequisite not in stages
+        }
+        if prerequisites:
+            print(f"Running {', '.join(sorted(prerequisites))} once, untimed, for the later stages")
+            run_benchmarks(prerequisites, 1, args.chunksize)
+        results = run_benchmarks(stages, args.repeat, args.chunksize)
+    finally:
+        os.chdir(cwd)
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "label": args.label,
+        "commit": get_commit(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpus": os.cpu_count(),
+        "rows": args.rows,
+        "months": args.months,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "chunksize": args.chunksize,
+        "cases": results,
+    }
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=1))
+        print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Synthetic raw data in the layout of every known lab export, for benchmarks. Real lab extracts cannot leave
+production, so each generator writes random values with the headers of schema_utils.lookup_schema() (Schema_1 to
+Schema_12) or the Ashford and Densign Excel layouts, with the quirks the preprocess functions handle: empty and
+placeholder dates, REPORT TOTALS rows, headers in the first data row, headerless exports and template layouts.
+
+Values are drawn from fixed size pools, so the number of distinct practices, customers and products stays realistic
+as the row count grows. The same schema, rows and seed always give the same file.
+"""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils import schema_utils, mysettings, validation
+
+# Rows generated and written at a time, so CSV files of tens of millions of rows can be written in bounded memory
+BLOCK_ROWS = 500_000
+# Excel sheets hold at most 1,048,576 rows including the header
+EXCEL_MAX_ROWS = 1_048_575
+
+POOL_SIZES = {"practice": 2_000, "customer": 5_000, "product": 800, "other": 50}
+PLACEHOLDER_DATE_RATE = 0.01
+EMPTY_DATE_RATE = 0.05
+
+YEAR_COLUMNS = {"year"}
+MONTH_COLUMNS = {"month"}
+QUANTITY_COLUMNS = {"qty", "quantity", "invoiceitem.quantity", "product count", "units"}
+AMOUNT_COLUMNS = {
+    "value", "net", "tax", "gross", "net_sales", "tax_sales", "revenue", "total", "invoice amount", "invoice vat",
+    "invoiceitem.amountnet", "invoiceitem.amountvat", "invoiceitem.amountnetvaluediscountproportion",
+    "netunitprice", "discountedunitprice",
+}
+ID_COLUMNS = {"shipid", "custid", "doctorid", "code", "id", "order", "invoice.number", "acct", "customer account"}
+DATE_COLUMNS = {"date", "completeddate", "invoicedate", "recieved", "due date", "datecreated", "datedue", "dateshipped"}
+POSTCODE_COLUMNS = {"practice post code or identifier", "delivery 5", "address5"}
+CHOICES = {
+    "standard": ["NHS", "Private"],
+    "standarddescription": ["NHS", "Private"],
+    "nhs /private/independent/ppe": ["NHS", "Private", "Independent", "PPE"],
+    "stan": ["NHS", "Private"],
+    "category": ["Fixed", "Removable", "Orthodontic"],
+    "categorydescription": ["Fixed", "Removable", "Orthodontic"],
+    "cat": ["Fixed", "Removable"],
+    "subcat": ["Crown", "Bridge", "Denture", "Veneer"],
+    "mat": ["Zirconia", "E.max", "PFM", "Acrylic"],
+    "status": ["Invoiced", "Complete", "Dispatched"],
+    "stage": ["Complete", "Despatch"],
+    "priceband": ["A", "B", "C"],
+    "currencysymbol": ["£"],
+    "currencydescription": ["Pound Sterling"],
+}
+PRACTICE_COLUMNS = {
+    "delivery 1", "shipfullname", "practice", "practice name", "prac", "client", "address1", "invoice 1",
+}
+CUSTOMER_COLUMNS = {"name", "custfullname", "doctorname", "dentist", "invoice.accountname", "patient"}
+PRODUCT_COLUMNS = {
+    "description", "product link", "product", "product description", "productname", "productid", "product code",
+    "item", "sku", "invoiceitem.productaccountreference", "invoiceitem.productaccountreference2",
+    "invoiceitem.description",
+}
+
+def make_pool(prefix, size) -> np.ndarray:
+    return np.array([f"{prefix} {i}" for i in range(size)], dtype=object)
+
+def random_dates(rng, rows, start="2021-01-01", end="2024-12-31") -> pd.DatetimeIndex:
+    start_day = pd.Timestamp(start).value // 86_400_000_000_000
+    end_day = pd.Timestamp(end).value // 86_400_000_000_000
+    return pd.to_datetime(rng.integers(start_day, end_day, rows), unit="D")
+
+def random_postcodes(rng, rows) -> np.ndarray:
+    letters = np.array(list("ABCDEFGHJKLMNPRSTUWYZ"))
+    pool = np.array([
+        f"{a}{b}{n} {m}{c}{d}"
+        for a, b, n, m, c, d in zip(
+            *[rng.choice(letters, 2_000) for _ in range(2)], rng.integers(1, 20, 2_000), rng.integers(1, 10, 2_000),
+            *[rng.choice(letters, 2_000) for _ in range(2)],
+        )
+    ], dtype=object)
+    return pool[rng.integers(0, len(pool), rows)]
+
+def column_values(name, rng, rows, date_format="%d/%m/%Y"):
+    """
+    Returns random values for a raw column, chosen by the column name.
+    """
+    key = name.lower()
+    if key in YEAR_COLUMNS:
+        return rng.integers(2021, 2025, rows)
+    if key in MONTH_COLUMNS:
+        return rng.integers(1, 13, rows)
+    if key in QUANTITY_COLUMNS:
+        return rng.integers(1, 6, rows)
+    if key in AMOUNT_COLUMNS:
+        return rng.integers(100, 100_000, rows) / 100
+    if key in DATE_COLUMNS:
+        values = random_dates(rng, rows).strftime(date_format).to_numpy(dtype=object)
+        values[rng.random(rows) < PLACEHOLDER_DATE_RATE] = "00/01/1900"
+        return values
+    if key in POSTCODE_COLUMNS:
+        return random_postcodes(rng, rows)
+    if key in ID_COLUMNS:
+        return rng.integers(1, POOL_SIZES["customer"], rows)
+    if key in CHOICES:
+        return rng.choice(np.array(CHOICES[key], dtype=object), rows)
+    if key in PRACTICE_COLUMNS:
+        pool = make_pool("Practice", POOL_SIZES["practice"])
+    elif key in CUSTOMER_COLUMNS:
+        pool = make_pool("Dr", POOL_SIZES["customer"])
+    elif key in PRODUCT_COLUMNS:
+        # Surrounding spaces, as the preprocess functions strip product codes and descriptions
+        pool = np.array([f" {value} " for value in make_pool(name, POOL_SIZES["product"])], dtype=object)
+    else:
+        pool = make_pool(name, POOL_SIZES["other"])
+    return pool[rng.integers(0, len(pool), rows)]
+
+def generate_schema_block(schema_type, rows, rng) -> pd.DataFrame:
+    """
+    Returns a block of random rows with the raw columns of a schema from schema_utils.lookup_schema().
+    """
+    columns = schema_utils.lookup_schema()[schema_type]
+    if schema_type == "Schema_9":
+        # The header of these exports is in the first data row, so the raw columns are named like Schema_8's
+        names = schema_utils.lookup_schema()["Schema_8"]
+    else:
+        names = columns
+    date_format = "%Y-%m-%d" if schema_type == "Schema_12" else "%d/%m/%Y"
+
+    df = pd.DataFrame({col: column_values(name, rng, rows, date_format) for col, name in zip(columns, names)})
+
+    # Orders not yet invoiced have no invoice date
+    for col in ["Date", "CompletedDate", "InvoiceDate"]:
+        if col in df.columns:
+            df.loc[rng.random(rows) < EMPTY_DATE_RATE, col] = None
+    return df
+
+def write_schema_file(schema_type, file_path, rows, seed=0) -> Path:
+    """
+    Write a raw CSV file of rows random rows in the layout of a schema, BLOCK_ROWS rows at a time.
+    :param schema_type: Schema key from schema_utils.lookup_schema(), e.g. "Schema_1".
+    :param file_path: Path of the CSV file to write.
+    :param rows: Number of data rows.
+    :param seed: Random seed.
+    :return file_path: Path of the written file.
+    """
+    rng = np.random.default_rng(seed)
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    columns = schema_utils.lookup_schema()[schema_type]
+    totals = None
+
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        f.write(pd.DataFrame(columns=columns).to_csv(index=False))
+        if schema_type == "Schema_9":
+            f.write(pd.DataFrame([schema_utils.lookup_schema()["Schema_8"]]).to_csv(index=False, header=False))
+
+        for start in range(0, rows, BLOCK_ROWS):
+            df = generate_schema_block(schema_type, min(BLOCK_ROWS, rows - start), rng)
+            if "Description" in df.columns and "Net_Sales" in df.columns:
+                block_totals = df[validation.REPORT_TOTALS_COLUMNS].sum()
+                totals = block_totals if totals is None else totals + block_totals
+            df.to_csv(f, index=False, header=False)
+
+        # Transactor reports end with a REPORT TOTALS row, which the preprocess functions reconcile and drop
+        if totals is not None:
+            total_row = {col: None for col in columns}
+            total_row.update(totals.to_dict(), Description=validation.REPORT_TOTALS_LABEL)
+            pd.DataFrame([total_row], columns=columns).to_csv(f, index=False, header=False)
+    return file_path
+
+ASHFORD_COLUMNS = [
+    "DR ID", "DOCTOR NAME", "PRACTICE", "CASE NUMBER", "STATUS", "DATE IN", "DUE DATE", "INVOICED DATE",
+    "PRODUCT ID", "PRODUCT DESC", "UNIT", "PRICE",
+]
+# Date range of each Ashford source, in the order of mysettings.ASHFORD_SOURCES
+ASHFORD_DATE_RANGES = [
+    ("2023-01-01", "2023-10-31"),
+    ("2022-01-01", "2022-12-31"),
+    ("2021-01-01", "2021-12-31"),
+    ("2024-01-01", "2024-04-30"),
+    ("2023-11-01", "2023-12-31"),
+]
+
+def generate_ashford_block(rows, rng, start, end) -> pd.DataFrame:
+    invoiced = random_dates(rng, rows, start, end)
+    created = invoiced - pd.to_timedelta(rng.integers(3, 20, rows), unit="D")
+    doctor = rng.integers(0, POOL_SIZES["customer"], rows)
+    invoiced = pd.Series(invoiced, dtype=object)
+    # Orders not yet invoiced have Excel's empty date, day zero, shown in 1899
+    invoiced[rng.random(rows) < PLACEHOLDER_DATE_RATE] = pd.Timestamp("1899-12-31")
+    products = make_pool("P", POOL_SIZES["product"])
+    product = rng.integers(0, POOL_SIZES["product"], rows)
+    return pd.DataFrame({
+        "DR ID": [f"D{i}" for i in doctor],
+        "DOCTOR NAME": make_pool("Dr", POOL_SIZES["customer"])[doctor],
+        "PRACTICE": make_pool("Practice", POOL_SIZES["practice"])[doctor % POOL_SIZES["practice"]],
+        "CASE NUMBER": rng.integers(100_000, 999_999, rows),
+        "STATUS": rng.choice(np.array(CHOICES["status"], dtype=object), rows),
+        "DATE IN": created,
+        "DUE DATE": created + pd.Timedelta(days=7),
+        "INVOICED DATE": invoiced,
+        "PRODUCT ID": [f"{code} " for code in products[product]],
+        "PRODUCT DESC": make_pool("Product", POOL_SIZES["product"])[product],
+        "UNIT": rng.integers(1, 6, rows),
+        "PRICE": [f"£{price:,.2f}" for price in rng.integers(500, 250_000, rows) / 100],
+    })
+
+def write_ashford_sources(folder, rows, seed=0) -> list:
+    """
+    Write the Ashford Labtrac exports declared in mysettings.ASHFORD_SOURCES, with rows split evenly across them.
+    Headerless sources are written without a header row, sources with add_dr_id without the DR ID column, and the
+    CSV source with day first date strings.
+    :return file_paths: Paths of the written files.
+    """
+    rng = np.random.default_rng(seed)
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    sources = mysettings.ASHFORD_SOURCES
+    source_rows = min(max(rows // len(sources), 1), EXCEL_MAX_ROWS)
+
+    file_paths = []
+    for source, (start, end) in zip(sources, ASHFORD_DATE_RANGES):
+        df = generate_ashford_block(source_rows, rng, start, end)
+        if source.get("add_dr_id"):
+            df = df.drop(columns="DR ID")
+        header = source.get("header", True)
+        file_path = folder / source["file_name"]
+        if file_path.suffix.lower() == ".csv":
+            for col in ["DATE IN", "DUE DATE", "INVOICED DATE"]:
+                df[col] = pd.to_datetime(df[col]).dt.strftime("%d/%m/%Y")
+            df.to_csv(file_path, index=False, header=header)
+        else:
+            df.to_excel(file_path, index=False, header=header)
+        file_paths.append(file_path)
+    return file_paths
+
+def write_ashford_price_list(file_path=None, seed=0) -> pd.DataFrame:
+    """
+    Returns a price list tagging every generated Ashford product code as NHS or Private, as used by
+    nhs_mapping.nhs_private_tag_ashford, and writes it to file_path if given.
+    """
+    rng = np.random.default_rng(seed)
+    price_list = pd.DataFrame({
+        "ProductID": make_pool("P", POOL_SIZES["product"]),
+        "Description": make_pool("Product", POOL_SIZES["product"]),
+        "Price 2024": rng.integers(500, 50_000, POOL_SIZES["product"]) / 100,
+        "Class": rng.choice(np.array(["NHS", "Private"], dtype=object), POOL_SIZES["product"]),
+    })
+    if file_path is not None:
+        price_list.to_csv(file_path, index=False)
+    return price_list
+
+def generate_densign_month(rows, rng, month: pd.Timestamp) -> pd.DataFrame:
+    """
+    Returns a monthly Evident report in its Excel template layout: a title block naming the month, the header on the
+    sixth row, and the customer columns filled only on the first row of each customer.
+    """
+    header = [
+        "Customer Code", "Dentist Name", "Practice Name", "Item", "Product Pieces", "Remake Pieces", "Revenue", "%",
+        "Alloy", "COGS Alloy", "Tax", "Total",
+    ]
+    # Some months name the customer column differently
+    if month.month % 3 == 1:
+        header[0] = "Customer Name"
+    elif month.month % 3 == 2:
+        header[0] = "Group"
+
+    customer = rng.integers(0, POOL_SIZES["customer"], rows)
+    first_row = np.arange(rows) % 5 == 0
+    practice = make_pool("Practice", POOL_SIZES["practice"])[customer % POOL_SIZES["practice"]]
+    # A few customers are the ALS labs themselves
+    practice[customer % 97 == 0] = "Veus Lab"
+    data = pd.DataFrame({
+        header[0]: np.where(first_row, customer, None),
+        "Dentist Name": np.where(first_row, make_pool("Dr", POOL_SIZES["customer"])[customer], None),
+        "Practice Name": np.where(first_row, practice, None),
+        "Item": [f" {item} " for item in make_pool("Item", POOL_SIZES["product"])[rng.integers(0, POOL_SIZES["product"], rows)]],
+        "Product Pieces": rng.integers(1, 6, rows),
+        "Remake Pieces": rng.integers(0, 2, rows),
+        "Revenue": rng.integers(1_000, 50_000, rows) / 100,
+        "%": 0.1,
+        "Alloy": 0,
+        "COGS Alloy": 0,
+        "Tax": 0,
+        "Total": rng.integers(1_000, 60_000, rows) / 100,
+    })
+
+    title = [[None] * len(header) for _ in range(6)]
+    title[1][0] = f"1 {month:%B %Y} - {month.days_in_month} {month:%B %Y}"
+    title[5] = header
+    data.columns = range(len(header))
+    df = pd.concat([pd.DataFrame(title), data], ignore_index=True)
+    df.columns = ["Densign Lab"] + [f"Unnamed: {i}" for i in range(1, len(header))]
+    return df
+
+def write_densign_months(folder, months, rows_per_month, seed=0) -> list:
+    """
+    Write months monthly Densign Evident reports from January 2021 onwards.
+    :return file_paths: Paths of the written files.
+    """
+    rng = np.random.default_rng(seed)
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rows_per_month = min(rows_per_month, EXCEL_MAX_ROWS - 6)
+
+    file_paths = []
+    for month in pd.date_range("2021-01-01", periods=months, freq="MS"):
+        file_path = folder / f"Densign {month:%Y-%m}.xlsx"
+        generate_densign_month(rows_per_month, rng, month).to_excel(file_path, index=False)
+        file_paths.append(file_path)
+    return file_paths
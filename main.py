@@ -1,42 +1,113 @@
-from utils import utils, pre_process
+import argparse
+from utils import utils, pre_process, validation
+from utils import mysettings, nhs_mapping, profiling
 
-# utils.get_excel_files()
+# Stages of the pipeline, in the order they run
+STAGES = ["excel", "preprocess", "validate", "ashford", "densign", "combine", "nhs"]
 
-# df = utils.get_csv_schema()
+def parse_args():
+    parser = argparse.ArgumentParser(description="ALS sales data pipeline")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="Stages to run, always in pipeline order (default: every stage)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes used to preprocess files (default: run serially)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Rebuild every output instead of only the files that changed since the last run",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["csv", "parquet"],
+        default=mysettings.OUTPUT_FORMAT,
+        help="Format of the pre-processed, combined and NHS mapping outputs",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=mysettings.PREPROCESS_CHUNKSIZE,
+        help="Preprocess raw files this many rows at a time to bound memory use (default: process files whole)",
+    )
+    parser.add_argument(
+        "--drop-overlap",
+        action="store_true",
+        default=mysettings.DEDUP_COMBINE,
+        help="Drop the rows of overlapping extracts when combining files, see mysettings.DEDUP_KEY_COLUMNS",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and write the stats to files/<raw folder>/profile.prof",
+    )
+    return parser.parse_args()
 
 
-# print("Starting preprocessing of files")
-# pre_process.preprocess(df)
+def main():
+    args = parse_args()
+    with profiling.cprofile(enabled=args.profile):
+        run(args)
+    # Wall time, CPU time, rows and peak RSS of each stage, file and preprocess function
+    profiling.write_run_report()
 
-# print("Starting preprocessing of Ashford files")
-# pre_process.preprocess_ashford()
 
-# print("Starting preprocessing of Densign files")
-# pre_process.preprocess_densign()
+def run(args):
+    incremental = not args.full
+    stages = set(args.stages)
 
-# print("Starting combining of files")
-# pre_process.combine_preprocess()
+    if "excel" in stages:
+        print("Converting Excel files to CSV")
+        utils.get_excel_files(incremental=incremental)
 
-########################################################################################################################
-# NHS mapping process start ####
-########################################################################################################################
-from pathlib import Path
-from utils import mysettings, nhs_mapping
+    if "preprocess" in stages or "validate" in stages:
+        df = utils.get_csv_schema()
 
-nhs_mapping_folder = Path(mysettings.NHS_MAPPING_FOLDER)
-nhs_mapping_folder.mkdir(parents=True, exist_ok=True)  
+    if "preprocess" in stages:
+        print("Starting preprocessing of files")
+        pre_process.preprocess(
+            df, workers=args.workers, incremental=incremental, output_format=args.output_format,
+            chunksize=args.chunksize,
+        )
 
-print("Generating NHS mapping data for aesthetic_world")
-aesthetic_world_nhs_codes = mysettings.AESTHETIC_WORLD_NHS_CODE_DATA
-aesthetic_world_private_codes = mysettings.AESTHETIC_WORLD_PRIVATE_CODE_DATA
-df = nhs_mapping.preprocess_aesthetic_world_nhs_private_mapping(aesthetic_world_nhs_codes,aesthetic_world_private_codes)
-mapping_output_file = f"{nhs_mapping_folder}/aesthetic_world.csv" 
-df.to_csv(mapping_output_file, index=False)
+    if "validate" in stages:
+        print("Starting validation of files")
+        validation.validate(df)
 
-print("Generating NHS mapping data for woodford")
-woodford_price_list = mysettings.WOODFORD_PRICE_LIST
-df = nhs_mapping.preprocess_woodford_nhs_private_mapping(woodford_price_list)
-mapping_output_file = f"{nhs_mapping_folder}/woodford.csv" 
-df.to_csv(mapping_output_file, index=False)
+    if "ashford" in stages:
+        print("Starting preprocessing of Ashford files")
+        pre_process.preprocess_ashford(output_format=args.output_format)
 
-ashford_price_list = mysettings.ASHFORD_PRICE_LIST
\ No newline at end of file
+    if "densign" in stages:
+        print("Starting preprocessing of Densign files")
+        pre_process.preprocess_densign(output_format=args.output_format)
+
+    if "combine" in stages:
+        print("Starting combining of files")
+        pre_process.combine_preprocess(
+            incremental=incremental, output_format=args.output_format, drop_overlap=args.drop_overlap
+        )
+
+    ########################################################################################################################
+    # NHS mapping process start ####
+    ########################################################################################################################
+    if "nhs" in stages:
+        # The price lists are only compiled again when they change
+        print("Compiling NHS mapping data")
+        nhs_mapping.compile_mappings(output_format=args.output_format)
+
+        print("Tagging combined files")
+        nhs_mapping.tag_combined_files(output_format=args.output_format)
+
+
+# The process pool used by pre_process.preprocess re-imports this module in every worker on Windows, so the
+# pipeline must only run when the script is executed directly
+if __name__ == "__main__":
+    main()
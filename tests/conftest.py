@@ -0,0 +1,15 @@
+from pathlib import Path
+import sys
+import pytest
+
+# The pipeline is run from the repository root, which is where the utils package is imported from
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Run a test from an empty folder, so the data/ and files/ outputs the pipeline writes relative to the working
+    directory (manifest, caches, reports) never touch the repository.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
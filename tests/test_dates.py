@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+from utils import dates, mysettings
+
+@pytest.fixture(autouse=True)
+def clear_date_state():
+    dates.date_format_cache.clear()
+    dates.date_stats.clear()
+    yield
+    dates.date_format_cache.clear()
+    dates.date_stats.clear()
+
+def test_ambiguous_dates_are_read_day_first():
+    assert dates.infer_date_format(["01/02/2024", "03/04/2024"]) == "%d/%m/%Y"
+    parsed = dates.parse_dates(pd.Series(["01/02/2024", "03/04/2024"]), "Lab", "date")
+    assert parsed.tolist() == [pd.Timestamp("2024-02-01"), pd.Timestamp("2024-04-03")]
+
+def test_month_first_dates_fall_back_to_a_month_first_format():
+    assert dates.infer_date_format(["12/25/2024", "01/02/2024"]) == "%m/%d/%Y"
+
+def test_iso_dates_are_not_read_day_first():
+    assert dates.infer_date_format(["2024-01-02", "2024-12-31"]) == "%Y-%m-%d"
+
+def test_given_formats_are_tried_first():
+    assert dates.infer_date_format(["01/02/2024"], formats=["%m/%d/%Y"]) == "%m/%d/%Y"
+
+def test_sentinels_bad_values_and_empty_values_become_nat():
+    values = pd.Series(["01/02/2024", "00/01/1900", "31/12/1899", "not a date", None])
+    parsed = dates.parse_dates(values, "Lab", "date")
+
+    assert parsed.iloc[0] == pd.Timestamp("2024-02-01")
+    assert parsed.iloc[1:].isna().all()
+    assert dates.date_stats[("Lab", "date")] == {"values": 2, "sentinels": 2, "failed": 1}
+
+def test_sentinel_datetimes_are_detected():
+    values = pd.Series(pd.to_datetime(["1899-12-31", "2024-01-02"]))
+    assert dates.is_sentinel_date(values).tolist() == [True, False]
+
+def test_cached_format_is_reused_for_later_chunks():
+    dates.parse_dates(pd.Series(["13/02/2024"]), "Lab", "date")
+    # 01/02/2024 alone reads either way, the cached day first format is kept
+    parsed = dates.parse_dates(pd.Series(["01/02/2024"]), "Lab", "date")
+    assert parsed.iloc[0] == pd.Timestamp("2024-02-01")
+    assert dates.date_format_cache[("Lab", "date")] == "%d/%m/%Y"
+
+def test_failed_dates_are_dropped_up_to_the_allowed_rate(monkeypatch):
+    monkeypatch.setattr(mysettings, "DATE_MAX_FAILURE_RATE", 0.25)
+    failed = pd.Series([False, True, False, False])
+    assert dates.drop_failed_dates(failed, "Lab", "date").tolist() == [True, False, True, True]
+
+    with pytest.raises(ValueError):
+        dates.drop_failed_dates(pd.Series([True, True, False, False]), "Lab", "date")
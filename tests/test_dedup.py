@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks import generators
+from utils import dedup, io_utils, pre_process, pre_process_function, schema_utils, mysettings
+
+def make_sales(als_lab, start, rows) -> pd.DataFrame:
+    return pd.DataFrame({
+        "als_lab": als_lab,
+        "order_id": [f"O{i}" for i in range(start, start + rows)],
+        "order_invoiced_date": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(start, start + rows), "D"),
+        "customer_id": [i % 7 for i in range(start, start + rows)],
+        "product_code": "CR1",
+        "quantity": 1.0,
+        "net_sales": 10.25,
+    })
+
+def test_whole_numbers_normalize_the_same_as_integers():
+    assert dedup.normalize_text(pd.Series([123.0, 4.5, None])).tolist() == ["123", "4.5", ""]
+    assert dedup.normalize_text(pd.Series([123, 5])).tolist() == ["123", "5"]
+    assert dedup.normalize_text(pd.Series([" CR1 ", None])).tolist() == ["CR1", ""]
+
+def test_business_key_hashes_are_the_same_after_a_csv_round_trip(tmp_path):
+    df = make_sales("Lab", 0, 5)
+    df.loc[0, "customer_id"] = None
+    read_back = io_utils.read_frame(io_utils.write_frame(df, tmp_path / "sales", "csv"))
+    np.testing.assert_array_equal(dedup.get_business_key_hashes(read_back), dedup.get_business_key_hashes(df))
+
+def test_overlapping_rows_of_later_files_are_dropped():
+    dedup_index = dedup.DedupIndex("labtrac", index_file="unused.npz")
+    first = make_sales("Lab", 0, 10)
+    # Repeats of a sale within one file are all kept
+    first = pd.concat([first, first.iloc[[0]]], ignore_index=True)
+    assert dedup_index.keep_mask(first, "first.csv").all()
+
+    second = make_sales("Lab", 5, 10)
+    assert dedup_index.keep_mask(second, "second.csv").tolist() == [False] * 5 + [True] * 5
+    # Two copies of the repeated sale were seen, so only a third copy in another file is new
+    assert dedup_index.keep_mask(first.iloc[[0, 10, 0]], "third.csv").tolist() == [False, False, True]
+
+    stats = dedup_index.stats["Lab"]
+    assert (stats["files"], stats["rows_in"], stats["duplicate_rows"]) == (3, 24, 7)
+    assert stats["overlapping_files"] == ["second.csv", "third.csv"]
+
+def test_labs_are_deduplicated_separately():
+    dedup_index = dedup.DedupIndex("labtrac", index_file="unused.npz")
+    dedup_index.keep_mask(make_sales("Lab A", 0, 5))
+    assert dedup_index.keep_mask(make_sales("Lab B", 0, 5)).all()
+
+def test_sales_of_different_orders_are_kept():
+    dedup_index = dedup.DedupIndex("labtrac", index_file="unused.npz")
+    dedup_index.keep_mask(make_sales("Lab", 0, 5))
+    other_orders = make_sales("Lab", 0, 5).assign(order_id=lambda df: df["order_id"] + "-B")
+    assert dedup_index.keep_mask(other_orders).all()
+
+def test_saved_index_carries_on_deduplicating(tmp_path):
+    index_file = tmp_path / "dedup_index" / "labtrac.npz"
+    dedup_index = dedup.DedupIndex("labtrac", index_file=index_file)
+    dedup_index.keep_mask(make_sales("Lab A", 0, 5))
+    dedup_index.keep_mask(make_sales("Lab B", 0, 5))
+    dedup_index.save()
+
+    loaded = dedup.DedupIndex.load("labtrac", index_file)
+    assert loaded.keep_mask(make_sales("Lab A", 3, 4)).tolist() == [False, False, True, True]
+    assert loaded.keep_mask(make_sales("Lab B", 5, 1)).tolist() == [True]
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_incremental_combine_matches_a_full_rebuild(workdir, output_format):
+    folder = workdir / "data" / "pre_processed" / "sales" / "labtrac" / "Lab"
+    folder.mkdir(parents=True)
+    io_utils.write_frame(make_sales("Lab", 0, 20), folder / "yearly", output_format)
+    io_utils.write_frame(make_sales("Lab", 10, 5), folder / "month_1", output_format)
+    pre_process.combine_preprocess(incremental=True, output_format=output_format, drop_overlap=True)
+
+    io_utils.write_frame(make_sales("Lab", 18, 6), folder / "month_2", output_format)
+    pre_process.combine_preprocess(incremental=True, output_format=output_format, drop_overlap=True)
+    combined_file = io_utils.get_output_file(
+        workdir / "data" / "pre_processed_combined" / "sales" / "combined_labtrac", output_format
+    )
+    incremental = io_utils.read_frame(combined_file)
+
+    pre_process.combine_preprocess(incremental=False, output_format=output_format, drop_overlap=True)
+    rebuilt = io_utils.read_frame(combined_file)
+
+    assert len(incremental) == 24
+    assert sorted(incremental["order_id"]) == sorted(rebuilt["order_id"])
+    report = pd.read_csv(workdir / "files" / "sales" / "dedup_report.csv")
+    assert report["duplicate_rows"].tolist() == [7]
+
+def make_labtrac_export(orders) -> pd.DataFrame:
+    # The same crown for the same dentist on the same day, once per order
+    columns = schema_utils.lookup_schema()["Schema_1"]
+    return pd.DataFrame([
+        {"Order": order, "Code": 7, "Name": "Dr A", "Date": "01/02/2024", "Product Link": "CR1",
+         "Description": "Crown", "Value": 100.0, "Qty": 1, "Category": "Fixed", "Standard": "NHS"}
+        for order in orders
+    ]).reindex(columns=columns)
+
+def test_identical_lines_of_different_orders_are_kept():
+    first = pre_process_function.preprocess_labtrac_new(make_labtrac_export([1001]), "Lab", "yearly.csv")
+    second = pre_process_function.preprocess_labtrac_new(make_labtrac_export([1001, 1002]), "Lab", "month_1.csv")
+    assert second["order_id"].tolist() == [1001, 1002]
+
+    dedup_index = dedup.DedupIndex("labtrac", index_file="unused.npz")
+    assert dedup_index.keep_mask(first, "yearly.csv").tolist() == [True]
+    assert dedup_index.keep_mask(second, "month_1.csv").tolist() == [False, True]
+
+def test_ashford_output_has_order_ids(workdir, monkeypatch):
+    monkeypatch.setattr(mysettings, "ASHFORD_FOLDER_PATH", str(workdir / "ashford"))
+    generators.write_ashford_sources(workdir / "ashford", 50, seed=1)
+    prep_data = pre_process_function.preprocess_labtrac_ashford()
+    assert "order_id" in prep_data.columns
+    assert prep_data["order_id"].notna().all()
+    assert set(mysettings.DEDUP_KEY_COLUMNS) & set(prep_data.columns) >= {"order_id", "order_invoiced_date"}
@@ -0,0 +1,61 @@
+import datetime
+import re
+import zipfile
+import pandas as pd
+from openpyxl import Workbook
+from utils import utils
+
+def write_workbook(file, rows, dimension=None):
+    """
+    Write a workbook with one sheet of rows. If dimension is given, the sheet size stored in the file is replaced by
+    it, as some exporters write a wrong one.
+    """
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(row)
+    wb.save(file)
+    if dimension is None:
+        return
+
+    with zipfile.ZipFile(file) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    sheet = parts["xl/worksheets/sheet1.xml"].decode("utf-8")
+    parts["xl/worksheets/sheet1.xml"] = re.sub(r'<dimension ref="[^"]*"', f'<dimension ref="{dimension}"', sheet).encode()
+    with zipfile.ZipFile(file, "w") as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+def test_sheet_is_converted_like_read_excel(tmp_path):
+    rows = [["Code", "Name", None, "Code"], [1, "Dr A", None, 2], [None, None, None, None], [3, None, "x", 4]]
+    write_workbook(tmp_path / "sales.xlsx", rows + [[None] * 4, [None] * 4])
+
+    csv_files = utils.xlsx_sheets_to_csv(tmp_path / "sales.xlsx", tmp_path)
+    converted = pd.read_csv(csv_files[0])
+    pd.testing.assert_frame_equal(converted, pd.read_excel(tmp_path / "sales.xlsx"), check_dtype=False)
+    assert list(converted.columns) == ["Code", "Name", "Unnamed: 2", "Code.1"]
+
+def test_rows_and_columns_past_a_wrong_sheet_size_are_kept(tmp_path):
+    rows = [["Code", "Name", "Value"], [1, "Dr A", 10.0], [2, "Dr B", 20.0], [3, "Dr C", None]]
+    write_workbook(tmp_path / "sales.xlsx", rows, dimension="A1:B2")
+
+    converted = pd.read_csv(utils.xlsx_sheets_to_csv(tmp_path / "sales.xlsx", tmp_path)[0])
+    assert list(converted.columns) == ["Code", "Name", "Value"]
+    assert converted["Code"].tolist() == [1, 2, 3]
+    assert converted["Value"].tolist()[:2] == [10.0, 20.0]
+
+def test_values_are_written_like_read_excel_to_csv(tmp_path):
+    rows = [
+        ["Code", "Qty", "Value", "Ref", "Invoiced", "Created", "Due", "Note", "Standard"],
+        [1, 5, 1, "A12", datetime.datetime(2024, 1, 2), datetime.datetime(2024, 1, 2, 10, 30), None, 3, True],
+        [2, None, 2.5, 7, datetime.datetime(2024, 1, 3), datetime.datetime(2024, 1, 3), None, "NA", False],
+        [None] * 9,
+        [3, 7, 3.0, 8.0, datetime.datetime(2024, 1, 4), datetime.datetime(2024, 1, 4), None, "#N/A", True],
+    ]
+    write_workbook(tmp_path / "sales.xlsx", rows)
+
+    csv_file = utils.xlsx_sheets_to_csv(tmp_path / "sales.xlsx", tmp_path)[0]
+    with open(csv_file, "r", encoding="utf-8", newline="") as f:
+        converted = f.read()
+    assert converted == pd.read_excel(tmp_path / "sales.xlsx").to_csv(index=False)
+    # Whole numbers of columns read as floats keep their decimal part, and dates without a time are written as dates
+    assert converted.splitlines()[1] == "1.0,5.0,1.0,A12,2024-01-02,2024-01-02 10:30:00,,3.0,1.0"
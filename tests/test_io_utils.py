@@ -0,0 +1,94 @@
+import os
+import pandas as pd
+import pytest
+from utils import io_utils
+
+def make_sales(rows=6) -> pd.DataFrame:
+    return pd.DataFrame({
+        "order_uuid": [f"id-{i}" for i in range(rows)],
+        "als_lab": ["Woodford"] * rows,
+        "customer_id": [f"C{100 + i}" for i in range(rows)],
+        "order_invoiced_date": pd.to_datetime(["2024-01-02"] * rows),
+        "product_code": [f"P{i % 3}" for i in range(rows)],
+        "quantity": list(range(1, rows + 1)),
+        "net_sales": [10.5 * i for i in range(rows)],
+    })
+
+def assert_same_sales(df: pd.DataFrame, expected: pd.DataFrame):
+    assert list(df.columns) == list(expected.columns)
+    assert isinstance(df["als_lab"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(
+        df.astype({"als_lab": str, "order_invoiced_date": "datetime64[ns]"}),
+        expected.astype({"als_lab": str, "order_invoiced_date": "datetime64[ns]"}),
+        check_dtype=False,
+    )
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_write_frame_round_trip(tmp_path, output_format):
+    df = make_sales()
+    output_file = io_utils.write_frame(df, tmp_path / "sales", output_format)
+    assert output_file.endswith(io_utils.OUTPUT_FORMAT_SUFFIX[output_format])
+    assert_same_sales(io_utils.read_frame(output_file), df)
+    assert io_utils.read_columns(output_file) == list(df.columns)
+
+def test_unsupported_output_format_is_rejected():
+    with pytest.raises(ValueError):
+        io_utils.get_output_format("xlsx")
+
+def test_make_arrow_compatible_converts_mixed_columns_to_strings():
+    df = pd.DataFrame({"customer_id": pd.Series([123, "A12", None], dtype=object), "quantity": [1, 2, 3]})
+    converted = io_utils.make_arrow_compatible(df)
+    assert converted["customer_id"].tolist()[:2] == ["123", "A12"]
+    assert converted["customer_id"].isna().tolist() == [False, False, True]
+    assert df["customer_id"].tolist()[0] == 123
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_chunked_writer_matches_whole_frame(tmp_path, output_format):
+    df = make_sales(10)
+    with io_utils.ChunkedFrameWriter(tmp_path / "sales", output_format) as writer:
+        for start in range(0, len(df), 4):
+            writer.write(df.iloc[start:start + 4])
+    assert writer.rows == len(df)
+    assert_same_sales(io_utils.read_frame(writer.output_file), df)
+
+    chunks = list(io_utils.read_frame_chunks(writer.output_file, 3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert_same_sales(pd.concat(chunks, ignore_index=True), df)
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_chunked_writer_leaves_nothing_on_failure(tmp_path, output_format):
+    with pytest.raises(RuntimeError):
+        with io_utils.ChunkedFrameWriter(tmp_path / "sales", output_format) as writer:
+            writer.write(make_sales())
+            raise RuntimeError("preprocessing failed")
+    assert os.listdir(tmp_path) == []
+
+def test_concat_to_parquet_promotes_types_across_files(tmp_path):
+    first = io_utils.write_frame(pd.DataFrame({"quantity": [1, 2]}), tmp_path / "first", "parquet")
+    second = io_utils.write_frame(pd.DataFrame({"quantity": [1.5], "net_sales": [3.0]}), tmp_path / "second", "csv")
+    output_file = tmp_path / "combined.parquet"
+
+    assert io_utils.concat_to_parquet([first, second], output_file) == 3
+    df = pd.read_parquet(output_file)
+    assert df["quantity"].tolist() == [1.0, 2.0, 1.5]
+    assert df["net_sales"].isna().tolist() == [True, True, False]
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_codes_keep_leading_zeros(tmp_path, output_format):
+    df = pd.DataFrame({
+        "customer_id": ["0042", "0043", "0044"],
+        "product_code": ["0012", "0013", "12"],
+        "product_description": ["001", "Crown", "Bridge"],
+        "quantity": [1, 2, 3],
+    })
+    output_file = io_utils.write_frame(df, tmp_path / "sales", output_format)
+
+    read_back = io_utils.read_frame(output_file)
+    assert read_back["product_code"].tolist() == ["0012", "0013", "12"]
+    assert read_back["customer_id"].tolist() == ["0042", "0043", "0044"]
+    assert read_back["product_description"].tolist() == ["001", "Crown", "Bridge"]
+    assert read_back["quantity"].tolist() == [1, 2, 3]
+
+    # A chunk holding only numeric looking codes still reads them as strings
+    chunks = list(io_utils.read_frame_chunks(output_file, 2))
+    assert [chunk["product_code"].tolist() for chunk in chunks] == [["0012", "0013"], ["12"]]
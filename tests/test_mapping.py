@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+from benchmarks import generators
+from utils import mapping, pre_process_function, schema_utils, dates, validation
+
+# Schema_6 exports have 9 columns, which preprocess_transactor rejects as it checks for the 15 of Schema_5
+SCHEMAS = [key for key in pre_process_function.lookup_preprocess_function if key != "Schema_6"]
+
+@pytest.fixture(autouse=True)
+def clear_date_formats():
+    dates.date_format_cache.clear()
+    yield
+    dates.date_format_cache.clear()
+
+def make_labtrac_export() -> pd.DataFrame:
+    columns = schema_utils.lookup_schema()["Schema_1"]
+    rows = [
+        {"Code": 7, "Name": " Dr A ", "Date": "01/02/2024", "Product Link": " CR1 ", "Description": "Crown",
+         "Value": 100.0, "Qty": 2, "Category": "Fixed", "Standard": "NHS", "Delivery 5": "SW1A 1AA"},
+        {"Code": 8, "Name": "Dr B", "Date": "13/02/2024", "Product Link": "DN2", "Description": "Denture",
+         "Value": 30.0, "Qty": 3, "Category": "Removable", "Standard": "Private"},
+        # Not yet invoiced: an empty date and a placeholder date
+        {"Code": 9, "Name": "Dr C", "Date": None, "Product Link": "CR1", "Value": 10.0, "Qty": 1},
+        {"Code": 9, "Name": "Dr C", "Date": "00/01/1900", "Product Link": "CR1", "Value": 10.0, "Qty": 1},
+    ]
+    return pd.DataFrame(rows).reindex(columns=columns)
+
+def test_labtrac_export_is_mapped_to_the_preprocessed_columns():
+    prep_data = pre_process_function.preprocess_labtrac_new(make_labtrac_export(), "Lab", "export.csv")
+
+    assert list(prep_data.columns) == pre_process_function.LABTRAC_NEW_MAPPING["output_columns"]
+    assert len(prep_data) == 2
+    assert prep_data["order_invoiced_date"].tolist() == [pd.Timestamp("2024-02-01"), pd.Timestamp("2024-02-13")]
+    assert prep_data["customer_name"].tolist() == ["Dr A", "Dr B"]
+    assert prep_data["product_code"].tolist() == ["CR1", "DN2"]
+    assert prep_data["unit_net_price"].tolist() == [50.0, 10.0]
+    assert (prep_data["system_source"] == "Labtrac").all() and (prep_data["als_lab"] == "Lab").all()
+    assert prep_data["order_uuid"].is_unique
+
+def test_transactor_report_is_mapped_without_its_totals_row():
+    columns = schema_utils.lookup_schema()["Schema_5"]
+    raw_data = pd.DataFrame([
+        {"Year": 2024, "Month": 3, "ShipID": None, "CustID": 5, "code": " CR1 ", "Description": "Crown", "Qty": 2.0,
+         "Net_Sales": 100.0, "Tax_Sales": 0.0},
+        {"Year": 2024, "Month": 4, "ShipID": 3, "ShipFullName": "Practice", "CustID": 6, "CustFullName": "Dr B",
+         "code": "DN2", "Description": "Denture", "Qty": 1.0, "Net_Sales": 30.0, "Tax_Sales": 6.0},
+        {"Description": validation.REPORT_TOTALS_LABEL, "Qty": 3.0, "Net_Sales": 130.0, "Tax_Sales": 6.0},
+    ]).reindex(columns=columns)
+    prep_data = pre_process_function.preprocess_transactor(raw_data, "Lab", "report.csv")
+
+    assert list(prep_data.columns) == pre_process_function.TRANSACTOR_MAPPING["output_columns"]
+    assert prep_data["year_month"].tolist() == [pd.Timestamp("2024-03-01"), pd.Timestamp("2024-04-01")]
+    assert prep_data["ship_id"].tolist() == [0, 3]
+    assert prep_data["ship_name"].tolist() == ["Unknown", "Practice"]
+    assert prep_data["customer_name"].tolist() == ["Unknown", "Dr B"]
+    assert prep_data["product_code"].tolist() == ["CR1", "DN2"]
+    assert prep_data["net_sales"].tolist() == [100.0, 30.0]
+
+def test_optional_column_with_empty_values_is_dropped():
+    raw_data = make_labtrac_export()
+    raw_data.loc[1, "Category"] = None
+    prep_data = pre_process_function.preprocess_labtrac_new(raw_data, "Lab", "export.csv")
+    assert "product_category" not in prep_data.columns
+
+def test_row_ids_are_deterministic_per_source_file():
+    first = pre_process_function.preprocess_labtrac_new(make_labtrac_export(), "Lab", "export.csv")
+    again = pre_process_function.preprocess_labtrac_new(make_labtrac_export(), "Lab", "export.csv")
+    other = pre_process_function.preprocess_labtrac_new(make_labtrac_export(), "Lab", "other.csv")
+    assert first["order_uuid"].tolist() == again["order_uuid"].tolist()
+    assert set(first["order_uuid"]).isdisjoint(other["order_uuid"])
+
+def test_source_usecols_include_columns_only_read_by_a_step():
+    spec = {
+        "system_source": "Test",
+        "rename": {"Raw Date": "order_invoiced_date", "Raw Code": "product_code", "Raw Category": "category"},
+        "strip": ["product_code"],
+        "dates": {"order_invoiced_date": []},
+        "optional_columns": ["category"],
+        "row_id": "order_uuid",
+        "output_columns": ["order_uuid", "als_lab", "quantity"],
+    }
+    assert mapping.get_source_usecols(spec) == {"Raw Date", "Raw Code", "Raw Category", "quantity"}
+    for col in ["order_invoiced_date", "product_code", "category"]:
+        assert mapping.is_input_column(col, spec)
+    assert not mapping.is_input_column("quantity", spec)
+
+@pytest.mark.parametrize("schema_type", SCHEMAS)
+def test_chunked_preprocessing_matches_whole_file(tmp_path, schema_type):
+    file_path = generators.write_schema_file(schema_type, tmp_path / f"{schema_type}.csv", 300, seed=1)
+
+    whole, func_name = pre_process_function.preprocess(file_path, schema_type, "Lab")
+    chunks, chunked_func_name = pre_process_function.preprocess(file_path, schema_type, "Lab", chunksize=70)
+    chunked = pd.concat(list(chunks), ignore_index=True)
+    id_column = pre_process_function.lookup_mapping_spec[func_name]["row_id"]
+
+    assert chunked_func_name == func_name
+    assert len(whole) > 0 and whole[id_column].is_unique
+    pd.testing.assert_frame_equal(chunked, whole.reset_index(drop=True), check_dtype=False, check_categorical=False)
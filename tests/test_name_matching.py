@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from utils import name_matching
+
+TERMS = ["central dental", "central dental lab", "veus", "a plus"]
+
+def test_longest_term_is_reported():
+    matches = name_matching.match_names(pd.Series(["Central Dental Lab Ltd", "CENTRAL DENTAL"]), TERMS)
+    assert matches.tolist() == ["central dental lab", "central dental"]
+
+def test_terms_are_matched_as_literal_substrings():
+    matches = name_matching.match_names(pd.Series(["A Plus Dental", "Aplus", "Dr Veus (a.plus)"]), TERMS)
+    assert matches.tolist() == ["a plus", np.nan, "veus"]
+
+def test_empty_values_match_nothing():
+    values = pd.Series(["Veus Lab", None, np.nan, "Veus Lab"], index=[10, 11, 12, 13])
+    matches = name_matching.match_names(values, TERMS)
+    assert matches.index.tolist() == [10, 11, 12, 13]
+    assert matches.tolist() == ["veus", np.nan, np.nan, "veus"]
+
+def test_match_from_the_first_column_with_a_match():
+    df = pd.DataFrame({
+        "customer_name": ["Veus Lab", "Dr Smith", "Dr Jones"],
+        "practice_name": ["Central Dental", "A Plus", "High Street"],
+    })
+    matches = name_matching.match_name_columns(df, ["customer_name", "practice_name"], TERMS)
+    assert matches.tolist() == ["veus", "a plus", np.nan]
+
+def test_default_terms_are_the_als_lab_names():
+    assert name_matching.match_names(pd.Series(["Densign Ltd"])).tolist() == ["densign"]
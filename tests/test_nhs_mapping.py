@@ -0,0 +1,100 @@
+import pandas as pd
+import pytest
+from utils import nhs_mapping, mysettings, io_utils
+
+MAPPINGS = {
+    "woodford": pd.DataFrame({
+        "product_code": ["P1", "P2", "P1", "RISIO-1", "0012"],
+        "nhs_or_private_mapping": ["NHS", "Private", "Private", "NHS", "NHS"],
+    }),
+    "aesthetic_world": pd.DataFrame({"product_code": [12.0, 13.0], "nhs_or_private_mapping": ["Private", "NHS"]}),
+}
+
+@pytest.fixture
+def tagging_index():
+    return nhs_mapping.build_tagging_index(MAPPINGS)
+
+def make_sale(**values) -> dict:
+    return {
+        "als_lab": "Woodford", "product_code": "X9", "customer_name": "Dr Smith", "practice_name": "High Street",
+        "practice_address_postcode": "B1 1AA", "product_description": "Crown", **values,
+    }
+
+def test_tagging_index_keeps_the_first_tag_of_a_repeated_code(tagging_index):
+    assert tagging_index[("woodford", "P1")] == "NHS"
+    assert tagging_index[("aesthetic_world", "12")] == "Private"
+    assert len(tagging_index) == 6
+
+def test_lab_names_and_keys_give_the_same_lab_key():
+    als_lab = pd.Series(["Woodford", "woodford", "Woodford Dental Services", "Aesthetic World", "New Lab"])
+    assert nhs_mapping.get_lab_keys(als_lab).tolist() == [
+        "woodford", "woodford", "woodford", "aesthetic_world", "new_lab",
+    ]
+
+def test_tag_precedence(tagging_index, monkeypatch):
+    monkeypatch.setattr(mysettings, "TAGGING_DESCRIPTION_RULES", {"RISIO": "Private"})
+    sales = pd.DataFrame([
+        # An ALS lab name or exact postcode wins over the price list
+        make_sale(product_code="P1", customer_name="Veus Lab"),
+        make_sale(product_code="P1", practice_address_postcode="da2 6nx"),
+        # An outward postcode match alone is not tagged, by default
+        make_sale(product_code="P1", practice_address_postcode="DA2 1ZZ"),
+        # The price list wins over the description rules
+        make_sale(product_code="RISIO-1", product_description="RISIO aligner"),
+        make_sale(product_code="P2"),
+        # Codes read as numbers match the price list's codes
+        make_sale(als_lab="Aesthetic World", product_code=12),
+        make_sale(product_description="RISIO aligner"),
+        make_sale(),
+        # Price list codes only tag sales of their own lab
+        make_sale(als_lab="Aesthetic World", product_code="P2"),
+    ])
+
+    tagged = nhs_mapping.tag_sales(sales, tagging_index)
+    assert tagged["nhs_private_tag"].tolist() == [
+        "ALS Lab", "ALS Lab", "NHS", "NHS", "Private", "Private", "Private", "Unknown", "Unknown",
+    ]
+    assert tagged["als_postcode_match"].fillna("").tolist() == ["", "exact", "outward", "", "", "", "", "", ""]
+
+def test_sales_without_name_postcode_or_description_columns_are_tagged(tagging_index):
+    sales = pd.DataFrame({"als_lab": ["Woodford", "Woodford"], "product_code": ["P2", "X9"]})
+    assert nhs_mapping.get_tags(sales, tagging_index).tolist() == ["Private", "Unknown"]
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_chunked_tagging_matches_whole_file(tmp_path, tagging_index, output_format):
+    sales = pd.DataFrame([
+        make_sale(product_code=code, customer_name=name, practice_address_postcode=postcode)
+        for code, name, postcode in zip(
+            ["P1", "P2", "X9", "RISIO-1", "P1", "P2", "X9"] * 3,
+            ["Dr A", "Veus Lab", "Dr B", "Dr C", "Dr D", "Dr E", "Dr F"] * 3,
+            ["B1 1AA", "B1 1AA", "DA2 6NX", "DA2 1ZZ", None, "B2 2BB", "B3 3CC"] * 3,
+        )
+    ])
+    combined_file = io_utils.write_frame(sales, tmp_path / "combined_labtrac", output_format)
+
+    whole_file, whole_counts, whole_matches = nhs_mapping.tag_file(
+        combined_file, tmp_path / "whole", tagging_index, chunksize=len(sales), output_format=output_format
+    )
+    chunked_file, chunked_counts, chunked_matches = nhs_mapping.tag_file(
+        combined_file, tmp_path / "chunked", tagging_index, chunksize=4, output_format=output_format
+    )
+
+    pd.testing.assert_frame_equal(io_utils.read_frame(chunked_file), io_utils.read_frame(whole_file))
+    pd.testing.assert_series_equal(chunked_counts.sort_index(), whole_counts.sort_index())
+    pd.testing.assert_frame_equal(chunked_matches, whole_matches, check_dtype=False)
+    assert whole_counts.sum() == len(sales)
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_chunked_tagging_keeps_leading_zeros(tmp_path, tagging_index, output_format):
+    sales = pd.DataFrame([make_sale(product_code=code) for code in ["0012", "0012", "0012", "P2", "X9"]])
+    combined_file = io_utils.write_frame(sales, tmp_path / "combined_labtrac", output_format)
+
+    # With 3 rows per chunk the first chunk only holds numeric looking codes and the second mixes them
+    for chunksize in [3, len(sales)]:
+        tagged_file = nhs_mapping.tag_file(
+            combined_file, tmp_path / f"tagged_{chunksize}", tagging_index, chunksize=chunksize,
+            output_format=output_format,
+        )[0]
+        tagged = io_utils.read_frame(tagged_file)
+        assert tagged["product_code"].tolist() == ["0012", "0012", "0012", "P2", "X9"]
+        assert tagged["nhs_private_tag"].tolist() == ["NHS", "NHS", "NHS", "Private", "Unknown"]
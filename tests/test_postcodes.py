@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils import postcodes
+
+LABS = {
+    "lab_a": {"name": "Lab A", "postcode": "DY8 1AB"},
+    "lab_b": {"name": "Lab B", "postcode": "dy8 9zz"},
+    "lab_c": {"name": "Lab C", "postcode": "V94 KR04"},
+    "lab_d": {"name": "Lab D", "postcode": None},
+}
+
+@pytest.mark.parametrize("value, expected", [
+    ("SW1A 1AA", ("SW1A1AA", "SW1A", "1AA")),
+    (" sw1a-1aa ", ("SW1A1AA", "SW1A", "1AA")),
+    ("M1 1AE", ("M11AE", "M1", "1AE")),
+    ("CF14 5GH", ("CF145GH", "CF14", "5GH")),
+    ("V94 KR04", ("V94KR04", None, None)),
+    ("", (None, None, None)),
+    (None, (None, None, None)),
+    (np.nan, (None, None, None)),
+])
+def test_split_postcode(value, expected):
+    assert postcodes.split_postcode(value) == expected
+
+def test_normalize_postcodes_is_aligned_to_the_values():
+    values = pd.Series(["dy8 1ab", None, "DY8 1AB"], index=[5, 6, 7])
+    normalized = postcodes.normalize_postcodes(values)
+    assert normalized.index.tolist() == [5, 6, 7]
+    assert normalized["postcode"].fillna("").tolist() == ["DY81AB", "", "DY81AB"]
+    assert normalized["outward"].fillna("").tolist() == ["DY8", "", "DY8"]
+
+def test_lab_postcode_index_skips_labs_without_a_postcode():
+    lab_postcodes = postcodes.build_lab_postcode_index(LABS)
+    assert lab_postcodes["als_lab_key"].tolist() == ["lab_a", "lab_b", "lab_c"]
+    assert lab_postcodes["postcode"].tolist() == ["DY81AB", "DY89ZZ", "V94KR04"]
+
+def test_exact_matches_come_before_outward_matches():
+    lab_postcodes = postcodes.build_lab_postcode_index(LABS)
+    values = pd.Series(["DY8 9ZZ", "DY8 5QQ", "v94kr04", "V94 KR05", "B1 1AA", None])
+    matches = postcodes.match_lab_postcodes(values, lab_postcodes)
+
+    assert matches["postcode_match"].fillna("").tolist() == ["exact", "outward", "exact", "", "", ""]
+    # Where labs share an outward code, the first lab is reported
+    assert matches["postcode_als_lab"].fillna("").tolist() == ["lab_b", "lab_a", "lab_c", "", "", ""]
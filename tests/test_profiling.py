@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from benchmarks import generators
+from utils import profiling, snapshot, pre_process, pre_process_function
+
+@pytest.fixture
+def stage_records():
+    profiling.clear_records()
+    yield profiling.stage_records
+    profiling.clear_records()
+
+def test_repeated_stages_are_added_together(stage_records):
+    for rows in [3, 4]:
+        with profiling.stage("transform", "sales.csv", "preprocess_labtrac") as counts:
+            counts["rows_out"] = rows
+    with profiling.stage("transform", "other.csv", "preprocess_labtrac"):
+        pass
+
+    totals = profiling.get_stage_totals(stage_records.values())
+    assert totals["transform"]["calls"] == 3
+    assert totals["transform"]["rows_out"] == 7
+    assert stage_records[("transform", "sales.csv", "preprocess_labtrac")]["calls"] == 2
+
+def test_worker_records_are_merged_once(workdir, stage_records):
+    # Records made in the main process before the pool starts, which forked workers inherit
+    with profiling.stage("schema"):
+        pass
+    files = generators.write_densign_months(workdir / "densign", 3, 20, seed=1)
+    snapshot.load_snapshots(files, pre_process_function.clean_densign_month, "densign", workers=2)
+
+    totals = profiling.get_stage_totals(stage_records.values())
+    assert totals["schema"]["calls"] == 1
+    assert totals["snapshot_build"]["calls"] == 3
+
+def test_preprocess_worker_records_are_merged_once(workdir, stage_records):
+    with profiling.stage("schema"):
+        pass
+    files = [
+        generators.write_schema_file("Schema_1", workdir / "raw" / "sales" / lab / "sales.csv", 30, seed=i)
+        for i, lab in enumerate(["Lab A", "Lab B"])
+    ]
+    file_with_schema = pd.DataFrame({
+        "file_name": files, "schema_type": "Schema_1", "als_lab": ["Lab A", "Lab B"],
+    })
+    report = pre_process.preprocess(file_with_schema, workers=2)
+    assert (report["status"] == "processed").all()
+
+    totals = profiling.get_stage_totals(stage_records.values())
+    assert totals["schema"]["calls"] == 1
+    assert totals["preprocess"]["calls"] == 1
+    assert totals["write"]["calls"] == 2
@@ -0,0 +1,52 @@
+import pandas as pd
+from utils import reference_store, manifest, mysettings
+
+def build_price_list(price_list, rows=None):
+    df = pd.read_csv(price_list)
+    if rows is not None:
+        df = df.iloc[rows[0]:rows[1]]
+    return df.assign(tag=lambda df: df["nhs_or_private"].str.upper())
+
+def write_price_list(file, rows):
+    pd.DataFrame({
+        "product_code": [f"P{i}" for i in range(rows)],
+        "nhs_or_private": ["nhs" if i % 2 else "private" for i in range(rows)],
+    }).to_csv(file, index=False)
+
+def test_reference_table_is_compiled_once(workdir):
+    price_list = workdir / "prices.csv"
+    write_price_list(price_list, 4)
+
+    df, rebuilt = reference_store.load_reference("lab", [price_list], build_price_list)
+    assert rebuilt and df["tag"].tolist() == ["PRIVATE", "NHS", "PRIVATE", "NHS"]
+    assert (workdir / reference_store.get_reference_file("lab")).exists()
+
+    cached, rebuilt = reference_store.load_reference("lab", [price_list], build_price_list)
+    assert not rebuilt
+    pd.testing.assert_frame_equal(cached, df)
+
+def test_reference_table_is_rebuilt_when_its_inputs_change(workdir, monkeypatch):
+    price_list = workdir / "prices.csv"
+    write_price_list(price_list, 4)
+    reference_store.load_reference("lab", [price_list], build_price_list)
+
+    write_price_list(price_list, 6)
+    df, rebuilt = reference_store.load_reference("lab", [price_list], build_price_list)
+    assert rebuilt and len(df) == 6
+
+    df, rebuilt = reference_store.load_reference("lab", [price_list], build_price_list, {"rows": [1, 3]})
+    assert rebuilt and df["product_code"].tolist() == ["P1", "P2"]
+
+    monkeypatch.setitem(mysettings.REFERENCE_VERSION, "lab", mysettings.REFERENCE_VERSION.get("lab", 1) + 1)
+    _, rebuilt = reference_store.load_reference("lab", [price_list], build_price_list, {"rows": [1, 3]})
+    assert rebuilt
+
+def test_reference_table_is_recorded_in_the_given_manifest(workdir):
+    price_list = workdir / "prices.csv"
+    write_price_list(price_list, 2)
+    pipeline_manifest = manifest.PipelineManifest()
+
+    reference_store.load_reference("lab", [price_list], build_price_list, pipeline_manifest=pipeline_manifest)
+    assert pipeline_manifest.get("reference", "lab")["output_file"] == reference_store.get_reference_file("lab")
+    # Saving is left to the caller
+    assert not manifest.get_manifest_file().exists()
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from utils import row_id
+
+def make_sales() -> pd.DataFrame:
+    return pd.DataFrame({
+        "order_invoiced_date": pd.to_datetime(["2024-01-02", "2024-01-02", "2024-01-03", "2024-01-04"]),
+        "customer_id": [7, 7, 8, 9],
+        "product_code": ["0012", "0012", "CR1", "CR1"],
+        "quantity": [1, 1, 2, 3],
+        "net_sales": [10.5, 10.5, 20.0, 30.0],
+    })
+
+def test_ids_do_not_depend_on_how_columns_were_typed():
+    df = make_sales()
+    ids = row_id.generate_row_ids(df, "Lab", "sales.csv")
+    assert ids.is_unique
+
+    retyped = df.assign(
+        customer_id=df["customer_id"].astype(float),
+        quantity=df["quantity"].astype(str),
+        net_sales=df["net_sales"].astype(object),
+    )
+    assert row_id.generate_row_ids(retyped, "Lab", "sales.csv").tolist() == ids.tolist()
+
+    # Empty values count as empty strings, however the column holds them
+    with_empty = df.assign(customer_id=pd.Series([7, None, 8, 9], dtype=object))
+    as_float = df.assign(customer_id=[7.0, np.nan, 8.0, 9.0])
+    assert (
+        row_id.generate_row_ids(with_empty, "Lab", "sales.csv").tolist()
+        == row_id.generate_row_ids(as_float, "Lab", "sales.csv").tolist()
+    )
+
+def test_leading_zeros_are_kept_apart():
+    df = make_sales()
+    ids = row_id.generate_row_ids(df, "Lab", "sales.csv")
+    other = row_id.generate_row_ids(df.assign(product_code=["12", "12", "CR1", "CR1"]), "Lab", "sales.csv")
+    assert ids.tolist()[:2] != other.tolist()[:2]
+    assert ids.tolist()[2:] == other.tolist()[2:]
+
+def test_chunks_typed_differently_get_the_whole_file_ids():
+    df = make_sales()
+    whole = row_id.generate_row_ids(df, "Lab", "sales.csv")
+
+    # The first chunk's customer ids read as floats and the second's as strings
+    first = df.iloc[:2].assign(customer_id=[7.0, 7.0])
+    second = df.iloc[2:].assign(customer_id=["8", "9"])
+    with row_id.chunked_row_ids("Lab", "sales.csv"):
+        chunked = pd.concat(
+            [row_id.generate_row_ids(first, "Lab", "sales.csv"), row_id.generate_row_ids(second, "Lab", "sales.csv")]
+        )
+    assert chunked.tolist() == whole.tolist()
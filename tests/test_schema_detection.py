@@ -0,0 +1,43 @@
+import pytest
+from utils import utils, schema_utils
+
+@pytest.fixture
+def unknown_schemas(monkeypatch):
+    """
+    Start from no unknown schemas, as add_header_to_dict registers them in module level dicts.
+    """
+    monkeypatch.setattr(utils, "schema_new", {})
+    monkeypatch.setattr(utils, "schema_new_index", {})
+    monkeypatch.setattr(utils, "schema_matched", {})
+    monkeypatch.setattr(utils, "schema_key", 1)
+
+def test_header_fingerprint_ignores_column_order():
+    columns = schema_utils.lookup_schema()["Schema_6"]
+    assert utils.header_fingerprint(columns) == utils.header_fingerprint(list(reversed(columns)))
+    assert utils.header_fingerprint(columns) != utils.header_fingerprint(columns[:-1])
+
+def test_known_header_in_any_order_gets_its_schema(unknown_schemas):
+    for key, columns in schema_utils.lookup_schema().items():
+        assert utils.add_header_to_dict(columns) == key
+        assert utils.add_header_to_dict(list(reversed(columns))) == key
+    assert utils.schema_new == {}
+
+def test_unknown_header_is_registered_once(unknown_schemas):
+    columns = ["Foo", "Bar", "Baz"]
+    assert utils.add_header_to_dict(columns) == "UNknown_Schema_1"
+    assert utils.add_header_to_dict(["Baz", "Foo", "Bar"]) == "UNknown_Schema_1"
+    assert utils.add_header_to_dict(["Other"]) == "UNknown_Schema_2"
+    assert utils.schema_new == {"UNknown_Schema_1": columns, "UNknown_Schema_2": ["Other"]}
+
+def test_cached_header_is_only_read_again_when_the_file_changes(tmp_path, unknown_schemas):
+    csv_file = tmp_path / "sales.csv"
+    csv_file.write_text(",".join(schema_utils.lookup_schema()["Schema_6"]) + "\n")
+    file_cache = {}
+
+    fingerprint, columns, is_unique = utils.get_cached_csv_header(csv_file, file_cache)
+    assert columns == schema_utils.lookup_schema()["Schema_6"] and is_unique
+    assert utils.get_cached_csv_header(csv_file, file_cache) == (fingerprint, None, True)
+
+    csv_file.write_text(",".join(schema_utils.lookup_schema()["Schema_5"]) + "\n")
+    _, columns, _ = utils.get_cached_csv_header(csv_file, file_cache)
+    assert columns == schema_utils.lookup_schema()["Schema_5"]
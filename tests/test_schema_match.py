@@ -0,0 +1,62 @@
+import pytest
+from utils import schema_match, schema_utils, mysettings
+
+SCHEMAS = schema_utils.lookup_schema()
+
+@pytest.fixture(autouse=True)
+def clear_match_results():
+    schema_match.match_results.clear()
+    yield
+    schema_match.match_results.clear()
+
+def test_unnamed_columns_are_ignored():
+    assert schema_match.normalize_header(["Code", "Unnamed: 3", "Name"]) == frozenset({"Code", "Name"})
+
+def test_score_header():
+    known = frozenset({"a", "b", "c", "d"})
+    assert schema_match.score_header(frozenset({"a", "b", "c", "d", "e"}), known) == (1.0, 0.8)
+    assert schema_match.score_header(frozenset({"a", "b"}), known) == (0.5, 0.5)
+
+def test_header_with_extra_unnamed_columns_matches():
+    result = schema_match.match_header(SCHEMAS["Schema_3"] + ["Unnamed: 58", "Unnamed: 59", "Unnamed: 60"])
+    assert result["status"] == "matched"
+    # Schema_3 and Schema_4 only differ by their unnamed columns and share a preprocess function
+    assert result["schema_type"] in ("Schema_3", "Schema_4")
+    assert result["missing_columns"] == [] and result["extra_columns"] == []
+
+def test_header_with_an_extra_column_matches():
+    result = schema_match.match_header(SCHEMAS["Schema_1"] + ["Notes"])
+    assert result["status"] == "matched" and result["schema_type"] == "Schema_1"
+    assert result["extra_columns"] == ["Notes"]
+    assert result["containment"] == 1.0
+
+def test_header_missing_a_column_the_preprocess_function_reads_does_not_match():
+    columns = [col for col in SCHEMAS["Schema_1"] if col != "Product Link"]
+    result = schema_match.match_header(columns)
+    assert result["status"] == "no_match"
+    assert result["best_schema"] == "Schema_1" and result["missing_columns"] == ["Product Link"]
+
+def test_header_below_the_thresholds_does_not_match():
+    result = schema_match.match_header(SCHEMAS["Schema_1"][:10] + ["Foo", "Bar"])
+    assert result["status"] == "no_match"
+    assert result["containment"] < mysettings.SCHEMA_MATCH_MIN_CONTAINMENT
+
+def test_unrelated_header_has_no_best_schema():
+    result = schema_match.match_header(["Foo", "Bar"])
+    assert result["status"] == "no_match" and result["best_schema"] is None
+
+def test_close_schemas_with_different_preprocess_functions_are_ambiguous(monkeypatch):
+    monkeypatch.setattr(mysettings, "SCHEMA_MATCH_MIN_CONTAINMENT", 0.5)
+    monkeypatch.setattr(mysettings, "SCHEMA_MATCH_MIN_JACCARD", 0.1)
+    monkeypatch.setattr(mysettings, "SCHEMA_MATCH_AMBIGUITY_MARGIN", 1.0)
+    # Both Labtrac and Leca Transactor columns, which only the ambiguity margin tells apart
+    result = schema_match.match_header(SCHEMAS["Schema_1"] + SCHEMAS["Schema_12"])
+    assert result["status"] == "ambiguous" and result["schema_type"] is None
+    assert set(result["candidates"]) == {"Schema_1", "Schema_12"}
+
+def test_match_report(workdir):
+    files = [("a.csv", "Schema_1", SCHEMAS["Schema_1"] + ["Notes"]), ("b.csv", "UNknown_Schema_1", ["Foo"])]
+    report = schema_match.write_match_report(files)
+    assert report["status"].tolist() == ["matched", "no_match"]
+    assert (workdir / "files" / "sales" / "schema_match_report.csv").exists()
+    assert schema_match.write_match_report([]) is None
@@ -0,0 +1,51 @@
+import pandas as pd
+from benchmarks import generators
+from utils import snapshot, pre_process_function
+
+def assert_same_frames(dfs, expected):
+    assert len(dfs) == len(expected)
+    for df, expected_df in zip(dfs, expected):
+        pd.testing.assert_frame_equal(
+            df.reset_index(drop=True), expected_df.reset_index(drop=True),
+            check_dtype=False, check_column_type=False, check_names=False,
+        )
+
+def test_densign_months_are_built_in_parallel_then_read_from_snapshots(workdir):
+    files = generators.write_densign_months(workdir / "densign", 3, 40, seed=1)
+    expected = [pre_process_function.clean_densign_month(file) for file in files]
+
+    built = snapshot.load_snapshots(files, pre_process_function.clean_densign_month, "densign", workers=2)
+    assert_same_frames(built, expected)
+
+    def fail(file_path):
+        raise AssertionError(f"{file_path} should have been read from its snapshot")
+
+    assert_same_frames(snapshot.load_snapshots(files, fail, "densign", workers=1), expected)
+
+def test_only_changed_sources_are_built_again(workdir):
+    files = [workdir / f"source_{i}.csv" for i in range(3)]
+    for i, file in enumerate(files):
+        pd.DataFrame({"value": [i]}).to_csv(file, index=False)
+    snapshot.load_snapshots(files, snapshot.read_source, "test", workers=1)
+
+    pd.DataFrame({"value": [10, 11]}).to_csv(files[1], index=False)
+    built = []
+
+    def read_source(file_path):
+        built.append(file_path)
+        return snapshot.read_source(file_path)
+
+    dfs = snapshot.load_snapshots(files, read_source, "test", workers=1)
+    assert built == [files[1]]
+    assert [df["value"].tolist() for df in dfs] == [[0], [10, 11], [2]]
+
+def test_sources_with_the_same_name_get_their_own_snapshots(workdir):
+    files = [workdir / "2023" / "sales.csv", workdir / "2024" / "sales.csv"]
+    for i, file in enumerate(files):
+        file.parent.mkdir()
+        pd.DataFrame({"value": [i]}).to_csv(file, index=False)
+
+    assert snapshot.get_snapshot_file("test", files[0]) != snapshot.get_snapshot_file("test", files[1])
+    snapshot.load_snapshots(files, snapshot.read_source, "test", workers=1)
+    dfs = snapshot.load_snapshots(files, snapshot.read_source, "test", workers=1)
+    assert [df["value"].tolist() for df in dfs] == [[0], [1]]
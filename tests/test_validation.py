@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+from benchmarks import generators
+from utils import validation
+
+def make_report(totals) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Description": ["Crown", "Denture", "Bridge", validation.REPORT_TOTALS_LABEL],
+        "Qty": [1.0, 2.0, 3.0, totals[0]],
+        "Net_Sales": [10.0, 20.0, 30.0, totals[1]],
+        "Tax_Sales": [1.0, 2.0, 3.0, totals[2]],
+    })
+
+def test_matching_totals_pass_in_any_chunking():
+    report = make_report([6.0, 60.0, 6.0])
+    for chunksize in [1, 2, 4]:
+        accumulator = validation.ReportTotalsAccumulator()
+        for start in range(0, len(report), chunksize):
+            accumulator.update(report.iloc[start:start + chunksize])
+        assert all(result["passed"] for result in accumulator.results())
+        accumulator.check()
+
+def test_totals_within_the_tolerance_pass():
+    validation.check_report_totals(make_report([6.0, 60.005, 5.995]))
+
+def test_mismatched_totals_fail_with_every_difference():
+    accumulator = validation.ReportTotalsAccumulator()
+    accumulator.update(make_report([6.0, 50.0, 7.0]))
+    failed = [result["column"] for result in accumulator.results() if not result["passed"]]
+    assert failed == ["Net_Sales", "Tax_Sales"]
+    with pytest.raises(Exception, match="Net_Sales differs by 10.00, Tax_Sales differs by -1.00"):
+        accumulator.check()
+
+def test_missing_totals_row_fails():
+    accumulator = validation.ReportTotalsAccumulator()
+    accumulator.update(make_report([6.0, 60.0, 6.0]).iloc[:-1])
+    assert accumulator.results() == [{
+        "check": "report_totals_row", "column": None, "expected": 1, "actual": 0, "difference": -1, "passed": False,
+    }]
+
+def test_validate_reports_every_file_without_stopping(workdir):
+    passing = generators.write_schema_file("Schema_5", workdir / "passing.csv", 250, seed=1)
+    failing = workdir / "failing.csv"
+    raw_data = pd.read_csv(passing)
+    raw_data.loc[0, "Net_Sales"] += 5
+    raw_data.to_csv(failing, index=False)
+    manifest = pd.DataFrame({
+        "file_name": [passing, failing, workdir / "missing.csv"],
+        "schema_type": ["Schema_5"] * 3,
+        "system_source": ["Lab"] * 3,
+    })
+
+    report = validation.validate(manifest, chunksize=100)
+
+    by_file = report.groupby("file_name")["passed"].all()
+    assert by_file.to_dict() == {str(passing): True, str(failing): False, str(workdir / "missing.csv"): False}
+    assert (workdir / "files" / "sales" / "validation_report.csv").exists()
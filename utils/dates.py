@@ -0,0 +1,188 @@
+import pandas as pd
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+from . import mysettings
+
+# Formats tried, in order, when the formats given for a column do not parse every value, before the format pandas
+# guesses from the first value. Day first formats come before month first ones, as the labs are in the UK.
+DATE_FORMATS = [
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%d/%m/%y",
+    "%m/%d/%Y",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+]
+
+# Placeholder values the lab systems write for a date that has not been set, e.g. an order not yet invoiced. Excel
+# stores an empty date as day zero, which is shown as a date in 1899.
+NULL_DATE_VALUES = ["00/01/1900", "00:00:00"]
+NULL_DATE_YEAR = "1899"
+
+# (als_lab, column) -> date format last used to parse the column
+date_format_cache = {}
+# (als_lab, column) -> counts of the values parsed since the stats were last reported
+date_stats = {}
+
+def get_sentinel_values(values: pd.Series):
+    """
+    Returns the distinct values of a date column that are placeholders for an empty date. Only the distinct values are
+    checked, so this is cheap on columns with millions of rows.
+    """
+    uniques = pd.Series(values.dropna().unique())
+    as_str = uniques.astype(str)
+    is_sentinel = as_str.isin(NULL_DATE_VALUES) | as_str.str.contains(NULL_DATE_YEAR, regex=False)
+    return uniques[is_sentinel.to_numpy()].tolist()
+
+def is_sentinel_date(values: pd.Series) -> pd.Series:
+    """
+    Returns a boolean Series marking the placeholder values of a date column (NULL_DATE_VALUES and 1899 dates).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.year == int(NULL_DATE_YEAR)
+    return values.isin(get_sentinel_values(values))
+
+def get_parse_rate(uniques, date_format) -> float:
+    if len(uniques) == 0:
+        return 1.0
+    return pd.to_datetime(pd.Series(uniques), format=date_format, errors="coerce").notna().mean()
+
+def get_candidate_formats(uniques, formats=()):
+    """
+    Yields the formats infer_date_format tries, in order. The format is only guessed from the first value once the
+    known formats have been tried, as guessing is slow and warns about day first values.
+    """
+    yield from formats
+    yield from DATE_FORMATS
+    yield guess_datetime_format(uniques[0])
+
+def infer_date_format(values, formats=()):
+    """
+    Infer the format of a date column from its distinct values. The given formats are tried first, then
+    DATE_FORMATS, then the format pandas guesses from the first value. The first format that parses every value
+    wins, otherwise the one that parses the most. DATE_FORMATS come before the guess, which reads month first, so
+    values that read either way, e.g. 01/02/2024, are taken as day first, as the labs are in the UK.
+    :param values: Series or array of date strings, without empty or placeholder values.
+    :param formats: Formats to try first.
+    :return date_format: Str format, or None if no format parses any value.
+    """
+    uniques = pd.unique(pd.Series(values).dropna().astype(str))
+    if len(uniques) == 0:
+        return None
+
+    best_format, best_rate = None, 0.0
+    tried = set()
+    for date_format in get_candidate_formats(uniques, formats):
+        if not date_format or date_format in tried:
+            continue
+        tried.add(date_format)
+        rate = get_parse_rate(uniques, date_format)
+        if rate > best_rate:
+            best_format, best_rate = date_format, rate
+        if rate == 1.0:
+            break
+    return best_format
+
+def get_date_format(values, als_lab=None, column=None, formats=()):
+    """
+    Returns the cached format for (als_lab, column) if it still parses every distinct value, otherwise infers the
+    format again and caches it. Given formats that parse every value take precedence over the cached format.
+    """
+    key = (als_lab, column)
+    cached = date_format_cache.get(key)
+    uniques = pd.unique(pd.Series(values).dropna().astype(str))
+
+    for date_format in [*formats, cached]:
+        if date_format is not None and get_parse_rate(uniques, date_format) == 1.0:
+            date_format_cache[key] = date_format
+            return date_format
+
+    date_format = infer_date_format(uniques, formats)
+    if date_format is not None:
+        date_format_cache[key] = date_format
+    return date_format
+
+def parse_dates(values: pd.Series, als_lab=None, column=None, formats=()) -> pd.Series:
+    """
+    Parse a date column with a single format per (als_lab, column), inferred once and cached. Parsing is vectorized
+    and each distinct value is parsed once. Placeholder values are returned as NaT, as are values that do
+    not match the format; both are counted in date_stats for report_date_stats.
+    :param values: Series of date strings, or datetimes which are returned as they are.
+    :param als_lab: Str name of the ALS dental lab the data is from, part of the format cache key.
+    :param column: Str name of the date column, part of the format cache key.
+    :param formats: Formats to try first.
+    :return dates: Series of datetimes aligned to values.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+
+    sentinel = is_sentinel_date(values)
+    to_parse = values.mask(sentinel)
+    date_format = get_date_format(to_parse, als_lab, column, formats)
+
+    # Parse each distinct value once and map the results back by position. This is what pd.to_datetime(cache=True)
+    # does, but its lookup of the parsed values is far slower than taking by the factorized codes.
+    codes, uniques = pd.factorize(to_parse)
+    if date_format is None:
+        parsed_uniques = pd.Series(pd.NaT, index=range(len(uniques)), dtype="datetime64[ns]")
+    else:
+        parsed_uniques = pd.to_datetime(pd.Series(uniques), format=date_format, errors="coerce")
+    parsed_uniques = pd.concat([parsed_uniques, pd.Series([pd.NaT], dtype=parsed_uniques.dtype)], ignore_index=True)
+    # Code -1 marks an empty value, which takes the NaT appended at the end
+    parsed = pd.Series(parsed_uniques.to_numpy()[codes], index=values.index)
+
+    stats = date_stats.setdefault((als_lab, column), {"values": 0, "sentinels": 0, "failed": 0})
+    present = to_parse.notna()
+    stats["values"] += int(present.sum())
+    stats["sentinels"] += int(sentinel.sum())
+    stats["failed"] += int((present & parsed.isna()).sum())
+    return parsed
+
+def drop_failed_dates(failed: pd.Series, als_lab=None, column=None) -> pd.Series:
+    """
+    Check the rows of a required date column whose value did not parse, which are dropped rather than passed on to
+    combine and tagging without a date. Raises if they are more than mysettings.DATE_MAX_FAILURE_RATE of the rows.
+    :param failed: Boolean Series marking the rows whose date did not parse.
+    :param als_lab: Str name of the ALS dental lab the data is from, used in the messages.
+    :param column: Str name of the date column, used in the messages.
+    :return keep: Boolean Series marking the rows to keep.
+    """
+    failed_rows = int(failed.sum())
+    if failed_rows == 0:
+        return ~failed
+
+    rate = failed_rows / len(failed)
+    if rate > mysettings.DATE_MAX_FAILURE_RATE:
+        raise ValueError(
+            f"{als_lab} {column}: {failed_rows} of {len(failed)} dates ({rate:.2%}) could not be parsed, more than "
+            f"the {mysettings.DATE_MAX_FAILURE_RATE:.2%} allowed"
+        )
+    print(f"{als_lab} {column}: dropped {failed_rows} of {len(failed)} rows whose date could not be parsed")
+    return ~failed
+
+def get_date_totals() -> dict:
+    """
+    Returns the counts in date_stats summed over every lab and column.
+    """
+    totals = {"values": 0, "sentinels": 0, "failed": 0}
+    for stats in date_stats.values():
+        for key in totals:
+            totals[key] += stats[key]
+    return totals
+
+def report_date_stats(stage):
+    for (als_lab, column), stats in sorted(date_stats.items(), key=lambda item: str(item[0])):
+        print(format_parse_rate(f"{stage} {als_lab} {column}", stats["values"], stats["failed"], stats["sentinels"]))
+    date_stats.clear()
+
+def format_parse_rate(label, values, failed, sentinels) -> str:
+    rate = 1 - failed / values if values else 1.0
+    return f"{label}: {rate:.2%} of {values} dates parsed ({failed} failed, {sentinels} empty placeholders)"
@@ -0,0 +1,201 @@
+from pathlib import Path
+import os
+import numpy as np
+import pandas as pd
+from . import mysettings
+
+folder_path = mysettings.RAW_FOLDER_PATH
+
+# Business key columns that hold dates or amounts, normalized so the same sale hashes the same whether it was read
+# back from a CSV or a Parquet file
+DATE_KEY_COLUMNS = ["order_invoiced_date", "year_month"]
+NUMBER_KEY_COLUMNS = ["quantity", "net_sales"]
+
+# A whole number written with a decimal part, e.g. "123.0", captured without it
+WHOLE_NUMBER_TEXT = r"^(-?\d+)\.0+$"
+
+def get_index_file(combine_folder):
+    last_folder = os.path.basename(folder_path)
+    return Path(f"files/{last_folder}/dedup_index/{combine_folder}.npz")
+
+def normalize_text(values: pd.Series) -> pd.Series:
+    """
+    Returns the values as stripped strings, with whole numbers written without a decimal part so that e.g. a
+    customer id read as 123 in one file and 123.0 in another (because of a missing value) gives the same key. The
+    same goes for whole numbers held as text, e.g. "123.0" read as a string from a CSV written with a float column.
+    """
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        numbers = values.astype("float64")
+        text = numbers.astype("string")
+        whole = numbers.notna() & (numbers % 1 == 0)
+        text[whole] = numbers[whole].astype("int64").astype("string")
+        return text.fillna("")
+    return values.astype("string").fillna("").str.strip().str.replace(WHOLE_NUMBER_TEXT, r"\1", regex=True)
+
+def get_business_key_hashes(df: pd.DataFrame, key_cols=None) -> np.ndarray:
+    """
+    Hash the business key of each row (mysettings.DEDUP_KEY_COLUMNS by default). Columns missing from the frame
+    count as empty. Identical keys within the frame are told apart by their occurrence number, so a file that
+    repeats a sale keeps every copy, and only copies of it in other files count as overlap.
+    :return hashes: uint64 array aligned to df's rows.
+    """
+    if key_cols is None:
+        key_cols = mysettings.DEDUP_KEY_COLUMNS
+
+    key = {}
+    for col in key_cols:
+        if col not in df.columns:
+            key[col] = pd.Series("", index=df.index, dtype="string")
+        elif col in DATE_KEY_COLUMNS:
+            key[col] = pd.to_datetime(df[col], errors="coerce").astype("datetime64[ns]")
+        elif col in NUMBER_KEY_COLUMNS:
+            key[col] = pd.to_numeric(df[col], errors="coerce").astype("float64").round(2)
+        else:
+            key[col] = normalize_text(df[col])
+
+    key_hash = pd.util.hash_pandas_object(pd.DataFrame(key), index=False).to_numpy()
+    occurrence = pd.Series(key_hash).groupby(key_hash).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({"key_hash": key_hash, "occurrence": occurrence}), index=False
+    ).to_numpy()
+
+class DedupIndex:
+    """
+    Persistent index of the business key hashes already written to a combined file, per ALS lab, used to drop the
+    rows of overlapping extracts (e.g. a yearly ALS_Extract and the monthly extracts it overlaps) while the file is
+    streamed together. The index and the overlap counts are stored with the combined file, so files added later can
+    be appended to it without reading the files already combined.
+
+        dedup_index = DedupIndex(combine_folder)
+        for file in input_files:
+            df = df.loc[dedup_index.keep_mask(df, file)]
+        dedup_index.save()
+    """
+
+    def __init__(self, combine_folder, index_file=None, stats=None):
+        self.combine_folder = combine_folder
+        self.index_file = Path(index_file) if index_file else get_index_file(combine_folder)
+        # ALS lab -> sorted unique uint64 key hashes
+        self.keys = {}
+        # ALS lab -> {files, rows_in, duplicate_rows, overlapping_files}
+        self.stats = stats if stats is not None else {}
+
+    @classmethod
+    def load(cls, combine_folder, index_file=None, stats=None):
+        """
+        Load the index saved by an earlier run, e.g. to append new files to a combined file.
+        :param stats: Overlap counts recorded with the index in the pipeline manifest.
+        """
+        dedup_index = cls(combine_folder, index_file, stats)
+        with np.load(dedup_index.index_file, allow_pickle=False) as data:
+            offsets = data["offsets"]
+            for i, als_lab in enumerate(data["labs"].tolist()):
+                dedup_index.keys[als_lab] = data["keys"][offsets[i]:offsets[i + 1]]
+        return dedup_index
+
+    def save(self):
+        labs = list(self.keys)
+        sizes = [len(self.keys[als_lab]) for als_lab in labs]
+        keys = np.concatenate([self.keys[als_lab] for als_lab in labs]) if labs else np.array([], dtype="uint64")
+
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so a failed run never leaves a half-written index behind
+        tmp_index_file = self.index_file.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_index_file,
+            labs=np.array(labs, dtype=str),
+            offsets=np.concatenate([[0], np.cumsum(sizes, dtype="int64")]),
+            keys=keys,
+        )
+        os.replace(tmp_index_file, self.index_file)
+
+    def keep_mask(self, df: pd.DataFrame, source_file=None) -> np.ndarray:
+        """
+        Returns a boolean mask of the rows of df whose business key has not been seen in an earlier file, and adds
+        their keys to the index. A file's rows are checked against the earlier files of the same ALS lab only.
+        :param df: Preprocessed rows of one file, with the columns of mysettings.DEDUP_KEY_COLUMNS it has.
+        :param source_file: Path of the file, recorded in the overlap counts when it has overlapping rows.
+        """
+        hashes = get_business_key_hashes(df)
+        keep = np.ones(len(df), dtype=bool)
+        labs = normalize_text(df["als_lab"]).to_numpy() if "als_lab" in df.columns else np.full(len(df), "")
+
+        for als_lab, positions in pd.Series(np.arange(len(df))).groupby(labs, sort=False).indices.items():
+            lab_hashes = hashes[positions]
+            known = self.keys.get(als_lab, np.array([], dtype="uint64"))
+            if len(known) > 0:
+                found = np.searchsorted(known, lab_hashes)
+                seen = known[np.minimum(found, len(known) - 1)] == lab_hashes
+            else:
+                seen = np.zeros(len(lab_hashes), dtype=bool)
+            keep[positions] = ~seen
+            self.keys[als_lab] = np.union1d(known, lab_hashes[~seen])
+
+            stats = self.stats.setdefault(
+                als_lab, {"files": 0, "rows_in": 0, "duplicate_rows": 0, "overlapping_files": []}
+            )
+            stats["files"] += 1
+            stats["rows_in"] += len(lab_hashes)
+            stats["duplicate_rows"] += int(seen.sum())
+            if seen.any() and source_file is not None:
+                stats["overlapping_files"].append(str(source_file))
+
+        return keep
+
+    def filter_table(self, table, source_file=None):
+        """
+        keep_mask for an Arrow table, reading only its business key columns into pandas.
+        """
+        import pyarrow as pa
+
+        key_cols = [col for col in mysettings.DEDUP_KEY_COLUMNS if col in table.column_names]
+        keep = self.keep_mask(table.select(key_cols).to_pandas(), source_file)
+        return table.filter(pa.array(keep))
+
+def get_stats_report(stats_by_folder) -> pd.DataFrame:
+    """
+    :param stats_by_folder: Dict of combine folder -> DedupIndex.stats.
+    :return df: One row per combine folder and ALS lab with the rows read, the overlapping rows dropped and the
+    files they were dropped from.
+    """
+    rows = []
+    for combine_folder, stats in stats_by_folder.items():
+        for als_lab, lab_stats in stats.items():
+            rows.append({
+                "combine_folder": combine_folder,
+                "als_lab": als_lab,
+                "files": lab_stats["files"],
+                "rows_in": lab_stats["rows_in"],
+                "rows_out": lab_stats["rows_in"] - lab_stats["duplicate_rows"],
+                "duplicate_rows": lab_stats["duplicate_rows"],
+                "duplicate_share": lab_stats["duplicate_rows"] / lab_stats["rows_in"] if lab_stats["rows_in"] else 0.0,
+                "overlapping_files": "; ".join(lab_stats["overlapping_files"]),
+            })
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "combine_folder", "als_lab", "files", "rows_in", "rows_out", "duplicate_rows", "duplicate_share",
+            "overlapping_files",
+        ],
+    )
+
+def write_stats_report(stats_by_folder, output_file=None):
+    """
+    Write the overlap counts of every combined file, by default to files/<raw folder>/dedup_report.csv, and print
+    the labs with overlapping extracts.
+    """
+    if output_file is None:
+        last_folder = os.path.basename(folder_path)
+        output_file = Path(f"files/{last_folder}/dedup_report.csv")
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+    df = get_stats_report(stats_by_folder)
+    df.to_csv(output_file, index=False)
+
+    for _, row in df.loc[df["duplicate_rows"] > 0].iterrows():
+        print(
+            f"dedup {row['combine_folder']} {row['als_lab']}: dropped {row['duplicate_rows']} of {row['rows_in']} "
+            f"rows ({row['duplicate_share']:.1%}) overlapping earlier files"
+        )
+    print(f"Dedup report written to {output_file}")
+    return df
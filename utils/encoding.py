@@ -0,0 +1,154 @@
+from pathlib import Path
+import codecs
+import json
+import os
+import pandas as pd
+from . import mysettings
+
+folder_path = mysettings.RAW_FOLDER_PATH
+
+# Bytes read from the start, middle and end of a file to detect its encoding
+SAMPLE_SIZE = 64 * 1024
+FALLBACK_ENCODING = "latin-1"
+
+encoding_cache = None
+# Distinct files read since the stats were last reported
+encoding_stats = {"files": set(), "fallback": set(), "retried": set()}
+
+def get_encoding_cache_file():
+    last_folder = os.path.basename(folder_path)
+    return Path(f"files/{last_folder}/encoding_cache.json")
+
+def load_encoding_cache():
+    global encoding_cache
+
+    if encoding_cache is None:
+        encoding_cache = {}
+        cache_file = get_encoding_cache_file()
+        if cache_file.exists():
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    encoding_cache = json.load(f)
+            except (OSError, ValueError):
+                print(f"⚠️ Could not read encoding cache {cache_file}. Rebuilding it.")
+    return encoding_cache
+
+def save_encoding_cache():
+    if encoding_cache is None:
+        return
+    cache_file = get_encoding_cache_file()
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, "w", encoding="utf-8") as f:
+        json.dump(encoding_cache, f)
+
+def read_samples(file_path):
+    """
+    Returns up to three byte samples from the start, middle and end of the file.
+    """
+    size = os.path.getsize(file_path)
+    offsets = sorted({0, max(0, size // 2 - SAMPLE_SIZE // 2), max(0, size - SAMPLE_SIZE)})
+    samples = []
+    with open(file_path, "rb") as f:
+        for offset in offsets:
+            f.seek(offset)
+            samples.append((offset, f.read(SAMPLE_SIZE)))
+    return samples
+
+def is_utf8(offset, sample):
+    # Samples taken from the middle of a file may start part way through a multi-byte character
+    if offset > 0:
+        skip = 0
+        while skip < 3 and skip < len(sample) and 0x80 <= sample[skip] <= 0xBF:
+            skip += 1
+        sample = sample[skip:]
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        # final=False allows the sample to end part way through a multi-byte character
+        decoder.decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def detect_encoding(file_path):
+    """
+    Detect the encoding of a file from a bounded sample of its bytes: UTF-8 (with or without a byte order mark) or
+    Latin-1, which can decode any byte sequence.
+    """
+    samples = read_samples(file_path)
+    if len(samples) > 0 and samples[0][1].startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if all(is_utf8(offset, sample) for offset, sample in samples):
+        return "utf-8"
+    return FALLBACK_ENCODING
+
+def get_encoding(file_path):
+    """
+    Returns the encoding of a file, detecting it only if the file is new or has changed (by size and modification
+    time) since the encoding was last cached.
+    """
+    cache = load_encoding_cache()
+    stat = Path(file_path).stat()
+    key = str(file_path)
+    cached = cache.get(key)
+
+    if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+        return cached["encoding"]
+
+    encoding = detect_encoding(file_path)
+    set_encoding(file_path, encoding)
+    return encoding
+
+def set_encoding(file_path, encoding):
+    stat = Path(file_path).stat()
+    load_encoding_cache()[str(file_path)] = {"size": stat.st_size, "mtime": stat.st_mtime, "encoding": encoding}
+
+def read_csv(file_path, **kwargs) -> pd.DataFrame:
+    """
+    pd.read_csv with the file's encoding looked up from the encoding cache, so each file is parsed once. If a
+    non-UTF-8 byte was outside the detection sample, the file is re-read as Latin-1 and the cache is corrected.
+    """
+    encoding = get_encoding(file_path)
+    encoding_stats["files"].add(str(file_path))
+
+    try:
+        df = pd.read_csv(file_path, encoding=encoding, **kwargs)
+    except UnicodeDecodeError:
+        print(f"⚠️ Encoding error in file: {file_path}. Retrying with Latin-1.")
+        encoding = FALLBACK_ENCODING
+        encoding_stats["retried"].add(str(file_path))
+        set_encoding(file_path, encoding)
+        df = pd.read_csv(file_path, encoding=encoding, **kwargs)
+
+    if encoding == FALLBACK_ENCODING:
+        encoding_stats["fallback"].add(str(file_path))
+    return df
+
+def read_csv_chunks(file_path, chunksize, **kwargs):
+    """
+    Iterate over a CSV file in chunks of chunksize rows, using the cached encoding. Chunks that were already handed
+    out cannot be re-read, so if a non-UTF-8 byte turns up outside the detection sample the cache is corrected to
+    Latin-1 for the next run and the error is raised.
+    """
+    encoding = get_encoding(file_path)
+    encoding_stats["files"].add(str(file_path))
+    if encoding == FALLBACK_ENCODING:
+        encoding_stats["fallback"].add(str(file_path))
+
+    try:
+        with pd.read_csv(file_path, encoding=encoding, chunksize=chunksize, **kwargs) as reader:
+            for chunk in reader:
+                yield chunk
+    except UnicodeDecodeError:
+        set_encoding(file_path, FALLBACK_ENCODING)
+        encoding_stats["retried"].add(str(file_path))
+        raise
+
+def report_encoding_stats(stage):
+    print(
+        f"{stage}: {len(encoding_stats['fallback'])} of {len(encoding_stats['files'])} files read as "
+        f"{FALLBACK_ENCODING} ({len(encoding_stats['retried'])} needed a second read)"
+    )
+    for files in encoding_stats.values():
+        files.clear()
+    save_encoding_cache()
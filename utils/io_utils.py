@@ -0,0 +1,273 @@
+from pathlib import Path
+import os
+import shutil
+import tempfile
+import pandas as pd
+from . import mysettings, encoding
+
+OUTPUT_FORMAT_SUFFIX = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+}
+
+# Columns written by the preprocess functions that hold dates, parsed back to datetimes when reading CSV outputs
+DATE_COLUMNS = ["order_invoiced_date", "year_month"]
+
+# Columns written by the preprocess functions that hold a small set of values repeated on every row, read back as
+# categoricals
+CATEGORICAL_COLUMNS = [
+    "system_source",
+    "als_lab",
+    "nhs_or_private",
+    "product_category",
+    "original_lab_price_band",
+    "order_status",
+    "currency_symbol",
+    "currency_description",
+]
+
+# Columns written by the preprocess functions that hold codes and names rather than numbers, read back from CSV as
+# strings so that e.g. product code "0012" keeps its leading zeros and has the same type in every chunk of a file
+STRING_COLUMNS = [
+    "order_id",
+    "customer_id",
+    "practice_code",
+    "practice_address_postcode",
+    "product_code",
+    "product_description",
+]
+
+def get_output_format(output_format=None):
+    output_format = (output_format or mysettings.OUTPUT_FORMAT).lower()
+    if output_format not in OUTPUT_FORMAT_SUFFIX:
+        raise ValueError(
+            f"Unsupported output format {output_format}. Expected one of {list(OUTPUT_FORMAT_SUFFIX)}."
+        )
+    return output_format
+
+def get_output_file(output_file_stem, output_format=None):
+    """
+    Returns the output file path for a path without extension, e.g. data/pre_processed/sales/labtrac/Lab/file.
+    """
+    return f"{output_file_stem}{OUTPUT_FORMAT_SUFFIX[get_output_format(output_format)]}"
+
+def is_data_file(file):
+    return Path(file).is_file() and Path(file).suffix.lower() in OUTPUT_FORMAT_SUFFIX.values()
+
+def make_arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parquet columns must hold a single type, but raw lab data often mixes numbers and strings in one object column
+    (e.g. customer ids). Convert the non-null values of any such column to strings.
+    """
+    mixed_cols = [
+        col for col in df.columns
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) in ("mixed", "mixed-integer")
+    ]
+    if len(mixed_cols) == 0:
+        return df
+
+    df = df.copy()
+    for col in mixed_cols:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+def write_frame(df: pd.DataFrame, output_file_stem, output_format=None):
+    """
+    Write a DataFrame as CSV or Parquet, depending on output_format (default mysettings.OUTPUT_FORMAT).
+    :param df: DataFrame to write.
+    :param output_file_stem: Output path without file extension.
+    :param output_format: "csv" or "parquet".
+    :return output_file: Path of the written file, including the extension.
+    """
+    output_format = get_output_format(output_format)
+    output_file = get_output_file(output_file_stem, output_format)
+
+    if output_format == "parquet":
+        make_arrow_compatible(df).to_parquet(output_file, index=False, compression=mysettings.PARQUET_COMPRESSION)
+    else:
+        df.to_csv(output_file, index=False)
+
+    return output_file
+
+def get_csv_dtypes() -> dict:
+    """
+    Returns the dtypes CSV outputs are read with: STRING_COLUMNS as strings and CATEGORICAL_COLUMNS as categoricals.
+    Columns a file does not have are ignored.
+    """
+    dtypes = {col: str for col in STRING_COLUMNS}
+    dtypes.update({col: "category" for col in CATEGORICAL_COLUMNS})
+    return dtypes
+
+def read_frame(file, columns=None, **kwargs) -> pd.DataFrame:
+    """
+    Read a CSV or Parquet output written by write_frame. Parquet keeps the column types it was written with; for CSV
+    the known date columns are parsed back to datetimes and STRING_COLUMNS are read as strings, whatever values they
+    hold. CATEGORICAL_COLUMNS are read as categoricals in both cases.
+    :param file: Path of a .csv or .parquet file.
+    :param columns: Optional list of columns to read. Other columns are never parsed.
+    :return df: DataFrame with the requested columns.
+    """
+    if Path(file).suffix.lower() == ".parquet":
+        return restore_categoricals(pd.read_parquet(file, columns=columns, **kwargs))
+
+    kwargs.setdefault("dtype", get_csv_dtypes())
+    return parse_date_columns(encoding.read_csv(file, usecols=columns, low_memory=False, **kwargs))
+
+def read_frame_chunks(file, chunksize, columns=None, **kwargs):
+    """
+    read_frame one chunk of chunksize rows at a time, so that files of any size can be streamed through a stage.
+    :param file: Path of a .csv or .parquet file.
+    :param chunksize: Number of rows per chunk.
+    :param columns: Optional list of columns to read. Other columns are never parsed.
+    :return chunks: Generator of DataFrames.
+    """
+    if Path(file).suffix.lower() == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield restore_categoricals(batch.to_pandas())
+        return
+
+    kwargs.setdefault("dtype", get_csv_dtypes())
+    for chunk in encoding.read_csv_chunks(file, chunksize, usecols=columns, **kwargs):
+        yield parse_date_columns(chunk)
+
+def restore_categoricals(df: pd.DataFrame) -> pd.DataFrame:
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+def parse_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+def read_columns(file):
+    """
+    Returns the column names of a CSV or Parquet file without reading its data.
+    """
+    if Path(file).suffix.lower() == ".parquet":
+        import pyarrow.parquet as pq
+
+        return list(pq.read_schema(file).names)
+
+    return list(encoding.read_csv(file, nrows=0).columns)
+
+def concat_to_parquet(input_files, output_file, row_filter=None):
+    """
+    Stream CSV or Parquet files into a single Parquet file, one input file at a time. The output schema is unified
+    from the input schemas, promoting types where files disagree (e.g. int and float quantities, or a column that is
+    entirely empty in one file). Parquet inputs only have their metadata read for this; CSV inputs have to be parsed
+    once to infer their types.
+    :param input_files: List of CSV or Parquet file paths.
+    :param output_file: Path of the Parquet file to write.
+    :param row_filter: Optional function taking an input file's Arrow table and path and returning the rows to
+    write, e.g. dedup.DedupIndex.filter_table.
+    :return rows: Number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def read_table(file):
+        if Path(file).suffix.lower() == ".parquet":
+            return pq.read_table(file)
+        df = make_arrow_compatible(read_frame(file))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def decode_dictionaries(schema):
+        # Categorical columns are dictionary encoded, which cannot be unified with a plain string column from another
+        # file. Parquet dictionary encodes repeated values on disk anyway, and read_frame restores the categoricals.
+        return pa.schema(
+            [
+                field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+                for field in schema
+            ]
+        )
+
+    schemas = []
+    for file in input_files:
+        if Path(file).suffix.lower() == ".parquet":
+            schemas.append(decode_dictionaries(pq.read_schema(file).remove_metadata()))
+        else:
+            schemas.append(decode_dictionaries(read_table(file).schema.remove_metadata()))
+    schema = pa.unify_schemas(schemas, promote_options="permissive") if len(schemas) > 0 else pa.schema([])
+
+    # Write to a temporary file first so a failed run never leaves a half-written file behind
+    tmp_output_file = f"{output_file}.tmp"
+    rows = 0
+    with pq.ParquetWriter(tmp_output_file, schema, compression=mysettings.PARQUET_COMPRESSION) as writer:
+        for file in input_files:
+            table = read_table(file)
+            if row_filter is not None:
+                table = row_filter(table, file)
+            columns = [
+                table.column(field.name) if field.name in table.column_names else pa.nulls(len(table), field.type)
+                for field in schema
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, names=schema.names).cast(schema))
+            rows += len(table)
+
+    os.replace(tmp_output_file, output_file)
+    return rows
+
+class ChunkedFrameWriter:
+    """
+    Write a DataFrame that arrives in chunks to a single CSV or Parquet file, holding one chunk in memory at a time.
+    The columns of the first chunk set the output columns. Parquet chunks are written as separate part files and
+    joined by concat_to_parquet on close, so a column's type can differ between chunks (e.g. an integer column
+    that only has missing values in a later chunk). Nothing is left at the output path if writing fails.
+
+        with ChunkedFrameWriter(output_file_stem, "parquet") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, output_file_stem, output_format=None):
+        self.output_format = get_output_format(output_format)
+        self.output_file = get_output_file(output_file_stem, self.output_format)
+        self.tmp_output_file = f"{self.output_file}.tmp"
+        self.columns = None
+        self.rows = 0
+        self.csv_file = None
+        self.part_folder = None
+        self.part_files = []
+
+    def __enter__(self):
+        if self.output_format == "parquet":
+            self.part_folder = tempfile.mkdtemp(dir=Path(self.output_file).parent, prefix=".parts_")
+        else:
+            self.csv_file = open(self.tmp_output_file, "w", encoding="utf-8", newline="")
+        return self
+
+    def write(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            if self.csv_file is not None:
+                self.csv_file.write(pd.DataFrame(columns=self.columns).to_csv(index=False))
+
+        chunk = chunk.reindex(columns=self.columns)
+        if self.output_format == "parquet":
+            part_file = f"{self.part_folder}/part_{len(self.part_files):05d}.parquet"
+            make_arrow_compatible(chunk).to_parquet(part_file, index=False)
+            self.part_files.append(part_file)
+        else:
+            chunk.to_csv(self.csv_file, index=False, header=False)
+        self.rows += len(chunk)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.csv_file is not None:
+                self.csv_file.close()
+                if exc_type is None:
+                    os.replace(self.tmp_output_file, self.output_file)
+                elif os.path.exists(self.tmp_output_file):
+                    os.remove(self.tmp_output_file)
+            elif exc_type is None:
+                concat_to_parquet(self.part_files, self.output_file)
+        finally:
+            if self.part_folder is not None:
+                shutil.rmtree(self.part_folder, ignore_errors=True)
+        return False
@@ -0,0 +1,101 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+from . import mysettings
+
+folder_path = mysettings.RAW_FOLDER_PATH
+
+def file_hash(file_path, block_size=1024 * 1024):
+    """
+    Returns the SHA-256 hex digest of a file's contents, read in fixed size blocks.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def get_manifest_file():
+    last_folder = os.path.basename(folder_path)
+    return Path(f"files/{last_folder}/pipeline_manifest.json")
+
+class PipelineManifest:
+    """
+    Records, for each pipeline stage, the inputs that were processed and the outputs they produced, so that later
+    runs only redo new or changed files.
+
+    The manifest is stored as JSON with one section per stage:
+        excel: source Excel file -> {hash, outputs}
+        preprocess: raw CSV file -> {hash, schema_type, func_name, func_version, output_file}
+        combine: combine folder -> {inputs, output_file}
+        snapshot: source Excel file -> {hash, name, version, build_kwargs, output_file}
+        reference: reference table name -> {sources, version, build_kwargs, output_file}
+    plus a hashes section caching (size, mtime) -> content hash so unchanged files are not re-hashed.
+    """
+
+    stages = ("excel", "preprocess", "combine", "snapshot", "reference")
+
+    def __init__(self, manifest_file=None):
+        self.manifest_file = Path(manifest_file) if manifest_file else get_manifest_file()
+        self.data = {stage: {} for stage in self.stages}
+        self.data["hashes"] = {}
+
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, "r", encoding="utf-8") as f:
+                    self.data.update(json.load(f))
+            except (OSError, ValueError):
+                print(f"⚠️ Could not read pipeline manifest {self.manifest_file}. Running a full rebuild.")
+
+    def save(self):
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_file, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1, default=str)
+
+    def hash(self, file_path):
+        """
+        Returns the content hash of a file, reusing the hash from the previous run if its size and modification
+        time have not changed.
+        """
+        stat = Path(file_path).stat()
+        key = str(file_path)
+        cached = self.data["hashes"].get(key)
+
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+            return cached["hash"]
+
+        digest = file_hash(file_path)
+        self.data["hashes"][key] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest}
+        return digest
+
+    def get(self, stage, key):
+        return self.data[stage].get(str(key))
+
+    def record(self, stage, key, **values):
+        self.data[stage][str(key)] = values
+
+    def remove(self, stage, key):
+        return self.data[stage].pop(str(key), None)
+
+    def keys(self, stage):
+        return list(self.data[stage].keys())
+
+    def is_unchanged(self, stage, key, **expected):
+        """
+        Returns True if the stage has a record for the key whose values match every expected value and whose
+        output files still exist.
+        """
+        recorded = self.get(stage, key)
+        if recorded is None:
+            return False
+
+        for name, value in expected.items():
+            if recorded.get(name) != value:
+                return False
+
+        if "outputs" in recorded:
+            outputs = recorded["outputs"]
+        else:
+            outputs = [recorded.get("output_file")]
+        return all(output and Path(output).exists() for output in outputs)
@@ -0,0 +1,189 @@
+import pandas as pd
+from . import row_id, dates, profiling
+
+# Operations available to the "derived" entries of a mapping spec. Each takes the source columns as Series.
+DERIVED_OPERATIONS = {
+    "year_month": lambda year, month: pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": 1})),
+    "subtract": lambda a, b: a - b,
+    "divide": lambda a, b: a / b,
+}
+
+# Spec keys naming the columns a step reads, whether or not they are output
+INPUT_KEYS = ["required", "exclude", "fill_na", "dtypes", "strip", "dates", "optional_columns"]
+
+def check_column_count(raw_data: pd.DataFrame, spec: dict):
+    expected_columns = spec.get("expected_columns")
+    if expected_columns is not None and raw_data.shape[1] != expected_columns:
+        raise Exception(
+            f"Raw {spec['system_source']} data does not have the correct number of columns."
+        )
+
+def has_header_in_first_row(columns) -> bool:
+    """
+    Some exports have a blank first line, so pandas names the columns "Unnamed: 0", "Unnamed: 1", ... and the real
+    header ends up in the first data row.
+    """
+    return len(columns) > 0 and columns[0] == "Unnamed: 0"
+
+def get_source_columns(raw_data: pd.DataFrame, spec: dict) -> dict:
+    """
+    Returns the raw columns keyed by the names used in the rest of the spec: positional names from spec["columns"]
+    if given, then spec["rename"] applied.
+    """
+    if spec.get("header_in_first_row") and has_header_in_first_row(raw_data.columns):
+        raw_data = raw_data.iloc[1:]
+
+    if spec.get("columns"):
+        if len(spec["columns"]) != raw_data.shape[1]:
+            raise Exception(
+                f"Raw {spec['system_source']} data has {raw_data.shape[1]} columns, expected {len(spec['columns'])}."
+            )
+        names = spec["columns"]
+    else:
+        names = raw_data.columns
+
+    rename = spec.get("rename", {})
+    return {rename.get(name, name): raw_data.iloc[:, i] for i, name in enumerate(names)}
+
+def apply_mapping(
+    raw_data: pd.DataFrame,
+    spec: dict,
+    als_lab: str,
+    source_file: str = None,
+    checks=(),
+    keep_optional_columns: bool = None,
+) -> pd.DataFrame:
+    """
+    Map a raw export onto the canonical preprocessed columns as described by a mapping spec, in a single pass: rows
+    are filtered once, each output column is transformed once, and the output frame is built once from the
+    transformed columns. The raw frame is never modified or copied as a whole.
+
+    A spec is a dict with the keys below. Column names after "rename" are the names used by all later keys.
+        system_source: Str system name written to the system_source column.
+        expected_columns: Optional number of columns the raw data must have.
+        header_in_first_row: If True and the header was read as "Unnamed: n", the first row is skipped.
+        columns: Optional list naming the raw columns by position.
+        rename: Dict of raw column name to output column name.
+        required: Columns whose empty rows are dropped. Placeholder values count as empty in date columns, and rows
+            whose date cannot be parsed are dropped too, see dates.drop_failed_dates.
+        exclude: Dict of column to list of values whose rows are dropped.
+        report_totals: If True the raw data has a REPORT TOTALS row, checked by the validation module.
+        fill_na: Dict of column to the value that fills its empty cells.
+        dtypes: Dict of column to the dtype it is cast to.
+        strip: Columns whose surrounding whitespace is removed.
+        dates: Dict of date column to list of formats to try, parsed by dates.parse_dates.
+        optional_columns: Columns that are dropped if they have any empty values.
+        constants: Dict of column to a value repeated on every row.
+        derived: List of (column, operation, source columns), operation being a key of DERIVED_OPERATIONS.
+        row_id: Name of the row ID column, generated by row_id.generate_row_ids.
+        output_columns: Output columns in order, including the row ID column.
+    :param raw_data: DataFrame containing the raw data for a single lab.
+    :param spec: Mapping spec for the raw data's schema.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :param checks: Functions run on the raw data before it is mapped, which raise if it is invalid.
+    :param keep_optional_columns: Whether to keep spec["optional_columns"]. By default each is kept only if it has no
+    empty values.
+    :return prep_data: DataFrame containing the preprocessed data.
+    """
+    check_column_count(raw_data, spec)
+    for check in checks:
+        check(raw_data)
+
+    source = get_source_columns(raw_data, spec)
+
+    # Find the rows to keep, then select them from each column that is used
+    mask = None
+    for col in spec.get("required", []):
+        keep = source[col].notna()
+        if col in spec.get("dates", {}):
+            # Placeholder dates, e.g. for orders not yet invoiced, count as empty
+            keep = keep & ~dates.is_sentinel_date(source[col])
+        mask = keep if mask is None else mask & keep
+    for col, values in spec.get("exclude", {}).items():
+        keep = ~source[col].isin(values)
+        mask = keep if mask is None else mask & keep
+
+    used_cols = [col for col in source if col in spec["output_columns"] or is_input_column(col, spec)]
+    if mask is None or mask.all():
+        data = {col: source[col] for col in used_cols}
+    else:
+        data = {col: source[col][mask] for col in used_cols}
+
+    for col, value in spec.get("fill_na", {}).items():
+        data[col] = data[col].fillna(value)
+    for col, dtype in spec.get("dtypes", {}).items():
+        data[col] = data[col].astype(dtype)
+    for col in spec.get("strip", []):
+        if col in data:
+            data[col] = data[col].str.strip()
+    for col, formats in spec.get("dates", {}).items():
+        data[col] = dates.parse_dates(data[col], als_lab, col, formats)
+
+    # Required dates are never empty here, so any that are empty did not parse. Their rows are dropped.
+    for col in spec.get("required", []):
+        if col in spec.get("dates", {}):
+            keep = dates.drop_failed_dates(data[col].isna(), als_lab, col)
+            if not keep.all():
+                data = {data_col: values[keep] for data_col, values in data.items()}
+
+    dropped_cols = set()
+    for col in spec.get("optional_columns", []):
+        keep = keep_optional_columns
+        if keep is None:
+            keep = not data[col].isnull().any()
+        if not keep:
+            dropped_cols.add(col)
+
+    data["system_source"] = spec["system_source"]
+    data["als_lab"] = als_lab
+    for col, value in spec.get("constants", {}).items():
+        data[col] = value
+    for col, operation, source_cols in spec.get("derived", []):
+        data[col] = DERIVED_OPERATIONS[operation](*[data[source_col] for source_col in source_cols])
+
+    output_cols = [col for col in spec["output_columns"] if col not in dropped_cols]
+    id_position = output_cols.index(spec["row_id"])
+    output_cols.remove(spec["row_id"])
+
+    index = next(values.index for values in data.values() if isinstance(values, pd.Series))
+    prep_data = pd.DataFrame({col: data[col] for col in output_cols}, index=index, copy=False)
+    prep_data = prep_data.reset_index(drop=True)
+
+    # Add deterministic unique row identifier
+    with profiling.stage("row_ids", source_file) as counts:
+        prep_data.insert(id_position, spec["row_id"], row_id.generate_row_ids(prep_data, als_lab, source_file))
+        counts["rows_out"] = len(prep_data)
+
+    return prep_data
+
+def is_input_column(col, spec: dict) -> bool:
+    """
+    Whether a column is read by a spec step other than output_columns.
+    """
+    for key in INPUT_KEYS:
+        if col in spec.get(key, []):
+            return True
+    return any(col in source_cols for _, _, source_cols in spec.get("derived", []))
+
+def get_source_usecols(spec: dict):
+    """
+    Returns the set of raw column names a spec reads, to be passed to the CSV parser as usecols so that other columns
+    are never parsed. Returns None when every column has to be read: when the columns are named by position, or
+    when the spec checks the number of raw columns.
+    """
+    if spec.get("columns") or spec.get("expected_columns") is not None:
+        return None
+
+    cols = set(spec["output_columns"])
+    for key in INPUT_KEYS:
+        cols.update(spec.get(key, []))
+    for _, _, source_cols in spec.get("derived", []):
+        cols.update(source_cols)
+    # Columns the engine adds itself
+    cols -= {"system_source", "als_lab", spec["row_id"]} | set(spec.get("constants", {}))
+    cols -= {col for col, _, _ in spec.get("derived", [])}
+
+    raw_cols = {raw_col for raw_col, col in spec.get("rename", {}).items() if col in cols}
+    renamed_cols = set(spec.get("rename", {}).values())
+    return raw_cols | {col for col in cols if col not in renamed_cols}
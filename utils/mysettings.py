@@ -10,13 +10,110 @@ LOOKUP_COMBINE_PREPROCESS_FUNCTION={
     "preprocess_leca_transactor":"leca"
 }
 
+# Bump the version of a preprocess function whenever its output changes, so incremental runs reprocess its files
+PREPROCESS_FUNCTION_VERSION={
+    "preprocess_labtrac_new":4,
+    "preprocess_labtrac_old":3,
+    "preprocess_transactor":4,
+    "preprocess_leca":3,
+    "prep_transactor_passion_dental_design":4,
+    "preprocess_leca_greatlab":3,
+    "preprocess_leca_transactor":3
+}
+
+# Format of the pre_processed, combined and NHS mapping outputs: "csv" or "parquet"
+OUTPUT_FORMAT="csv"
+PARQUET_COMPRESSION="zstd"
+
+# Rows read and preprocessed at a time per raw file, bounding memory on large extracts. None processes files whole.
+PREPROCESS_CHUNKSIZE=None
+
+# Rows whose required date (e.g. order_invoiced_date) cannot be parsed are dropped, and a file fails to preprocess
+# when they are more than this share of its rows
+DATE_MAX_FAILURE_RATE=0.01
+
+# Headers that match no known schema exactly are routed to the closest known schema, ignoring "Unnamed: n" columns,
+# when at least this share of the schema's named columns are present
+SCHEMA_MATCH_MIN_CONTAINMENT=0.9
+# and the named columns in both headers are at least this share of those in either (Jaccard similarity)
+SCHEMA_MATCH_MIN_JACCARD=0.8
+# Schemas scoring within this Jaccard margin of the best one but using another preprocess function make it ambiguous
+SCHEMA_MATCH_AMBIGUITY_MARGIN=0.05
+
+# Largest difference allowed between the sums of a Transactor report and its REPORT TOTALS row, in either direction
+REPORT_TOTALS_TOLERANCE=0.01
+# Rows read at a time when validating raw files
+VALIDATION_CHUNKSIZE=500000
+
 COMBINED_FOLDER_PATH="data/pre_processed_combined/sales"
+# Drop the rows of overlapping extracts (e.g. a yearly ALS_Extract and the monthly extracts it covers) when combining,
+# keeping the first file's copy of each sale. A sale is identified by these columns, those missing counting as empty.
+# Off by default: only the Labtrac and Ashford outputs have an order id, so in the other exports two identical lines of
+# different orders on the same day (e.g. two crowns for one dentist) only differ by their order and would be dropped
+# as overlap if they are in different files.
+DEDUP_COMBINE=False
+DEDUP_KEY_COLUMNS=[
+    "als_lab", "order_id", "order_invoiced_date", "year_month", "customer_id", "product_code", "quantity", "net_sales"
+]
+DENSIGN_FOLDER_PATH="data/sales_densign/densign"
+ASHFORD_FOLDER_PATH="data/sales_ashford/Ashford"
+
+# Ashford Labtrac exports, spliced together in this order. The first file's header names the columns of every file.
+#   header: False if the file has no header row, so its first row is data.
+#   add_dr_id: True if the file has no DR ID column, which is then filled with "Unknown".
+#   date_formats: Formats to try first when parsing the INVOICED DATE column.
+#   invoiced_after / invoiced_before: Keep only the rows invoiced in this range, where the files overlap.
+ASHFORD_SOURCES=[
+    {"file_name":"Ashford 2023 Labtrac Data.xlsx", "invoiced_before":"2023-11-1"},
+    {"file_name":"Ashford 2022 Labtrac Data.xlsx", "header":False, "add_dr_id":True},
+    {"file_name":"Ashford 2021 Labtrac Data.xlsx", "header":False},
+    {"file_name":"Ashford Data 2024_Jan_Apr Labtrac Data.xlsx", "header":False},
+    {"file_name":"Ashford 2023_Nov_Dec Labtrac Data.csv", "header":False, "date_formats":["%d/%m/%Y"], "invoiced_after":"2023-10-31"},
+]
+
+# Typed Parquet copies of Excel sources, rebuilt only when the source file changes
+SNAPSHOT_FOLDER_PATH="data/snapshots"
+# Worker processes used to build snapshots. None uses one per CPU.
+SNAPSHOT_WORKERS=None
+# Bump the version of a snapshot set whenever the function building its snapshots changes, so they are rebuilt
+SNAPSHOT_VERSION={
+    "densign":2,
+    "ashford":2,
+}
 NHS_MAPPING_FOLDER = "data/utils/mappings"
+# Sales whose product description contains one of these texts get its tag, if no ALS lab name or price list tags them
+TAGGING_DESCRIPTION_RULES={
+    "RISIO":"Private",
+}
+TAGGED_FOLDER_PATH="data/tagged/sales"
+# Rows of a combined file read, tagged and written at a time, so tagging memory does not grow with the file
+TAGGING_CHUNKSIZE=500000
+# Sales whose practice postcode matches an ALS lab's postcode at one of these levels are tagged as ALS lab sales, like
+# sales whose customer or practice name matches ALS_NAME_SEARCH_TERM: "exact", or also "outward" for the same
+# postcode district. Both levels are counted in the ALS lab match report either way.
+ALS_POSTCODE_TAG_MATCHES=["exact"]
 AESTHETIC_WORLD_NHS_CODE_DATA="data/utils/nhs.xlsx"
 AESTHETIC_WORLD_PRIVATE_CODE_DATA="data/utils/private codes.xlsx"
 WOODFORD_PRICE_LIST="data/utils/cus product price list.xls"
+# Rows of the Woodford price list sheet that hold products, as [start, stop) positions after the header row
+WOODFORD_PRICE_LIST_ROWS=[8, 789]
 ASHFORD_PRICE_LIST="data/utils/Copy of Copy of 2024 price list.xlsx"
 
+# Price lists of each lab, compiled into its NHS mapping and used to tag the combined files
+NHS_MAPPING_SOURCES={
+    "aesthetic_world":[AESTHETIC_WORLD_NHS_CODE_DATA, AESTHETIC_WORLD_PRIVATE_CODE_DATA],
+    "woodford":[WOODFORD_PRICE_LIST],
+    "ashford":[ASHFORD_PRICE_LIST],
+}
+# Compiled reference tables, rebuilt only when their source files change
+REFERENCE_FOLDER_PATH="data/reference"
+# Bump the version of a reference table whenever the function building it changes, so it is rebuilt
+REFERENCE_VERSION={
+    "aesthetic_world":1,
+    "woodford":1,
+    "ashford":1,
+}
+
 ALS_LABS_POSTCODES_DIC= {
     "aesthetic_world": {"name": "Aesthetic World", "postcode": "BL1 4SS"},
     "aplus": {"name": "A Plus", "postcode": "DD2 3SP"},
@@ -0,0 +1,46 @@
+import functools
+import re
+import numpy as np
+import pandas as pd
+from . import mysettings
+
+@functools.lru_cache(maxsize=None)
+def compile_name_pattern(terms: tuple) -> re.Pattern:
+    """
+    Compile search terms into a single case-insensitive alternation, longest term first so that e.g. "central dental
+    lab" is reported rather than "central dental". Compiled once per term list.
+    """
+    alternatives = sorted(set(terms), key=len, reverse=True)
+    return re.compile("|".join(re.escape(term) for term in alternatives), re.IGNORECASE)
+
+def match_names(values: pd.Series, terms=None) -> pd.Series:
+    """
+    Find the first search term each value contains, e.g. the ALS lab names in a customer name column. Each distinct
+    value is searched once, so the cost grows with the number of distinct names rather than rows times terms.
+    :param values: Series of names. Empty values match nothing.
+    :param terms: Search terms, matched as lowercase substrings (default mysettings.ALS_NAME_SEARCH_TERM).
+    :return matches: Series of the matched term (lowercase) per row, or NaN, aligned to values.
+    """
+    if terms is None:
+        terms = mysettings.ALS_NAME_SEARCH_TERM
+    pattern = compile_name_pattern(tuple(term.lower() for term in terms))
+
+    codes, uniques = pd.factorize(values)
+    labels = np.full(len(uniques) + 1, np.nan, dtype=object)
+    for i, value in enumerate(uniques):
+        match = pattern.search(str(value))
+        if match:
+            labels[i] = match.group(0).lower()
+    # factorize gives empty values the code -1, which picks the NaN label at the end
+    return pd.Series(labels[codes], index=values.index, dtype=object)
+
+def match_name_columns(df: pd.DataFrame, columns, terms=None) -> pd.Series:
+    """
+    match_names over several name columns, taking the match from the first column that has one.
+    :return matches: Series of the matched term per row, or NaN, aligned to df.
+    """
+    matches = None
+    for col in columns:
+        col_matches = match_names(df[col], terms)
+        matches = col_matches if matches is None else matches.fillna(col_matches)
+    return matches
@@ -1,5 +1,39 @@
+import os
+import re
+import numpy as np
 import pandas as pd
+from pathlib import Path
+from tqdm import tqdm
+from . import mysettings, io_utils, profiling, name_matching, dedup, manifest, reference_store, postcodes
 
+folder_path = mysettings.RAW_FOLDER_PATH
+
+def write_mapping(mapping: pd.DataFrame, lab: str, output_format=None):
+    """
+    Write an NHS-private mapping table for a lab to the NHS mapping folder.
+    :param mapping: DataFrame with product_code, product_description and nhs_or_private_mapping columns.
+    :param lab: Str lab key used as the file name, e.g. "woodford".
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :return output_file: Path of the written mapping file.
+    """
+    nhs_mapping_folder = Path(mysettings.NHS_MAPPING_FOLDER)
+    nhs_mapping_folder.mkdir(parents=True, exist_ok=True)
+    return io_utils.write_frame(mapping, f"{nhs_mapping_folder}/{lab}", output_format)
+
+def read_mapping(lab: str, columns=None, output_format=None) -> pd.DataFrame:
+    """
+    Read an NHS-private mapping table written by write_mapping.
+    :param lab: Str lab key used as the file name, e.g. "woodford".
+    :param columns: Optional list of columns to read.
+    :return mapping: DataFrame containing the mapping.
+    """
+    mapping_file = io_utils.get_output_file(f"{mysettings.NHS_MAPPING_FOLDER}/{lab}", output_format)
+    if io_utils.get_output_format(output_format) == "csv":
+        # Keep product codes such as 0012 as strings
+        return io_utils.read_frame(mapping_file, columns=columns, dtype=str)
+    return io_utils.read_frame(mapping_file, columns=columns)
+
+@profiling.profiled("nhs_mapping")
 def generate_aesthetic_world_nhs_private_mapping(
     aesthetic_world_nhs_codes, aesthetic_world_private_codes
 ):
@@ -38,17 +72,21 @@ def generate_aesthetic_world_nhs_private_mapping(
 
     return aesthetic_world_nhs_private_mapping
 
+@profiling.profiled("nhs_mapping")
 def generate_woodford_nhs_private_mapping(
-    woodford_price_list: pd.DataFrame
+    woodford_price_list, rows=None
 ):
     """
     Preprocess the NHS-private pricing lists for the Woodford lab (Labtrac).
-    :param aesthetic_world_nhs_codes: Raw list of NHS/Private codes for Woodford.
+    :param woodford_price_list: Raw list of NHS/Private codes for Woodford.
+    :param rows: [start, stop) positions of the rows holding products (default mysettings.WOODFORD_PRICE_LIST_ROWS).
     :return woodford_nhs_private_mapping: Preprocessed mapping of Woodford products to NHS and Private
     tags.
     """
+    if rows is None:
+        rows = mysettings.WOODFORD_PRICE_LIST_ROWS
     prices = pd.read_excel(woodford_price_list)
-    prices = prices.iloc[8:789, :]
+    prices = prices.iloc[rows[0]:rows[1], :]
     prices = prices[
         [
             "Product Price List 1 - Default",
@@ -72,104 +110,354 @@ def generate_woodford_nhs_private_mapping(
 
     return woodford_nhs_private_mapping
 
-def nhs_private_tag_ashford(
-    prep_data: pd.DataFrame, als_lab_postcodes_dict, ashford_price_list: pd.DataFrame
-):
+@profiling.profiled("nhs_mapping")
+def generate_ashford_nhs_private_mapping(ashford_price_list):
     """
-    Tag sales in lab-level preprocessed sales data from Ashford to whether they are from NHS end-customer orders or
-    private end-customer order.
-    :param prep_data: Dataframe containing lab-level preprocessed sales data from Ashford.
-    :param als_lab_postcodes_dict: Dict containing names and postcodes of ALS labs.
-    :param ashford_price_list: Prices list separating NHS and private sales in Ashford data.
-    :return tagged_data: DataFrame containing lab-level preprocessed data with sales tagged to NHS or private.
+    Preprocess the NHS-private price list for the Ashford lab (Labtrac).
+    :param ashford_price_list: Raw price list of Ashford products with their NHS or Private class.
+    :return ashford_nhs_private_mapping: Preprocessed mapping of Ashford products to NHS and Private tags.
     """
-    tagged_data = prep_data.copy(deep=True)
+    prices = pd.read_excel(ashford_price_list)
+    return get_ashford_nhs_private_mapping(prices)
 
-    # Unpack the ALS lab postcodes dict
-    als_df = pd.DataFrame.from_dict(als_lab_postcodes_dict, orient="index").reset_index(
-        drop=True
+def get_ashford_nhs_private_mapping(prices: pd.DataFrame) -> pd.DataFrame:
+    prices = prices[["ProductID", "Description", "Class"]].rename(
+        columns={
+            "ProductID": "product_code",
+            "Description": "product_description",
+            "Class": "nhs_or_private_mapping",
+        }
     )
+    for col in prices.columns:
+        prices[col] = prices[col].astype("string").str.strip()
+    return prices
 
-    # Check if the ship name roughly matches an ALS lab name
-    als_name_search_term_list = [
-        "leca",
-        "ashford",
-        "casterbridge",
-        "dental technique",
-        "cardiff ortho",
-        "woodford",
-        "dental excellence",
-        "passion",
-        "ceramics",
-        "denture centre",
-        "veus",
-        "precedental",
-        "ken poland",
-        "bristol crown",
-        "bristol cadcam",
-        "bristol cad-cam",
-        "iw dental",
-        "ip milling",
-        "reiner",
-        "halo",
-        "burke ortho",
-        "dent 8",
-        "dent8",
-        "densign",
-        "aesthetic world",
-        "aplus",
-        "a plus",
-        "oakview restorations",
-        "oakview",
-        "central dental",
-        "central dental lab",
-        "ceroplast",
-        "european dental lab",
-        "innovate",
-    ]
-    als_lab_data = tagged_data.copy(deep=True)
-    als_lab_data["practice_name_lower_case"] = als_lab_data["practice_name"].str.lower()
-    als_lab_data["customer_name_lower_case"] = als_lab_data["customer_name"].str.lower()
-    df_list = []
-    for substring in als_name_search_term_list:
-        df_list.append(
-            als_lab_data.loc[
-                (
-                    (als_lab_data["customer_name_lower_case"].str.contains(substring))
-                    | (als_lab_data["practice_name_lower_case"].str.contains(substring))
-                )
-            ]
+# Function compiling each lab's price lists (mysettings.NHS_MAPPING_SOURCES) into its NHS mapping
+lookup_mapping_function = {
+    "aesthetic_world": generate_aesthetic_world_nhs_private_mapping,
+    "woodford": generate_woodford_nhs_private_mapping,
+    "ashford": generate_ashford_nhs_private_mapping,
+}
+
+def get_mapping_build_kwargs(lab) -> dict:
+    if lab == "woodford":
+        return {"rows": list(mysettings.WOODFORD_PRICE_LIST_ROWS)}
+    return {}
+
+def compile_mappings(labs=None, output_format=None) -> dict:
+    """
+    Returns the NHS mapping of each lab from the reference store, compiling it from the lab's price lists
+    (mysettings.NHS_MAPPING_SOURCES) only when they changed since the last run. A recompiled mapping is also written
+    to the NHS mapping folder with write_mapping, to be checked by hand. Labs whose price lists are missing are
+    skipped with a warning.
+    :param labs: ALS lab keys (default every lab in mysettings.NHS_MAPPING_SOURCES).
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT), of the mappings written.
+    :return mappings: Dict of ALS lab key -> mapping DataFrame.
+    """
+    if labs is None:
+        labs = list(mysettings.NHS_MAPPING_SOURCES)
+
+    pipeline_manifest = manifest.PipelineManifest()
+    mappings = {}
+    for lab in labs:
+        source_files = mysettings.NHS_MAPPING_SOURCES[lab]
+        missing_files = [source_file for source_file in source_files if not Path(source_file).exists()]
+        if len(missing_files) > 0:
+            print(f"⚠️ No price list for {lab} at {missing_files}. Its sales are tagged without a price list.")
+            continue
+
+        mapping, rebuilt = reference_store.load_reference(
+            lab, source_files, lookup_mapping_function[lab], get_mapping_build_kwargs(lab), pipeline_manifest
         )
-    als_lab_data = pd.concat(df_list)
+        if rebuilt:
+            write_mapping(mapping, lab, output_format)
+        mappings[lab] = mapping
+    pipeline_manifest.save()
+    return mappings
+
+def get_lab_keys(als_lab: pd.Series) -> pd.Series:
+    """
+    Returns the key of mysettings.ALS_LABS_POSTCODES_DIC for each ALS lab name, e.g. "Aesthetic World" ->
+    "aesthetic_world", matched on the key or the lab's name. Names that are neither are lowercased with runs of
+    other characters replaced by "_". Each distinct name is looked up once.
+    """
+    lab_keys = {}
+    for key, lab in mysettings.ALS_LABS_POSTCODES_DIC.items():
+        lab_keys[normalize_lab_name(key)] = key
+        lab_keys.setdefault(normalize_lab_name(lab["name"]), key)
+
+    codes, uniques = pd.factorize(als_lab)
+    keys = np.array([lab_keys.get(normalize_lab_name(value), normalize_lab_name(value)) for value in uniques] + [""], dtype=object)
+    return pd.Series(keys[codes], index=als_lab.index, dtype=object)
+
+def normalize_lab_name(name) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_")
+
+def build_tagging_index(mappings: dict) -> pd.Series:
+    """
+    Build one (ALS lab key, product code) -> tag index from the mapping table of each lab.
+    :param mappings: Dict of ALS lab key (e.g. "woodford") -> DataFrame with product_code and nhs_or_private_mapping
+    columns, as written by write_mapping. Where a lab lists a product code twice, the first tag is used.
+    :return tagging_index: Series of tags with an (als_lab, product_code) MultiIndex.
+    """
+    frames = []
+    for lab, mapping in mappings.items():
+        frame = pd.DataFrame({
+            "als_lab": lab,
+            "product_code": dedup.normalize_text(mapping["product_code"]).to_numpy(dtype=object),
+            "tag": mapping["nhs_or_private_mapping"].to_numpy(dtype=object),
+        })
+        frames.append(frame.loc[(frame["product_code"] != "") & frame["tag"].notna()])
 
-    # Tag rows with similar addresses and names as ALS lab as a lab-related sale
-    als_lab_data["nhs_private_tag"] = "ALS Lab"
-    als_lab_data = als_lab_data.reset_index(drop=True)
-    tagged_data = tagged_data.merge(
-        als_lab_data[["order_uuid", "nhs_private_tag"]], on="order_uuid", how="left"
+    if len(frames) == 0:
+        return pd.Series([], index=pd.MultiIndex.from_arrays([[], []], names=["als_lab", "product_code"]), dtype=object)
+
+    index_df = pd.concat(frames, ignore_index=True)
+    duplicates = index_df.duplicated(subset=["als_lab", "product_code"])
+    if duplicates.any():
+        print(f"Tagging index: {duplicates.sum()} repeated product codes use their first tag")
+    index_df = index_df.loc[~duplicates]
+    return pd.Series(
+        index_df["tag"].to_numpy(), index=pd.MultiIndex.from_frame(index_df[["als_lab", "product_code"]]), dtype=object
     )
 
-    # Add in NHS and private tags from the Ashford prices list
-    ashford_price_list["ProductID"] = ashford_price_list["ProductID"].astype(str)
-    tagged_data = tagged_data.merge(
-        ashford_price_list, left_on="product_code", right_on="ProductID", how="left"
+def load_tagging_index(labs=None, output_format=None) -> pd.Series:
+    """
+    Load the NHS mapping of each lab from the reference store into a tagging index, see compile_mappings and
+    build_tagging_index.
+    :param labs: ALS lab keys whose mappings are loaded (default every lab in mysettings.NHS_MAPPING_SOURCES).
+    """
+    return build_tagging_index(compile_mappings(labs, output_format))
+
+def match_description_rules(descriptions: pd.Series, rules=None) -> pd.Series:
+    """
+    Returns the tag of the first rule whose text each product description contains, or NaN. Each distinct
+    description is checked once.
+    :param rules: Dict of text -> tag (default mysettings.TAGGING_DESCRIPTION_RULES), e.g. {"RISIO": "Private"}.
+    """
+    if rules is None:
+        rules = mysettings.TAGGING_DESCRIPTION_RULES
+
+    codes, uniques = pd.factorize(descriptions)
+    tags = np.full(len(uniques) + 1, np.nan, dtype=object)
+    for i, value in enumerate(uniques):
+        value = str(value)
+        for text, tag in rules.items():
+            if text in value:
+                tags[i] = tag
+                break
+    return pd.Series(tags[codes], index=descriptions.index, dtype=object)
+
+def get_als_lab_matches(df: pd.DataFrame, lab_postcodes=None) -> pd.DataFrame:
+    """
+    Find the sales that may be to another ALS lab, by name (name_matching.match_name_columns on the customer and
+    practice names) and by postcode (postcodes.match_lab_postcodes on practice_address_postcode). Columns the sales
+    do not have match nothing.
+    :param lab_postcodes: DataFrame returned by postcodes.build_lab_postcode_index (default built from
+    mysettings.ALS_LABS_POSTCODES_DIC).
+    :return matches: DataFrame aligned to df with name_match (the matched search term), postcode_match ("exact" or
+    "outward") and postcode_als_lab, NaN where nothing matched.
+    """
+    name_cols = [col for col in ["customer_name", "practice_name"] if col in df.columns]
+    if len(name_cols) > 0:
+        name_match = name_matching.match_name_columns(df, name_cols)
+    else:
+        name_match = pd.Series(None, index=df.index, dtype=object)
+
+    if "practice_address_postcode" in df.columns:
+        if lab_postcodes is None:
+            lab_postcodes = postcodes.build_lab_postcode_index()
+        postcode_matches = postcodes.match_lab_postcodes(df["practice_address_postcode"], lab_postcodes)
+    else:
+        postcode_matches = pd.DataFrame({"postcode_match": None, "postcode_als_lab": None}, index=df.index, dtype=object)
+
+    return postcode_matches.assign(name_match=name_match)[["name_match", "postcode_match", "postcode_als_lab"]]
+
+def is_als_lab_sale(als_matches: pd.DataFrame) -> pd.Series:
+    """
+    Whether each sale is tagged as an ALS lab sale: its name matches, or its postcode matches at one of the levels in
+    mysettings.ALS_POSTCODE_TAG_MATCHES.
+    """
+    return als_matches["name_match"].notna() | als_matches["postcode_match"].isin(mysettings.ALS_POSTCODE_TAG_MATCHES)
+
+def get_tags(df: pd.DataFrame, tagging_index: pd.Series, description_rules=None, als_matches=None) -> pd.Series:
+    """
+    Tag each sale as NHS, Private or an ALS lab sale, taking the first of:
+        1. "ALS Lab" if the customer or practice name or the practice postcode matches an ALS lab (is_als_lab_sale).
+        2. The tag of the sale's (ALS lab, product code) in the tagging index, i.e. the lab's price list class.
+        3. The tag of the first product description rule that matches, e.g. RISIO products are Private.
+        4. "Unknown".
+    :param df: Sales with als_lab and product_code columns, and optionally customer_name, practice_name,
+    practice_address_postcode and product_description.
+    :param tagging_index: Index built by build_tagging_index or load_tagging_index.
+    :param als_matches: DataFrame returned by get_als_lab_matches for df, if already found.
+    :return tags: Series of tags aligned to df.
+    """
+    if als_matches is None:
+        als_matches = get_als_lab_matches(df)
+    tags = pd.Series(np.where(is_als_lab_sale(als_matches), "ALS Lab", None), index=df.index, dtype=object)
+
+    keys = pd.MultiIndex.from_arrays(
+        [get_lab_keys(df["als_lab"]).to_numpy(), dedup.normalize_text(df["product_code"]).to_numpy(dtype=object)]
     )
-    tagged_data["nhs_private_tag"] = tagged_data["nhs_private_tag"].fillna(
-        tagged_data["Class"]
+    positions = tagging_index.index.get_indexer(keys)
+    price_list_tags = np.where(positions >= 0, tagging_index.to_numpy()[positions], None) if len(tagging_index) > 0 else None
+    if price_list_tags is not None:
+        tags = tags.where(tags.notna(), pd.Series(price_list_tags, index=df.index, dtype=object))
+
+    if "product_description" in df.columns:
+        tags = tags.where(tags.notna(), match_description_rules(df["product_description"], description_rules))
+
+    return tags.fillna("Unknown")
+
+def tag_sales(df: pd.DataFrame, tagging_index: pd.Series, description_rules=None, als_matches=None) -> pd.DataFrame:
+    """
+    Returns the sales with an nhs_private_tag column, see get_tags, and an als_postcode_match column recording
+    whether the practice postcode matched an ALS lab postcode exactly or on its outward code.
+    """
+    if als_matches is None:
+        als_matches = get_als_lab_matches(df)
+    return df.assign(
+        nhs_private_tag=get_tags(df, tagging_index, description_rules, als_matches),
+        als_postcode_match=als_matches["postcode_match"],
+    )
+
+def count_als_lab_matches(df: pd.DataFrame, als_matches: pd.DataFrame) -> pd.DataFrame:
+    """
+    Count how often the name and postcode checks of get_als_lab_matches agree, per ALS lab.
+    :return counts: DataFrame indexed by als_lab with the number of rows, of name matches, of exact and outward
+    postcode matches, and of rows matched by both checks, by name only and by postcode only.
+    """
+    name = als_matches["name_match"].notna()
+    postcode = als_matches["postcode_match"].notna()
+    counts = pd.DataFrame({
+        "als_lab": df["als_lab"].astype(object).to_numpy(),
+        "rows": 1,
+        "name_match": name.to_numpy(),
+        "postcode_exact": (als_matches["postcode_match"] == "exact").to_numpy(),
+        "postcode_outward": (als_matches["postcode_match"] == "outward").to_numpy(),
+        "name_and_postcode": (name & postcode).to_numpy(),
+        "name_only": (name & ~postcode).to_numpy(),
+        "postcode_only": (postcode & ~name).to_numpy(),
+    })
+    return counts.groupby("als_lab", dropna=False).sum()
+
+def write_als_lab_match_report(counts: pd.DataFrame, output_file=None) -> pd.DataFrame:
+    """
+    Write the counts of count_als_lab_matches with the agreement of the two checks (rows matched by both over rows
+    matched by either), by default to files/<raw folder>/als_lab_match_report.csv.
+    """
+    if output_file is None:
+        last_folder = os.path.basename(folder_path)
+        output_file = Path(f"files/{last_folder}/als_lab_match_report.csv")
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+    report = counts.reset_index()
+    either = report["name_and_postcode"] + report["name_only"] + report["postcode_only"]
+    report["agreement"] = (report["name_and_postcode"] / either.where(either > 0)).fillna(1.0)
+    report.to_csv(output_file, index=False)
+
+    totals = report.drop(columns=["als_lab", "agreement"]).sum()
+    print(
+        f"ALS lab matches: {totals['name_match']} by name, {totals['postcode_exact']} by exact and "
+        f"{totals['postcode_outward']} by outward postcode, {totals['name_and_postcode']} by both. "
+        f"Report written to {output_file}"
     )
+    return report
+
+def tag_file(file, output_file_stem, tagging_index, lab_postcodes=None, chunksize=None, output_format=None) -> tuple:
+    """
+    Tag a combined file chunksize rows at a time, writing each tagged chunk before the next one is read, so memory
+    use does not grow with the file.
+    :param file: Path of a combined CSV or Parquet file.
+    :param output_file_stem: Path of the tagged file without extension.
+    :param tagging_index: Index built by build_tagging_index or load_tagging_index.
+    :param lab_postcodes: DataFrame returned by postcodes.build_lab_postcode_index.
+    :param chunksize: Number of rows per chunk (default mysettings.TAGGING_CHUNKSIZE).
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :return output_file, tag_counts, match_counts: Path of the tagged file, Series of rows per tag, and the
+    count_als_lab_matches counts of the file.
+    """
+    if chunksize is None:
+        chunksize = mysettings.TAGGING_CHUNKSIZE
+    if lab_postcodes is None:
+        lab_postcodes = postcodes.build_lab_postcode_index()
+
+    tag_counts = pd.Series(dtype="int64")
+    match_counts = None
+    chunks = io_utils.read_frame_chunks(file, chunksize)
+    with io_utils.ChunkedFrameWriter(output_file_stem, output_format) as writer:
+        for chunk in profiling.profile_iter(chunks, "tag_read", file):
+            with profiling.stage("tag", file) as counts:
+                counts["rows_in"] = len(chunk)
+                als_matches = get_als_lab_matches(chunk, lab_postcodes)
+                chunk_match_counts = count_als_lab_matches(chunk, als_matches)
+                chunk = tag_sales(chunk, tagging_index, als_matches=als_matches)
+                counts["rows_out"] = len(chunk)
+            with profiling.stage("tag_write", file) as counts:
+                writer.write(chunk)
+                counts["rows_out"] = len(chunk)
 
-    # Mark all RISIO sales as private
-    tagged_data.loc[
-        tagged_data["product_description"].str.contains("RISIO"), "nhs_private_tag"
-    ] = "Private"
+            tag_counts = tag_counts.add(chunk["nhs_private_tag"].value_counts(), fill_value=0)
+            if match_counts is None:
+                match_counts = chunk_match_counts
+            else:
+                match_counts = match_counts.add(chunk_match_counts, fill_value=0)
 
-    tagged_data.loc[
-        tagged_data["nhs_private_tag"].isna() == True, "nhs_private_tag"
-    ] = "Unknown"
+    return writer.output_file, tag_counts.astype("int64"), match_counts
 
-    # Drop extraneous columns
-    tagged_data = tagged_data.drop(
-        columns=["ProductID", "Description", "Price 2024", "Class"]
+@profiling.profiled("nhs_mapping")
+def tag_combined_files(output_folder=None, labs=None, output_format=None, chunksize=None):
+    """
+    Tag every combined file in mysettings.COMBINED_FOLDER_PATH with one tagging index holding every lab's mapping,
+    streaming each file chunk by chunk (see tag_file) to output_folder (default mysettings.TAGGED_FOLDER_PATH), and
+    report how the ALS lab name and postcode checks agree.
+    :param labs: ALS lab keys whose mappings are used (default every lab in mysettings.NHS_MAPPING_SOURCES).
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT), of the mappings and the output.
+    :param chunksize: Number of rows tagged at a time (default mysettings.TAGGING_CHUNKSIZE).
+    :return output_files: List of the tagged files written.
+    """
+    if output_folder is None:
+        output_folder = mysettings.TAGGED_FOLDER_PATH
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    tagging_index = load_tagging_index(labs, output_format)
+    lab_postcodes = postcodes.build_lab_postcode_index()
+
+    output_files = []
+    match_counts = []
+    # Only the combined files of this run's output format, as files left from runs in the other format are stale
+    suffix = io_utils.OUTPUT_FORMAT_SUFFIX[io_utils.get_output_format(output_format)]
+    combined_files = sorted(
+        file for file in Path(mysettings.COMBINED_FOLDER_PATH).iterdir() if io_utils.is_data_file(file) and file.suffix == suffix
     )
+    for file in tqdm(combined_files):
+        print(f"Tagging {file}")
+        output_file, tag_counts, file_match_counts = tag_file(
+            file, f"{output_folder}/tagged_{file.stem}", tagging_index, lab_postcodes, chunksize, output_format
+        )
+        output_files.append(output_file)
+        if file_match_counts is not None:
+            match_counts.append(file_match_counts)
+        print(tag_counts.sort_values(ascending=False).to_string())
+
+    if len(match_counts) > 0:
+        write_als_lab_match_report(pd.concat(match_counts).groupby(level=0, dropna=False).sum().astype("int64"))
+    return output_files
 
-    return tagged_data
+@profiling.profiled("nhs_mapping")
+def nhs_private_tag_ashford(
+    prep_data: pd.DataFrame, als_lab_postcodes_dict, ashford_price_list: pd.DataFrame
+):
+    """
+    Tag sales in lab-level preprocessed sales data from Ashford to whether they are from NHS end-customer orders or
+    private end-customer order, see get_tags.
+    :param prep_data: Dataframe containing lab-level preprocessed sales data from Ashford.
+    :param als_lab_postcodes_dict: Dict containing names and postcodes of ALS labs.
+    :param ashford_price_list: Prices list separating NHS and private sales in Ashford data.
+    :return tagged_data: DataFrame containing lab-level preprocessed data with sales tagged to NHS or private.
+    """
+    tagging_index = build_tagging_index({"ashford": get_ashford_nhs_private_mapping(ashford_price_list)})
+    als_matches = get_als_lab_matches(prep_data, postcodes.build_lab_postcode_index(als_lab_postcodes_dict))
+    # The price list applies to every row, whichever lab name the rows carry
+    tags = get_tags(prep_data.assign(als_lab="ashford"), tagging_index, als_matches=als_matches)
+    return prep_data.assign(nhs_private_tag=tags)
@@ -0,0 +1,73 @@
+import re
+import numpy as np
+import pandas as pd
+from . import mysettings
+
+# A UK postcode without spaces: the outward code (area and district) then the 3 character inward code
+UK_POSTCODE = re.compile(r"^([A-Z]{1,2}[0-9][A-Z0-9]?)([0-9][A-Z]{2})$")
+
+def split_postcode(postcode) -> tuple:
+    """
+    Normalize a postcode (uppercase, spaces and punctuation removed) and split it into its outward and inward codes.
+    :return postcode, outward, inward: The normalized postcode, or None if empty. outward and inward are None for
+    values that are not UK postcodes, e.g. Irish Eircodes, which can then only match exactly.
+    """
+    if postcode is None or (isinstance(postcode, float) and np.isnan(postcode)):
+        return None, None, None
+    normalized = re.sub(r"[^A-Z0-9]", "", str(postcode).upper())
+    if normalized == "":
+        return None, None, None
+    match = UK_POSTCODE.match(normalized)
+    if match is None:
+        return normalized, None, None
+    return normalized, match.group(1), match.group(2)
+
+def normalize_postcodes(values: pd.Series) -> pd.DataFrame:
+    """
+    split_postcode for a column of postcodes, each distinct value being split once.
+    :return postcodes: DataFrame with postcode, outward and inward columns aligned to values.
+    """
+    codes, uniques = pd.factorize(values)
+    parts = np.array([split_postcode(value) for value in uniques] + [(None, None, None)], dtype=object).reshape(-1, 3)
+    return pd.DataFrame(parts[codes], index=values.index, columns=["postcode", "outward", "inward"])
+
+def build_lab_postcode_index(als_lab_postcodes_dict=None) -> pd.DataFrame:
+    """
+    Normalize the postcode of every ALS lab.
+    :param als_lab_postcodes_dict: Dict of ALS lab key -> {name, postcode} (default mysettings.ALS_LABS_POSTCODES_DIC).
+    :return lab_postcodes: DataFrame with als_lab_key, postcode, outward and inward columns.
+    """
+    if als_lab_postcodes_dict is None:
+        als_lab_postcodes_dict = mysettings.ALS_LABS_POSTCODES_DIC
+
+    lab_postcodes = pd.DataFrame.from_dict(als_lab_postcodes_dict, orient="index")
+    lab_postcodes = lab_postcodes.rename_axis("als_lab_key").reset_index()
+    return pd.concat(
+        [lab_postcodes[["als_lab_key"]], normalize_postcodes(lab_postcodes["postcode"])], axis=1
+    ).dropna(subset="postcode")
+
+def match_lab_postcodes(values: pd.Series, lab_postcodes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Match postcodes against the ALS lab postcodes, first on the whole postcode and otherwise on the outward code.
+    Where several labs share an outward code (e.g. DY8), the first lab is reported.
+    :param values: Series of postcodes, e.g. practice_address_postcode.
+    :param lab_postcodes: DataFrame returned by build_lab_postcode_index.
+    :return matches: DataFrame aligned to values with postcode_match ("exact", "outward" or NaN) and
+    postcode_als_lab (the matched ALS lab key or NaN).
+    """
+    postcodes = normalize_postcodes(values)
+    exact_labs = lab_postcodes.drop_duplicates(subset="postcode")
+    outward_labs = lab_postcodes.dropna(subset="outward").drop_duplicates(subset="outward")
+
+    exact = pd.Index(exact_labs["postcode"]).get_indexer(postcodes["postcode"])
+    outward = pd.Index(outward_labs["outward"]).get_indexer(postcodes["outward"])
+
+    match = np.full(len(values), None, dtype=object)
+    als_lab = np.full(len(values), None, dtype=object)
+    is_outward = outward >= 0
+    match[is_outward] = "outward"
+    als_lab[is_outward] = outward_labs["als_lab_key"].to_numpy()[outward[is_outward]]
+    is_exact = exact >= 0
+    match[is_exact] = "exact"
+    als_lab[is_exact] = exact_labs["als_lab_key"].to_numpy()[exact[is_exact]]
+    return pd.DataFrame({"postcode_match": match, "postcode_als_lab": als_lab}, index=values.index)
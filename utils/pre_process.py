@@ -1,8 +1,9 @@
 from pathlib import Path
 import os
 import pandas as pd
-from . import pre_process_function, mysettings
+from . import pre_process_function, mysettings, manifest, io_utils, encoding, dates, profiling, dedup
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 folder_path = mysettings.RAW_FOLDER_PATH
 
@@ -34,73 +35,444 @@ def get_folder_names(folder_path):
 
 combine_lookup = mysettings.LOOKUP_COMBINE_PREPROCESS_FUNCTION
 
-def preprocess (df):
-    #Get the preprocess function for each file
+def make_preprocess_record(file_path, schema_type, als_lab, status="not processed", **fields) -> dict:
+    """
+    Returns the report record of a file in the file_with_schema manifest, with every field the preprocess report has.
+    :param status: "not processed", "processed", "unchanged" or "error".
+    :param fields: Values of the other fields, e.g. func_name, output_file, encoding or error. Fields not given are
+    None.
+    """
+    record = {
+        "file_name": str(file_path),
+        "schema_type": schema_type,
+        "als_lab": als_lab,
+        "status": status,
+        "func_name": None,
+        "output_file": None,
+        "encoding": None,
+        "error": None,
+        "date_values": None,
+        "date_sentinels": None,
+        "date_failures": None,
+    }
+    record.update(fields)
+    return record
+
+def preprocess_file(file_path, schema_type, als_lab, output_format=None, chunksize=None):
+    """
+    Preprocess a single file from the file_with_schema manifest and write the output to the pre_processed folder.
+    :param file_path: Path of the raw CSV file.
+    :param schema_type: Schema key assigned to the file by utils.get_csv_schema.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :param chunksize: If set, read, preprocess and write the file chunksize rows at a time.
+    :return record: Dict describing whether the file was processed and where the output was written.
+    """
     last_folder = os.path.basename(folder_path)
-    no_of_files = len(df)
-    for i in tqdm(range (len(df))):
-        file_path = df.iloc[i,0]
-        schema_type = df.iloc[i,1]
-        als_lab = df.iloc[i,2]
-
-        print(f'preprocess file {i+1} of {no_of_files} [{file_path}]')
-        processed_df, func_name = pre_process_function.preprocess(file_path,schema_type,als_lab)
-
-        if processed_df is not None:
-            parent_folder, file_name = get_als_lab_folder_name_and_file_name(file_path)   
-            combine_folder = combine_lookup.get(func_name, "combine")         
-            if parent_folder:
-                output_folder = Path(f"data/pre_processed/{last_folder}/{combine_folder}/{parent_folder}")
+    record = make_preprocess_record(file_path, schema_type, als_lab)
+
+    # Date parse stats are collected per file, so they are returned with the record from worker processes
+    dates.date_stats.clear()
+    try:
+        record["encoding"] = encoding.get_encoding(file_path)
+        result = pre_process_function.preprocess(file_path,schema_type,als_lab,chunksize)
+    except Exception as e:
+        print(f"Error preprocessing file {file_path}: {e}")
+        record["status"] = "error"
+        record["error"] = repr(e)
+        return record
+
+    if result is None:
+        print(f"file not processed {file_path}")
+        return record
+
+    processed_df, func_name = result
+    parent_folder, file_name = get_als_lab_folder_name_and_file_name(file_path)
+    combine_folder = combine_lookup.get(func_name, "combine")
+    if parent_folder:
+        output_folder = Path(f"data/pre_processed/{last_folder}/{combine_folder}/{parent_folder}")
+    else:
+        output_folder = Path(f"data/pre_processed/{last_folder}/{combine_folder}")
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+    if chunksize:
+        # The chunks are only read and preprocessed as they are written, so errors can still happen here
+        try:
+            with io_utils.ChunkedFrameWriter(f"{output_folder}/{file_name}", output_format) as writer:
+                for chunk in processed_df:
+                    with profiling.stage("write", file_path, func_name) as counts:
+                        writer.write(chunk)
+                        counts["rows_out"] = len(chunk)
+        except Exception as e:
+            print(f"Error preprocessing file {file_path}: {e}")
+            record["status"] = "error"
+            record["error"] = repr(e)
+            return record
+        preprocessed_output_file = writer.output_file
+    else:
+        with profiling.stage("write", file_path, func_name) as counts:
+            preprocessed_output_file = io_utils.write_frame(processed_df, f"{output_folder}/{file_name}", output_format)
+            counts["rows_out"] = len(processed_df)
+
+    date_totals = dates.get_date_totals()
+    record["status"] = "processed"
+    record["func_name"] = func_name
+    record["output_file"] = preprocessed_output_file
+    record["date_values"] = date_totals["values"]
+    record["date_sentinels"] = date_totals["sentinels"]
+    record["date_failures"] = date_totals["failed"]
+    return record
+
+def preprocess_lab_files(rows, output_format=None, chunksize=None):
+    """
+    Preprocess every manifest row belonging to one ALS lab, one file at a time. Used as the unit of work for the
+    process pool so that each worker only holds a single lab's file in memory.
+    :param rows: List of (file_path, schema_type, als_lab) tuples.
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :param chunksize: If set, each file is processed chunksize rows at a time.
+    :return records, profile_records: List of per-file report dicts, and the profiling stage records of the files,
+    to be merged into the main process's run report.
+    """
+    records = [
+        preprocess_file(file_path, schema_type, als_lab, output_format, chunksize)
+        for file_path, schema_type, als_lab in rows
+    ]
+    return records, profiling.pop_records()
+
+def write_preprocess_report(records):
+    last_folder = os.path.basename(folder_path)
+    output_folder = Path(f"files/{last_folder}")
+    # Create the output folder if it doesn't exist
+    output_folder.mkdir(parents=True, exist_ok=True)
+    report_df = pd.DataFrame(records)
+    report_df.to_csv(f"{output_folder}/preprocess_report.csv", index=False)
+
+    if len(report_df) > 0:
+        print(report_df.groupby("status").size().to_string())
+        fallback_files = (report_df["encoding"] == encoding.FALLBACK_ENCODING).sum()
+        print(f"preprocess: {fallback_files} of {len(report_df)} files read as {encoding.FALLBACK_ENCODING}")
+
+        # Date parse rates per lab, for the files processed in this run
+        date_df = report_df.dropna(subset="date_values")
+        date_df = date_df.groupby("als_lab")[["date_values", "date_failures", "date_sentinels"]].sum()
+        date_df = date_df.loc[date_df["date_values"] > 0]
+        for als_lab, row in date_df.iterrows():
+            print(dates.format_parse_rate(
+                f"preprocess {als_lab}", int(row["date_values"]), int(row["date_failures"]), int(row["date_sentinels"])
+            ))
+
+    return report_df
+
+def get_preprocess_function_version(schema_type):
+    func = pre_process_function.lookup_preprocess_function.get(schema_type)
+    if func is None:
+        return None, None
+    return func.__name__, mysettings.PREPROCESS_FUNCTION_VERSION.get(func.__name__)
+
+def remove_stale_preprocess_outputs(pipeline_manifest, current_files):
+    """
+    Delete the preprocessed output of any file recorded in the manifest that is no longer in the raw folder, so it
+    drops out of the combined files.
+    """
+    for key in pipeline_manifest.keys("preprocess"):
+        if key not in current_files:
+            recorded = pipeline_manifest.remove("preprocess", key)
+            output_file = recorded.get("output_file")
+            if output_file and Path(output_file).exists():
+                print(f"Removing preprocessed output of deleted file {key}")
+                Path(output_file).unlink()
+
+def update_preprocess_manifest(pipeline_manifest, records, file_hashes, output_format):
+    for record in records:
+        file_name = record["file_name"]
+        previous = pipeline_manifest.get("preprocess", file_name)
+
+        if record["status"] != "processed":
+            pipeline_manifest.remove("preprocess", file_name)
+            continue
+
+        # The file may now map to a different combine folder, in which case the old output must not be combined
+        if previous and previous.get("output_file") != record["output_file"] and Path(previous["output_file"]).exists():
+            Path(previous["output_file"]).unlink()
+
+        pipeline_manifest.record(
+            "preprocess",
+            file_name,
+            hash=file_hashes[file_name],
+            schema_type=record["schema_type"],
+            func_name=record["func_name"],
+            func_version=mysettings.PREPROCESS_FUNCTION_VERSION.get(record["func_name"]),
+            output_format=output_format,
+            output_file=record["output_file"],
+        )
+
+@profiling.profiled("preprocess")
+def preprocess (df, workers=None, incremental=False, output_format=None, chunksize=None):
+    """
+    Preprocess every file in the file_with_schema manifest.
+    :param df: DataFrame returned by utils.get_csv_schema (file_name, schema_type, system_source).
+    :param workers: Number of worker processes. When None or 1 the files are processed serially, otherwise the
+    manifest rows are grouped by ALS lab and the groups are spread across a process pool.
+    :param incremental: If True, only preprocess files whose content hash, schema or preprocess function version
+    changed since the last run, and remove the outputs of files that no longer exist.
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :param chunksize: Number of rows read and preprocessed at a time, bounding the memory used per file. Defaults to
+    mysettings.PREPROCESS_CHUNKSIZE; when None each file is processed whole.
+    :return report_df: DataFrame with one row per file recording whether it was processed.
+    """
+    rows = [(df.iloc[i,0], df.iloc[i,1], df.iloc[i,2]) for i in range(len(df))]
+    records = []
+    output_format = io_utils.get_output_format(output_format)
+    if chunksize is None:
+        chunksize = mysettings.PREPROCESS_CHUNKSIZE
+
+    pipeline_manifest = manifest.PipelineManifest()
+    file_hashes = {str(row[0]): pipeline_manifest.hash(row[0]) for row in rows}
+
+    if incremental:
+        remove_stale_preprocess_outputs(pipeline_manifest, file_hashes)
+        changed_rows = []
+        for file_path, schema_type, als_lab in rows:
+            func_name, func_version = get_preprocess_function_version(schema_type)
+            recorded = pipeline_manifest.get("preprocess", file_path)
+            if func_name and pipeline_manifest.is_unchanged(
+                "preprocess", file_path, hash=file_hashes[str(file_path)], schema_type=schema_type, func_version=func_version,
+                output_format=output_format,
+            ):
+                records.append(make_preprocess_record(
+                    file_path, schema_type, als_lab, "unchanged", func_name=func_name,
+                    output_file=recorded["output_file"], encoding=encoding.get_encoding(file_path),
+                ))
             else:
-                output_folder = Path(f"data/pre_processed/{last_folder}/{combine_folder}")
+                changed_rows.append((file_path, schema_type, als_lab))
+        print(f'{len(changed_rows)} of {len(rows)} files are new or changed')
+        rows = changed_rows
 
-            output_folder.mkdir(parents=True, exist_ok=True) 
-            preprocessed_output_file = f"{output_folder}/{file_name}.csv"            
-            processed_df.to_csv(preprocessed_output_file, index=False)  
-        else:
-            print(f"file not processed {file_path}")           
+    no_of_files = len(rows)
+    processed_records = []
+
+    if not workers or workers <= 1:
+        for i, row in enumerate(tqdm(rows)):
+            print(f'preprocess file {i+1} of {no_of_files} [{row[0]}]')
+            processed_records.append(preprocess_file(*row, output_format, chunksize))
+    else:
+        # Group the files by ALS lab so that each task only works through one lab's files
+        lab_groups = {}
+        for row in rows:
+            lab_groups.setdefault(row[2], []).append(row)
+
+        print(f'preprocess {no_of_files} files from {len(lab_groups)} labs using {workers} workers')
+        with ProcessPoolExecutor(max_workers=workers, initializer=profiling.clear_records) as executor:
+            futures = {executor.submit(preprocess_lab_files, lab_rows, output_format, chunksize): als_lab for als_lab, lab_rows in lab_groups.items()}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                als_lab = futures[future]
+                try:
+                    lab_records, profile_records = future.result()
+                    processed_records.extend(lab_records)
+                    profiling.merge_records(profile_records)
+                except Exception as e:
+                    # The worker itself failed (e.g. ran out of memory), so mark every file of the lab as failed
+                    print(f"Error preprocessing files for {als_lab}: {e}")
+                    for file_path, schema_type, _ in lab_groups[als_lab]:
+                        processed_records.append(
+                            make_preprocess_record(file_path, schema_type, als_lab, "error", error=repr(e))
+                        )
+
+    update_preprocess_manifest(pipeline_manifest, processed_records, file_hashes, output_format)
+    pipeline_manifest.save()
+
+    # Files read in worker processes were detected there, so keep their encodings for later stages and runs
+    for record in processed_records:
+        if record["encoding"] and Path(record["file_name"]).exists():
+            encoding.set_encoding(record["file_name"], record["encoding"])
+    encoding.save_encoding_cache()
+
+    return write_preprocess_report(records + processed_records)
     
-def preprocess_ashford():
+@profiling.profiled("preprocess")
+def preprocess_ashford(output_format=None):
     processed_df = pre_process_function.preprocess_labtrac_ashford()
 
     output_folder = Path(f"data/pre_processed/sales/Ashford")
     output_folder.mkdir(parents=True, exist_ok=True) 
-    preprocessed_output_file = f"{output_folder}/ashford_preprocess.csv"            
-    processed_df.to_csv(preprocessed_output_file, index=False)  
+    output_file = io_utils.write_frame(processed_df, f"{output_folder}/ashford_preprocess", output_format)
+    dates.report_date_stats("Ashford")
+    return output_file
 
-def preprocess_densign():
+@profiling.profiled("preprocess")
+def preprocess_densign(output_format=None):
     processed_df = pre_process_function.preprocess_evident_densign("Densign")
 
     output_folder = Path(f"data/pre_processed/sales/Densign")
     output_folder.mkdir(parents=True, exist_ok=True) 
-    preprocessed_output_file = f"{output_folder}/densign_preprocess.csv"            
-    processed_df.to_csv(preprocessed_output_file, index=False) 
+    return io_utils.write_frame(processed_df, f"{output_folder}/densign_preprocess", output_format)
+
+def read_preprocessed_file(file):
+    if Path(file).suffix.lower() == ".parquet":
+        return pd.read_parquet(file)
+    return encoding.read_csv(file)
+
+def combine_files(input_files, output_file, output_format=None, dedup_index=None, append=False):
+    """
+    Stream a group of preprocessed files into a single combined file, holding only one input file in memory at a
+    time. The columns are reconciled once across the group from the file headers (e.g. Labtrac files with and
+    without product_category), in order of first appearance, and files missing a column get empty values for it.
+    :param input_files: List of preprocessed CSV or Parquet file paths.
+    :param output_file: Path of the combined file.
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :param dedup_index: Optional dedup.DedupIndex. Rows whose business key was already written, by an earlier file
+    or an earlier run when appending, are dropped.
+    :param append: If True, append the files to an existing combined CSV file with the same columns instead.
+    :return rows: Number of data rows written.
+    """
+    if io_utils.get_output_format(output_format) == "parquet":
+        return io_utils.concat_to_parquet(
+            input_files, output_file, dedup_index.filter_table if dedup_index is not None else None
+        )
+
+    if append:
+        return append_files(input_files, output_file, dedup_index)
+
+    columns = []
+    for file in input_files:
+        for col in io_utils.read_columns(file):
+            if col not in columns:
+                columns.append(col)
+
+    # Write to a temporary file first so a failed run never leaves a half-written combined file behind
+    tmp_output_file = f"{output_file}.tmp"
+    with open(tmp_output_file, "w", encoding="utf-8", newline="") as f:
+        if len(input_files) > 0:
+            f.write(pd.DataFrame(columns=columns).to_csv(index=False))
+        rows = write_combined_rows(f, input_files, columns, dedup_index)
+
+    os.replace(tmp_output_file, output_file)
+    return rows
+
+def write_combined_rows(f, input_files, columns, dedup_index=None):
+    rows = 0
+    for file in input_files:
+        df = read_preprocessed_file(file)
+        if dedup_index is not None:
+            df = df.loc[dedup_index.keep_mask(df, file)]
+        df.reindex(columns=columns).to_csv(f, index=False, header=False)
+        rows += len(df)
+    return rows
+
+def append_files(input_files, output_file, dedup_index=None):
+    """
+    Append preprocessed files to a combined CSV file in place. If writing fails the file is truncated back to its
+    previous size, so it is never left half-written.
+    :return rows: Number of data rows appended.
+    """
+    columns = io_utils.read_columns(output_file)
+    size = Path(output_file).stat().st_size
+    with open(output_file, "a", encoding="utf-8", newline="") as f:
+        try:
+            return write_combined_rows(f, input_files, columns, dedup_index)
+        except BaseException:
+            f.truncate(size)
+            raise
+
+def get_appendable_files(recorded, inputs, output_file, output_format=None):
+    """
+    Returns the input files that can be appended to a combined file built with dedup in an earlier run: the files
+    combined then must all be unchanged, and the new files must not add columns. Returns None when the combined file
+    has to be rebuilt instead.
+    :param recorded: The combine folder's record in the pipeline manifest.
+    :param inputs: List of [path, size, mtime] of the current input files.
+    """
+    if (
+        io_utils.get_output_format(output_format) != "csv"
+        or recorded is None
+        or recorded.get("dedup_key") != mysettings.DEDUP_KEY_COLUMNS
+        or recorded.get("output_file") != output_file
+        or not Path(output_file).exists()
+        or not Path(recorded.get("dedup_index", "")).is_file()
+    ):
+        return None
+
+    previous_inputs = {tuple(value) for value in recorded["inputs"]}
+    current_inputs = {tuple(value) for value in inputs}
+    if not previous_inputs <= current_inputs or previous_inputs == current_inputs:
+        return None
+
+    new_files = [Path(value[0]) for value in inputs if tuple(value) not in previous_inputs]
+    columns = set(io_utils.read_columns(output_file))
+    if any(not set(io_utils.read_columns(file)) <= columns for file in new_files):
+        return None
+    return new_files
+
+@profiling.profiled("combine")
+def combine_preprocess(incremental=False, output_format=None, drop_overlap=None):
+    """
+    Combine the preprocessed files in each combine folder into a single combined_<folder> file.
+    :param incremental: If True, only rebuild the combined files whose set of preprocessed input files (by path,
+    size and modification time) changed since the last run. When drop_overlap is on and files were only added, they are
+    appended to the combined CSV file, checked against the dedup index saved with it.
+    :param output_format: "csv" or "parquet" (default mysettings.OUTPUT_FORMAT).
+    :param drop_overlap: Whether to drop the rows of overlapping extracts, see dedup.DedupIndex (default
+    mysettings.DEDUP_COMBINE). The overlap per lab is written to files/<raw folder>/dedup_report.csv.
+    """
+    if drop_overlap is None:
+        drop_overlap = mysettings.DEDUP_COMBINE
+    dedup_key = mysettings.DEDUP_KEY_COLUMNS if drop_overlap else None
 
-def combine_preprocess():
-    valid_extensions = (".csv")
     last_folder = os.path.basename(folder_path)
     preprocessed_folder_path = Path(f"data/pre_processed/{last_folder}")
     preprocessed_folder_names = get_folder_names(preprocessed_folder_path)
+    pipeline_manifest = manifest.PipelineManifest()
+    dedup_stats = {}
 
     for folder_name in tqdm(preprocessed_folder_names):
-        print(f'Combining data in {folder_name}')
         combine_preprocessed_folder_path = Path(f"{preprocessed_folder_path}/{folder_name}")
-        combine_df =  pd.DataFrame()
+        combined_output_folder = Path(f"data/pre_processed_combined/{last_folder}")
+        combined_output_file = io_utils.get_output_file(f"{combined_output_folder}/combined_{folder_name}", output_format)
 
-        for file in combine_preprocessed_folder_path.rglob("*"):
-            if file.is_file() and file.suffix.lower() in valid_extensions:  
-                try:
-                    df = pd.read_csv(file, encoding="utf-8")  # Try UTF-8 first
-                except UnicodeDecodeError:
-                    print(f"⚠️ Encoding error in file: {file}. Retrying with Latin-1.")
-                    df = pd.read_csv(file, encoding="latin-1")  # Use Latin-1 as fallback
+        input_files = sorted(
+            file for file in combine_preprocessed_folder_path.rglob("*") if io_utils.is_data_file(file)
+        )
+        inputs = [[str(file), file.stat().st_size, file.stat().st_mtime] for file in input_files]
+        recorded = pipeline_manifest.get("combine", folder_name)
 
-                combine_df = pd.concat([combine_df,df])
-        
-        combined_output_folder = Path(f"data/pre_processed_combined/{last_folder}")
-        combined_output_folder.mkdir(parents=True, exist_ok=True) 
-        combined_output_file = f"{combined_output_folder}/combined_{folder_name}.csv"            
-        combine_df.to_csv(combined_output_file, index=False) 
+        if incremental and pipeline_manifest.is_unchanged(
+            "combine", folder_name, inputs=inputs, output_file=combined_output_file, dedup_key=dedup_key
+        ):
+            print(f'Skipping {folder_name}, no preprocessed files changed')
+            if drop_overlap:
+                dedup_stats[folder_name] = recorded.get("dedup_stats", {})
+            continue
+
+        append_input_files = None
+        if incremental and drop_overlap:
+            append_input_files = get_appendable_files(recorded, inputs, combined_output_file, output_format)
 
+        dedup_index = None
+        if append_input_files is not None:
+            print(f'Appending {len(append_input_files)} new files to {folder_name}')
+            dedup_index = dedup.DedupIndex.load(folder_name, recorded["dedup_index"], recorded.get("dedup_stats"))
+        else:
+            print(f'Combining data in {folder_name}')
+            if drop_overlap:
+                dedup_index = dedup.DedupIndex(folder_name)
+
+        combined_output_folder.mkdir(parents=True, exist_ok=True) 
+        with profiling.stage("combine_file", combined_output_file) as counts:
+            if append_input_files is not None:
+                counts["rows_out"] = combine_files(append_input_files, combined_output_file, output_format, dedup_index, append=True)
+            else:
+                counts["rows_out"] = combine_files(input_files, combined_output_file, output_format, dedup_index)
+            if dedup_index is not None:
+                dedup_index.save()
 
+        values = {"inputs": inputs, "output_file": combined_output_file, "dedup_key": dedup_key}
+        if dedup_index is not None:
+            values["dedup_index"] = str(dedup_index.index_file)
+            values["dedup_stats"] = dedup_index.stats
+            dedup_stats[folder_name] = dedup_index.stats
+        pipeline_manifest.record("combine", folder_name, **values)
 
+    pipeline_manifest.save()
+    encoding.report_encoding_stats("combine")
+    if drop_overlap:
+        dedup.write_stats_report(dedup_stats)
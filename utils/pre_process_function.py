@@ -1,779 +1,502 @@
 import pandas as pd
 import numpy as np
-import uuid
 import os
 from pathlib import Path
 import dateutil.parser as dparser
 from tqdm import tqdm
+from . import row_id, encoding, schema_utils, mapping, dates, validation, snapshot, mysettings, profiling
 
-def preprocess (file_path,schema_type,als_lab):
-    func = lookup_preprocess_function.get(schema_type)  # Get function from dictionary
+def labtrac_new_keeps_product_category(file_path) -> bool:
+    """
+    Decide up front whether preprocess_labtrac_new keeps the product_category column for a whole file, by reading
+    only the invoice date and category columns. Mirrors the check in preprocess_labtrac_new for chunked processing.
+    """
+    df = encoding.read_csv(
+        file_path, usecols=lambda col: col in ("Date", "CompletedDate", "Category"), dtype=str
+    )
+    df = df.rename(columns={"Date": "CompletedDate"})
+    df = df.dropna(subset="CompletedDate")
+    df = df.loc[~dates.is_sentinel_date(df["CompletedDate"])]
+    return not df["Category"].isnull().any()
 
-    if func: 
-        try:
-            df = pd.read_csv(file_path, low_memory=False, encoding="utf-8") # Try UTF-8 first
-        except UnicodeDecodeError:
-            print(f"⚠️ Encoding error in file: {file_path}. Retrying with Latin-1.")
-            df = pd.read_csv(file_path, low_memory=False, encoding="latin-1")  # Use Latin-1 as fallback
+def prime_date_formats(file_path, spec, als_lab):
+    """
+    Infer the format of each date column of a spec from the whole file, reading only those columns, and cache it in
+    dates.date_format_cache. Used before processing a file in chunks, so every chunk is parsed with the same format
+    even if the first chunk alone is ambiguous between day first and month first dates.
+    """
+    raw_date_cols = {}
+    for raw_col, col in spec.get("rename", {}).items():
+        if col in spec.get("dates", {}):
+            raw_date_cols[raw_col] = col
+    for col in spec.get("dates", {}):
+        raw_date_cols.setdefault(col, col)
+    if len(raw_date_cols) == 0 or spec.get("columns"):
+        return
+
+    df = encoding.read_csv(file_path, usecols=lambda col: col in raw_date_cols, dtype=str)
+    for raw_col in df.columns:
+        col = raw_date_cols[raw_col]
+        values = df[raw_col].dropna()
+        values = values.loc[~dates.is_sentinel_date(values)]
+        dates.get_date_format(values, als_lab, col, spec["dates"][col])
+
+def get_read_kwargs(file_path, func, dtype=None) -> dict:
+    """
+    Returns the pd.read_csv arguments for a raw file. Only the columns used by the function's mapping spec are
+    parsed. Leca and Great Lab exports with a blank first line are read with the header from the first data row, so
+    the numeric columns are still parsed as numbers.
+    """
+    read_kwargs = {"low_memory": False, "dtype": dtype}
+    usecols = mapping.get_source_usecols(lookup_mapping_spec[func.__name__])
+    if usecols is not None:
+        # A callable, as a list would raise if one of the alternative names of a column (e.g. Date or CompletedDate)
+        # is missing. A missing column the spec needs still raises when the data is mapped.
+        read_kwargs["usecols"] = lambda col: col in usecols
+    if func in (preprocess_leca, preprocess_leca_greatlab):
+        if mapping.has_header_in_first_row(encoding.read_csv(file_path, nrows=0).columns):
+            read_kwargs["header"] = 1
+    return read_kwargs
+
+def preprocess_chunks(file_path, func, als_lab, chunksize, dtype=None):
+    """
+    Run a preprocess function over a raw file in chunks of chunksize rows, yielding each preprocessed chunk. Steps
+    that need the whole file are handled up front (product_category for Labtrac, date formats) or accumulated across
+    chunks (Transactor REPORT TOTALS, checked once every chunk has been processed, and row ID occurrence counts).
+    """
+    source_file = Path(file_path).name
+    func_kwargs = {}
+    read_kwargs = get_read_kwargs(file_path, func, dtype)
+    report_totals = None
+
+    prime_date_formats(file_path, lookup_mapping_spec[func.__name__], als_lab)
+
+    if func is preprocess_labtrac_new:
+        func_kwargs["keep_product_category"] = labtrac_new_keeps_product_category(file_path)
+    elif func in (preprocess_transactor, prep_transactor_passion_dental_design):
+        func_kwargs["check_totals"] = False
+        report_totals = validation.ReportTotalsAccumulator()
+
+    chunks = encoding.read_csv_chunks(file_path, chunksize, **read_kwargs)
+    with row_id.chunked_row_ids(als_lab, source_file):
+        for chunk in profiling.profile_iter(chunks, "csv_read", file_path, func.__name__):
+            if report_totals is not None:
+                report_totals.update(chunk)
+            with profiling.stage("transform", file_path, func.__name__) as counts:
+                counts["rows_in"] = len(chunk)
+                prep_chunk = func(chunk, als_lab, source_file, **func_kwargs)
+                counts["rows_out"] = len(prep_chunk)
+            yield prep_chunk
+
+    if report_totals is not None:
+        report_totals.check()
+
+def preprocess (file_path,schema_type,als_lab,chunksize=None):
+    """
+    Preprocess a raw CSV file with the preprocess function for its schema.
+    :param chunksize: If set, the file is processed in chunks of chunksize rows and a generator of preprocessed
+    chunks is returned instead of a DataFrame.
+    :return prep_df, func_name: Preprocessed data and the name of the preprocess function, or None if there is no
+    preprocess function for the schema.
+    """
+    func = lookup_preprocess_function.get(schema_type)  # Get function from dictionary
+    dtype = schema_utils.lookup_schema_dtypes().get(schema_type)
 
-        prep_df = func(df, als_lab) 
+    if func and chunksize:
+        return preprocess_chunks(file_path, func, als_lab, chunksize, dtype), func.__name__
+    elif func: 
         func_name = func.__name__
+        with profiling.stage("csv_read", file_path, func_name) as counts:
+            df = encoding.read_csv(file_path, **get_read_kwargs(file_path, func, dtype))
+            counts["rows_out"] = len(df)
+
+        with profiling.stage("transform", file_path, func_name) as counts:
+            counts["rows_in"] = len(df)
+            prep_df = func(df, als_lab, Path(file_path).name)
+            counts["rows_out"] = len(prep_df)
         return prep_df, func_name
     else:
         print(f"No schema found for file {file_path}")          
 
-def preprocess_labtrac_new(raw_data: pd.DataFrame, als_lab: str) -> pd.DataFrame:
+LABTRAC_NEW_MAPPING = {
+    "system_source": "Labtrac",
+    "rename": {
+        "Order": "order_id",
+        "Code": "customer_id",
+        "Name": "customer_name",
+        "Delivery 1": "practice_name",
+        "Delivery 2": "practice_address_road",
+        "Delivery 3": "practice_address_town",
+        "Delivery 5": "practice_address_postcode",
+        "Date": "order_invoiced_date",
+        "CompletedDate": "order_invoiced_date",
+        "Product Link": "product_code",
+        "Description": "product_description",
+        "Value": "net_sales",
+        "Qty": "quantity",
+        "Category": "product_category",
+        "Standard": "nhs_or_private",
+    },
+    # Drop rows where the invoice has not been sent, as these orders will not yet appear in accounting revenue
+    "required": ["order_invoiced_date"],
+    "strip": ["product_code", "customer_name", "product_description", "product_category", "nhs_or_private"],
+    "dates": {"order_invoiced_date": []},
+    "optional_columns": ["product_category"],
+    "derived": [("unit_net_price", "divide", ["net_sales", "quantity"])],
+    "row_id": "order_uuid",
+    "output_columns": [
+        "order_uuid",
+        "order_id",
+        "order_invoiced_date",
+        "system_source",
+        "als_lab",
+        "practice_name",
+        "practice_address_road",
+        "practice_address_town",
+        "practice_address_postcode",
+        "customer_id",
+        "customer_name",
+        "product_code",
+        "product_description",
+        "product_category",
+        "quantity",
+        "net_sales",
+        "nhs_or_private",
+        "unit_net_price",
+    ],
+}
+
+def preprocess_labtrac_new(
+    raw_data: pd.DataFrame, als_lab: str, source_file: str = None, keep_product_category: bool = None
+) -> pd.DataFrame:
     """
     Preprocess raw data from a single lab from the Labtrac system in the full 2021 to 2023 format.
     :param raw_data: DataFrame containing the raw data for a single lab from Labtrac.
     :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :param keep_product_category: Whether to keep the product_category column. By default it is dropped if it has
+    any empty values.
     :return prep_data: DataFrame containing preprocessed data for a single lab from Labtrac.
     """
-    prep_data = raw_data.copy(deep=True)
-
-    cols_to_cut = [
-        "Order",
-        "Stage",
-        "Patient",
-        "Recieved",
-        "Due Date",
-        "DoctorAnalysis1",
-        "DoctorAnalysis2",
-        "DoctorAnalysis3",
-        "DoctorAnalysis4",
-        "DoctorAnalysis5",
-        "Invoice 1",
-        "Invoice 2",
-        "Invoice 3",
-        "Invoice 4",
-        "Invoice 5",
-        "Delivery 4",
-        "Status",
-    ]
-
-    # Drop extraneous columns
-    for col in prep_data.columns:
-        if col in cols_to_cut:
-            prep_data = prep_data.drop(columns=col)
-        if col == "Date":
-            prep_data = prep_data.rename(columns={"Date": "CompletedDate"})
-
-    # Drop rows where the invoice has not been sent, as these orders will not yet appear in accounting revenue
-    prep_data = prep_data.dropna(subset="CompletedDate", axis=0, how="all").reset_index(
-        drop=True
-    )
-
-    # Remove any trailing spaces from the product codes
-    prep_data["Description"] = prep_data["Description"].str.strip()
-
-    # Rename columns
-    prep_data = prep_data.rename(
-        columns={
-            "Code": "customer_id",
-            "Name": "customer_name",
-            "Delivery 1": "practice_name",
-            "Delivery 2": "practice_address_road",
-            "Delivery 3": "practice_address_town",
-            "Delivery 5": "practice_address_postcode",
-            "CompletedDate": "order_invoiced_date",
-            "Product Link": "product_code",
-            "Description": "product_description",
-            "Value": "net_sales",
-            "Qty": "quantity",
-            "Category": "product_category",
-            "Standard": "nhs_or_private"
-        }
+    return mapping.apply_mapping(
+        raw_data, LABTRAC_NEW_MAPPING, als_lab, source_file, keep_optional_columns=keep_product_category
     )
 
-    # Set order invoiced date to datetime format
-    if als_lab == "Romak Denture Centre":
-        prep_data = prep_data.loc[prep_data["order_invoiced_date"] != "00/01/1900", :].reset_index(drop=True)
-        try:
-            prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-        except:
-            prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"], format="%d/%m/%Y")
-    elif als_lab == "APlus":
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-    elif als_lab == "Central Dental Laboratory":
-        prep_data["order_invoiced_date"] = prep_data["order_invoiced_date"].astype(str)
-        prep_data = prep_data.loc[prep_data["order_invoiced_date"] != "00:00:00", :].reset_index(drop=True)
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-    elif als_lab == "Lodge":
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-    elif als_lab == "Precedental":
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-    else:
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-
-    # Drop the product_category column if it is empty
-    if prep_data[["product_category"]].isnull().any().any() == True:
-        prep_data = prep_data.drop(columns="product_category")
-
-    # Remove trailing spaces string columns
-    for col in ["product_code", "customer_name", "product_description", "product_category", "nhs_or_private"]:
-        if col in prep_data.columns:
-            prep_data[col] = prep_data[col].str.strip()
-
-    # Add system source and ALS lab columns
-    prep_data["system_source"] = "Labtrac"
-    prep_data["als_lab"] = als_lab
-
-    # Add unique row identifier
-    prep_data["order_uuid"] = prep_data.apply(lambda _: uuid.uuid4(), axis=1)
-    prep_data["order_uuid"] = prep_data["order_uuid"].astype(str)
-
-    if "product_category" in prep_data.columns:
-        prep_data = prep_data[
-            [
-                "order_uuid",
-                "order_invoiced_date",
-                "system_source",
-                "als_lab",
-                "practice_name",
-                "practice_address_road",
-                "practice_address_town",
-                "practice_address_postcode",
-                "customer_id",
-                "customer_name",
-                "product_code",
-                "product_description",
-                "product_category",
-                "quantity",
-                "net_sales",
-                "nhs_or_private"
-            ]
-        ]
-    else:
-        prep_data = prep_data[
-            [
-                "order_uuid",
-                "order_invoiced_date",
-                "system_source",
-                "als_lab",
-                "practice_name",
-                "practice_address_road",
-                "practice_address_town",
-                "practice_address_postcode",
-                "customer_id",
-                "customer_name",
-                "product_code",
-                "product_description",
-                "quantity",
-                "net_sales",
-                "nhs_or_private"
-            ]
-        ]
-
-    # Find the unit net price for each order
-    prep_data["unit_net_price"] = prep_data["net_sales"] / prep_data["quantity"]
-
-    return prep_data
+LABTRAC_OLD_MAPPING = {
+    "system_source": "Labtrac",
+    "rename": {
+        "DoctorId": "customer_id",
+        "DoctorName": "customer_name",
+        "Address1": "practice_name",
+        "Address2": "practice_address_road",
+        "Address3": "practice_address_town",
+        "Address5": "practice_address_postcode",
+        "InvoiceDate": "order_invoiced_date",
+        "ProductId": "product_code",
+        "ProductName": "product_description",
+        "Net": "net_sales",
+        "Qty": "quantity",
+        "Status": "order_status",
+        "CurrencySymbol": "currency_symbol",
+        "CurrencyDescription": "currency_description",
+    },
+    # Drop rows where the invoice has not been sent, as these orders will not yet appear in accounting revenue
+    "required": ["order_invoiced_date"],
+    "dtypes": {"product_code": str},
+    "strip": ["product_code"],
+    "dates": {"order_invoiced_date": []},
+    "derived": [("unit_net_price", "divide", ["net_sales", "quantity"])],
+    "row_id": "order_uuid",
+    "output_columns": [
+        "order_uuid",
+        "order_invoiced_date",
+        "system_source",
+        "als_lab",
+        "practice_name",
+        "practice_address_road",
+        "practice_address_town",
+        "practice_address_postcode",
+        "customer_id",
+        "customer_name",
+        "product_code",
+        "product_description",
+        "quantity",
+        "net_sales",
+        "order_status",
+        "currency_symbol",
+        "currency_description",
+        "unit_net_price",
+    ],
+}
 
-def preprocess_labtrac_old(raw_data: pd.DataFrame, als_lab: str) -> pd.DataFrame:
+def preprocess_labtrac_old(raw_data: pd.DataFrame, als_lab: str, source_file: str = None) -> pd.DataFrame:
     """
     Preprocess raw data from a single lab from the Labtrac system in the old 2021 to Oct 2023 format.
     :param raw_data: DataFrame containing the raw data for a single lab from Labtrac.
     :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
     :return prep_data: DataFrame containing preprocessed data for a single lab from Labtrac.
     """
-    prep_data = raw_data.copy(deep=True)
-
-    # Drop extraneous columns
-    prep_data = prep_data.drop(
-        columns=[
-            "LicenceNo",
-            "DoctorAnalysis1",
-            "DoctorAnalysis2",
-            "DoctorAnalysis3",
-            "DoctorAnalysis4",
-            "DoctorAnalysis5",
-            "DoctorAnalysis6",
-            "DoctorAnalysis7",
-            "DoctorAnalysis8",
-            "DoctorAnalysis9",
-            "DoctorAnalysis10",
-            "ProductAnalysis1",
-            "ProductAnalysis2",
-            "ProductAnalysis3",
-            "ProductAnalysis4",
-            "ProductAnalysis5",
-            "ProductAnalysis6",
-            "ProductAnalysis7",
-            "ProductAnalysis8",
-            "ProductAnalysis9",
-            "ProductAnalysis10",
-            "MaterialId",
-            "MaterialName",
-            "MaterialAnalysis1",
-            "MaterialAnalysis2",
-            "MaterialAnalysis3",
-            "MaterialAnalysis4",
-            "MaterialAnalysis5",
-            "MaterialAnalysis6",
-            "MaterialAnalysis7",
-            "MaterialAnalysis8",
-            "MaterialAnalysis9",
-            "MaterialAnalysis10",
-        ]
-    )
-
-    # Drop rows where the invoice has not been sent, as these orders will not yet appear in accounting revenue
-    prep_data = prep_data.dropna(subset="InvoiceDate", axis=0, how="all").reset_index(
-        drop=True
-    )
-
-    # # Drop rows where the sales value was zero (primarily shipping)
-    # prep_data = prep_data.loc[prep_data["Net"] != 0, :]
-
-    # Remove any trailing spaces from the product codes
-    prep_data["ProductId"] = prep_data["ProductId"].astype(str)
-    prep_data["ProductId"] = prep_data["ProductId"].str.strip()
-
-    # Rename columns
-    prep_data = prep_data.rename(
-        columns={
-            "DoctorId": "customer_id",
-            "DoctorName": "customer_name",
-            "Address1": "practice_name",
-            "Address2": "practice_address_road",
-            "Address3": "practice_address_town",
-            "Address5": "practice_address_postcode",
-            "InvoiceDate": "order_invoiced_date",
-            "ProductId": "product_code",
-            "ProductName": "product_description",
-            "Net": "net_sales",
-            "Qty": "quantity",
-            "Status": "order_status",
-            "CurrencySymbol": "currency_symbol",
-            "CurrencyDescription": "currency_description",
-        }
-    )
-
-    try:
-        # Set order invoiced date to datetime format
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"])
-    except:
-        prep_data["order_invoiced_date"] = pd.to_datetime(prep_data["order_invoiced_date"], format="%d/%m/%Y")
-        
-
-
-    # Add system source and ALS lab columns
-    prep_data["system_source"] = "Labtrac"
-    prep_data["als_lab"] = als_lab
-
-    # Add unique row identifier
-    prep_data["order_uuid"] = prep_data.apply(lambda _: uuid.uuid4(), axis=1)
-    prep_data["order_uuid"] = prep_data["order_uuid"].astype(str)
-
-    prep_data = prep_data[
-        [
-            "order_uuid",
-            "order_invoiced_date",
-            "system_source",
-            "als_lab",
-            "practice_name",
-            "practice_address_road",
-            "practice_address_town",
-            "practice_address_postcode",
-            "customer_id",
-            "customer_name",
-            "product_code",
-            "product_description",
-            "quantity",
-            "net_sales",
-            "order_status",
-            "currency_symbol",
-            "currency_description",
-        ]
-    ]
-
-    # Find the unit net price for each order
-    prep_data["unit_net_price"] = prep_data["net_sales"] / prep_data["quantity"]
-
-    return prep_data
+    return mapping.apply_mapping(raw_data, LABTRAC_OLD_MAPPING, als_lab, source_file)
+
+# Columns of the Transactor output, shared by the Passion Dental Design variant
+TRANSACTOR_OUTPUT_COLUMNS = [
+    "customer_product_cube_uuid",
+    "year_month",
+    "system_source",
+    "als_lab",
+    "ship_id",
+    "ship_name",
+    "ship_address",
+    "customer_id",
+    "customer_name",
+    "product_code",
+    "product_description",
+    "original_lab_price_band",
+    "net_unit_price",
+    "discounted_unit_price",
+    "quantity",
+    "net_sales",
+    "tax_sales",
+]
+
+TRANSACTOR_MAPPING = {
+    "system_source": "Transactor",
+    "expected_columns": 15,
+    "rename": {
+        "ShipID": "ship_id",
+        "ShipFullName": "ship_name",
+        "ShipAddress": "ship_address",
+        "CustID": "customer_id",
+        "CustFullName": "customer_name",
+        "code": "product_code",
+        "Description": "product_description",
+        "PriceBand": "original_lab_price_band",
+        "NetUnitPrice": "net_unit_price",
+        "DiscountedUnitPrice": "discounted_unit_price",
+        "Qty": "quantity",
+        "Net_Sales": "net_sales",
+        "Tax_Sales": "tax_sales",
+    },
+    "exclude": {"product_description": [validation.REPORT_TOTALS_LABEL]},
+    # Reconciled with the quantity and sales columns by validation.ReportTotalsAccumulator
+    "report_totals": True,
+    "fill_na": {"ship_name": "Unknown", "ship_address": "Unknown", "customer_name": "Unknown", "ship_id": 0},
+    "dtypes": {
+        "Year": int,
+        "Month": int,
+        "ship_id": int,
+        "ship_name": str,
+        "ship_address": str,
+        "customer_id": int,
+        "customer_name": str,
+        "product_code": str,
+        "product_description": str,
+        "original_lab_price_band": str,
+        "net_unit_price": float,
+        "discounted_unit_price": float,
+        "quantity": float,
+        "net_sales": float,
+        "tax_sales": float,
+    },
+    "strip": ["product_code"],
+    "derived": [("year_month", "year_month", ["Year", "Month"])],
+    "row_id": "customer_product_cube_uuid",
+    "output_columns": TRANSACTOR_OUTPUT_COLUMNS,
+}
 
-def preprocess_transactor(raw_data: pd.DataFrame, als_lab: str) -> pd.DataFrame:
+def preprocess_transactor(
+    raw_data: pd.DataFrame, als_lab: str, source_file: str = None, check_totals: bool = True
+) -> pd.DataFrame:
     """
     Preprocess raw data from a single lab from the Transactor system.
     :param raw_data: DataFrame containing the raw data for a single lab from Transactor.
     :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :param check_totals: Whether to check the REPORT TOTALS row. Disabled when processing in chunks, where the check
+    is done across all chunks by validation.ReportTotalsAccumulator.
     :return prep_data: DataFrame containing preprocessed data for a single lab from Transactor.
     """
-    prep_data = raw_data.copy(deep=True)
-
-    #  Ensure the correct number of columns, and that column names are correct
-    if prep_data.shape[1] != 15:
-        raise Exception(
-            "Raw Transactor data does not have the correct number of columns."
-        )
-
-    # Check sums for quantity and sales match totals in the raw data, then drop the report total row
-    for col in ["Qty", "Net_Sales", "Tax_Sales"]:
-        if (
-            prep_data.loc[prep_data["Description"] != "REPORT TOTALS:", col].sum()
-            - prep_data.loc[prep_data["Description"] == "REPORT TOTALS:", col].values[0]
-        ) > 0.01:
-            raise Exception(
-                f"Total {col} from Transactor data does not match report total in original raw data."
-            )
-
-    prep_data = prep_data.loc[prep_data["Description"] != "REPORT TOTALS:", :].copy(
-        deep=True
-    )
-
-    # Fill in null values in ShipFullName column
-    prep_data["ShipFullName"] = prep_data["ShipFullName"].fillna("Unknown")
-    prep_data["ShipAddress"] = prep_data["ShipAddress"].fillna("Unknown")
-    prep_data["CustFullName"] = prep_data["CustFullName"].fillna("Unknown")
-    prep_data["ShipID"] = prep_data["ShipID"].fillna(0)
-
-    # Set the column data types
-    prep_data["Year"] = prep_data["Year"].astype(int)
-    prep_data["Month"] = prep_data["Month"].astype(int)
-    prep_data["ShipID"] = prep_data["ShipID"].astype(int)
-    prep_data["ShipFullName"] = prep_data["ShipFullName"].astype(str)
-    prep_data["ShipAddress"] = prep_data["ShipAddress"].astype(str)
-    prep_data["CustID"] = prep_data["CustID"].astype(int)
-    prep_data["CustFullName"] = prep_data["CustFullName"].astype(str)
-    prep_data["code"] = prep_data["code"].astype(str)
-    prep_data["Description"] = prep_data["Description"].astype(str)
-    prep_data["PriceBand"] = prep_data["PriceBand"].astype(str)
-    prep_data["NetUnitPrice"] = prep_data["NetUnitPrice"].astype(float)
-    prep_data["DiscountedUnitPrice"] = prep_data["DiscountedUnitPrice"].astype(float)
-    prep_data["Qty"] = prep_data["Qty"].astype(float)
-    prep_data["Net_Sales"] = prep_data["Net_Sales"].astype(float)
-    prep_data["Tax_Sales"] = prep_data["Tax_Sales"].astype(float)
-
-    # Add unique row identifier
-    prep_data["customer_product_cube_uuid"] = prep_data.apply(
-        lambda _: uuid.uuid4(), axis=1
-    )
-    prep_data["customer_product_cube_uuid"] = prep_data[
-        "customer_product_cube_uuid"
-    ].astype(str)
-
-    # Combine year and month into single datetime column
-    prep_data["year_month"] = pd.to_datetime(prep_data[["Year", "Month"]].assign(DAY=1))
+    checks = [validation.check_report_totals] if check_totals else []
+    return mapping.apply_mapping(raw_data, TRANSACTOR_MAPPING, als_lab, source_file, checks=checks)
 
-    # Add labels for raw data system source and dental lab source
-    prep_data["system_source"] = "Transactor"
-    prep_data["als_lab"] = als_lab
-
-    # Drop extraneous columns
-    prep_data = prep_data.drop(["Year", "Month"], axis=1)
-
-    # Remove any trailing spaces from the product codes
-    prep_data["code"] = prep_data["code"].str.strip()
-
-    # Rename and reorder columns
-    prep_data = prep_data.rename(
-        columns={
-            "ShipID": "ship_id",
-            "ShipFullName": "ship_name",
-            "ShipAddress": "ship_address",
-            "CustID": "customer_id",
-            "CustFullName": "customer_name",
-            "code": "product_code",
-            "Description": "product_description",
-            "PriceBand": "original_lab_price_band",
-            "NetUnitPrice": "net_unit_price",
-            "DiscountedUnitPrice": "discounted_unit_price",
-            "Qty": "quantity",
-            "Net_Sales": "net_sales",
-            "Tax_Sales": "tax_sales",
-        }
-    )
-    prep_data = prep_data[
-        [
-            "customer_product_cube_uuid",
-            "year_month",
-            "system_source",
-            "als_lab",
-            "ship_id",
-            "ship_name",
-            "ship_address",
-            "customer_id",
-            "customer_name",
-            "product_code",
-            "product_description",
-            "original_lab_price_band",
-            "net_unit_price",
-            "discounted_unit_price",
-            "quantity",
-            "net_sales",
-            "tax_sales",
-        ]
-    ]
-
-    return prep_data
-
-def preprocess_leca(raw_data: pd.DataFrame, als_lab: str) -> pd.DataFrame:
-    """
-
-    :param raw_data:
-    :param als_lab:
-    :return:
-    """
-    prep_data = raw_data.copy(deep=True)
-
-    # Replace unnamed columns with first row of data table if relevant
-    if "Unnamed: 0" in prep_data.columns:
-        prep_data.columns = prep_data.iloc[0]
-        prep_data = prep_data.iloc[1:].reset_index(drop=True)
-
-    prep_data.columns = [
+LECA_MAPPING = {
+    "system_source": "Custom",
+    "header_in_first_row": True,
+    "columns": [
         "Year",
         "Month",
-        "Practice Post Code or Identifier",
-        "Practice Name",
-        "Customer Account",
-        "Dentist",
-        "Product Code",
-        "Product Description",
-        "NHS /Private/Independent/PPE",
-        "Quantity",
+        "practice_code",
+        "practice_name",
+        "customer_id",
+        "customer_name",
+        "product_code",
+        "product_description",
+        "nhs_or_private",
+        "quantity",
         "Invoice Amount",
         "Invoice VAT",
-    ]
-
-    # Rename columns
-    prep_data = prep_data.rename(
-        columns={
-            "Practice Post Code or Identifier": "practice_code",
-            "Practice Name": "practice_name",
-            "Customer Account": "customer_id",
-            "Dentist": "customer_name",
-            "Product Code": "product_code",
-            "Product Description": "product_description",
-            "NHS /Private/Independent/PPE": "nhs_or_private",
-            "Quantity": "quantity"
-        }
-    )
-
-    # Add unique row identifier
-    prep_data["customer_product_cube_uuid"] = prep_data.apply(
-        lambda _: uuid.uuid4(), axis=1
-    )
-    prep_data["customer_product_cube_uuid"] = prep_data[
-        "customer_product_cube_uuid"
-    ].astype(str)
-
-    # Combine year and month into single datetime column
-    prep_data["year_month"] = pd.to_datetime(prep_data[["Year", "Month"]].assign(DAY=1))
-
-    # Add labels for raw data system source and dental lab source
-    prep_data["system_source"] = "Custom"
-    prep_data["als_lab"] = als_lab
-
-    # Create net sales column by minusing VAT from the invoice value
-    prep_data["net_sales"] = prep_data["Invoice Amount"] - prep_data["Invoice VAT"]
-
-    # Drop extraneous columns and reorder columns
-    prep_data = prep_data[
-        [
-            "customer_product_cube_uuid",
-            "year_month",
-            "system_source",
-            "als_lab",
-            "practice_code",
-            "practice_name",
-            "customer_id",
-            "customer_name",
-            "product_code",
-            "product_description",
-            "quantity",
-            "net_sales",
-            "nhs_or_private"
-        ]
-    ]
-
-    # Add columns for the net unit price
-    prep_data["net_unit_price"] = prep_data["net_sales"] / prep_data["quantity"]
+    ],
+    "derived": [
+        ("year_month", "year_month", ["Year", "Month"]),
+        # Net sales are the invoice value minus VAT
+        ("net_sales", "subtract", ["Invoice Amount", "Invoice VAT"]),
+        ("net_unit_price", "divide", ["net_sales", "quantity"]),
+    ],
+    "row_id": "customer_product_cube_uuid",
+    "output_columns": [
+        "customer_product_cube_uuid",
+        "year_month",
+        "system_source",
+        "als_lab",
+        "practice_code",
+        "practice_name",
+        "customer_id",
+        "customer_name",
+        "product_code",
+        "product_description",
+        "quantity",
+        "net_sales",
+        "nhs_or_private",
+        "net_unit_price",
+    ],
+}
 
-    return prep_data
+def preprocess_leca(raw_data: pd.DataFrame, als_lab: str, source_file: str = None) -> pd.DataFrame:
+    """
+    Preprocess raw data from a single lab from the Leca custom reports.
+    :param raw_data: DataFrame containing the raw data for a single lab from Leca.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :return prep_data: DataFrame containing preprocessed data for a single lab from Leca.
+    """
+    return mapping.apply_mapping(raw_data, LECA_MAPPING, als_lab, source_file)
+
+PASSION_DENTAL_DESIGN_MAPPING = {
+    "system_source": "Transactor",
+    "expected_columns": 11,
+    "rename": {
+        "shipid": "ship_id",
+        "shipfullname": "ship_name",
+        "custID": "customer_id",
+        "CustFullName": "customer_name",
+        "code": "product_code",
+        "Description": "product_description",
+        "Qty": "quantity",
+        "Net_Sales": "net_sales",
+        "Tax_Sales": "tax_sales",
+    },
+    "exclude": {"product_description": [validation.REPORT_TOTALS_LABEL]},
+    # Reconciled with the quantity and sales columns by validation.ReportTotalsAccumulator
+    "report_totals": True,
+    "fill_na": {"ship_name": "Unknown", "customer_id": "Unknown", "customer_name": "Unknown", "ship_id": 0},
+    "dtypes": {
+        "Year": int,
+        "Month": int,
+        "ship_id": int,
+        "ship_name": str,
+        "customer_id": int,
+        "customer_name": str,
+        "product_code": str,
+        "product_description": str,
+        "quantity": float,
+        "net_sales": float,
+        "tax_sales": float,
+    },
+    "strip": ["product_code"],
+    # Additional empty columns to match what is seen in other labs' Transactor reports
+    "constants": {
+        "ship_address": "Unknown",
+        "original_lab_price_band": "Unknown",
+        "net_unit_price": np.nan,
+        "discounted_unit_price": np.nan,
+    },
+    "derived": [("year_month", "year_month", ["Year", "Month"])],
+    "row_id": "customer_product_cube_uuid",
+    "output_columns": TRANSACTOR_OUTPUT_COLUMNS,
+}
 
-def prep_transactor_passion_dental_design(raw_data: pd.DataFrame, als_lab: str):
+def prep_transactor_passion_dental_design(
+    raw_data: pd.DataFrame, als_lab: str, source_file: str = None, check_totals: bool = True
+):
     """
     Preprocess raw data from Passion Dental Design lab from the Transactor system.
     :param raw_data: DataFrame containing the raw data for Passion Dental Design lab from Transactor.
     :param als_lab: Str name of Passion Dental Design.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :param check_totals: Whether to check the REPORT TOTALS row. Disabled when processing in chunks.
     :return prep_data: DataFrame containing preprocessed data for Passion Dental Design lab from Transactor.
     """
-    prep_data = raw_data.copy(deep=True)
-
-    #  Ensure the correct number of columns, and that column names are correct
-    if prep_data.shape[1] != 11:
-        raise Exception(
-            "Raw Transactor data does not have the correct number of columns."
-        )
-
-    # Check sums for quantity and sales match totals in the raw data, then drop the report total row
-    for col in ["Qty", "Net_Sales", "Tax_Sales"]:
-        if (
-            prep_data.loc[prep_data["Description"] != "REPORT TOTALS:", col].sum()
-            - prep_data.loc[prep_data["Description"] == "REPORT TOTALS:", col].values[0]
-        ) > 0.01:
-            raise Exception(
-                f"Total {col} from Transactor data does not match report total in original raw data."
-            )
-    prep_data = prep_data.loc[prep_data["Description"] != "REPORT TOTALS:", :].copy(
-        deep=True
-    )
-
-    # Fill in null values in ShipFullName column
-    prep_data["shipfullname"] = prep_data["shipfullname"].fillna("Unknown")
-    prep_data["custID"] = prep_data["custID"].fillna("Unknown")
-    prep_data["CustFullName"] = prep_data["CustFullName"].fillna("Unknown")
-    prep_data["shipid"] = prep_data["shipid"].fillna(0)
-
-    # Set the column data types
-    prep_data["Year"] = prep_data["Year"].astype(int)
-    prep_data["Month"] = prep_data["Month"].astype(int)
-    prep_data["shipid"] = prep_data["shipid"].astype(int)
-    prep_data["shipfullname"] = prep_data["shipfullname"].astype(str)
-    prep_data["custID"] = prep_data["custID"].astype(int)
-    prep_data["CustFullName"] = prep_data["CustFullName"].astype(str)
-    prep_data["code"] = prep_data["code"].astype(str)
-    prep_data["Description"] = prep_data["Description"].astype(str)
-    prep_data["Qty"] = prep_data["Qty"].astype(float)
-    prep_data["Net_Sales"] = prep_data["Net_Sales"].astype(float)
-    prep_data["Tax_Sales"] = prep_data["Tax_Sales"].astype(float)
-
-    # Add unique row identifier
-    prep_data["customer_product_cube_uuid"] = prep_data.apply(
-        lambda _: uuid.uuid4(), axis=1
-    )
-    prep_data["customer_product_cube_uuid"] = prep_data[
-        "customer_product_cube_uuid"
-    ].astype(str)
-
-    # Combine year and month into single datetime column
-    prep_data["year_month"] = pd.to_datetime(prep_data[["Year", "Month"]].assign(DAY=1))
-
-    # Add labels for raw data system source and dental lab source
-    prep_data["system_source"] = "Transactor"
-    prep_data["als_lab"] = als_lab
-
-    # Drop extraneous columns
-    prep_data = prep_data.drop(["Year", "Month"], axis=1)
-
-    # Remove any trailing spaces from the product codes
-    prep_data["code"] = prep_data["code"].str.strip()
-
-    # Add additional empty columns to match what is seen in other labs' Transactor reports
-    for col in ["ship_address", "original_lab_price_band", "net_unit_price", "discounted_unit_price"]:
-        if col in ["ship_address", "original_lab_price_band"]:
-            prep_data[col] = "Unknown"
-        elif col in ["net_unit_price", "discounted_unit_price"]:
-            prep_data[col] = np.nan
-
-    # Rename and reorder columns
-    prep_data = prep_data.rename(
-        columns={
-            "shipid": "ship_id",
-            "shipfullname": "ship_name",
-            "custID": "customer_id",
-            "CustFullName": "customer_name",
-            "code": "product_code",
-            "Description": "product_description",
-            "Qty": "quantity",
-            "Net_Sales": "net_sales",
-            "Tax_Sales": "tax_sales",
-        }
-    )
-    prep_data = prep_data[
-        [
-            "customer_product_cube_uuid",
-            "year_month",
-            "system_source",
-            "als_lab",
-            "ship_id",
-            "ship_name",
-            "ship_address",
-            "customer_id",
-            "customer_name",
-            "product_code",
-            "product_description",
-            "original_lab_price_band",
-            "net_unit_price",
-            "discounted_unit_price",
-            "quantity",
-            "net_sales",
-            "tax_sales",
-        ]
-    ]
-
-    return prep_data
-
-def preprocess_leca_greatlab(raw_data: pd.DataFrame, als_lab: str) -> pd.DataFrame:
-    """
-
-    :param raw_data:
-    :param als_lab:
-    :return:
-    """
-    prep_data = raw_data.copy(deep=True)
+    checks = [validation.check_report_totals] if check_totals else []
+    return mapping.apply_mapping(raw_data, PASSION_DENTAL_DESIGN_MAPPING, als_lab, source_file, checks=checks)
 
-    # Replace unnamed columns with first row of data table if relevant
-    if "Unnamed: 0" in prep_data.columns:
-        prep_data.columns = prep_data.iloc[0]
-        prep_data = prep_data.iloc[1:].reset_index(drop=True)
-
-    prep_data.columns = [
+LECA_GREATLAB_MAPPING = {
+    "system_source": "Great Lab",
+    "header_in_first_row": True,
+    "columns": [
         "Year",
         "Month",
-        "Client",
-        "Prac",
-        "Acct",
-        "Item",
-        "SKU",
+        "customer_name",
+        "practice_name",
+        "customer_id",
+        "product_description",
+        "product_code",
         "CAT",
         "SubCat",
         "Mat",
         "Stan",
-        "Product count",
-        "Revenue",
+        "quantity",
+        "net_sales",
         "Tax",
-        "Total"
-    ]
-
-    # Rename columns
-    prep_data = prep_data.rename(
-        columns={            
-            "Prac": "practice_name",
-            "Acct": "customer_id",
-            "Client": "customer_name",
-            "SKU": "product_code",
-            "Item": "product_description",            
-            "Product count": "quantity",
-            "Revenue":"net_sales"
-        }
-    )
-
-    # Add unique row identifier
-    prep_data["customer_product_cube_uuid"] = prep_data.apply(
-        lambda _: uuid.uuid4(), axis=1
-    )
-    prep_data["customer_product_cube_uuid"] = prep_data[
-        "customer_product_cube_uuid"
-    ].astype(str)
-
-    # Combine year and month into single datetime column
-    prep_data["year_month"] = pd.to_datetime(prep_data[["Year", "Month"]].assign(DAY=1))
-
-    # Add labels for raw data system source and dental lab source
-    prep_data["system_source"] = "Great Lab"
-    prep_data["als_lab"] = als_lab
-    
-    prep_data["nhs_or_private"] = ""
-    prep_data["practice_code"] = ""
-
-    # Drop extraneous columns and reorder columns
-    prep_data = prep_data[
-        [
-            "customer_product_cube_uuid",
-            "year_month",
-            "system_source",
-            "als_lab",
-            "practice_code",
-            "practice_name",
-            "customer_id",
-            "customer_name",
-            "product_code",
-            "product_description",
-            "quantity",
-            "net_sales",
-            "nhs_or_private"
-        ]
-    ]
-
-    # Add columns for the net unit price
-    prep_data["net_unit_price"] = prep_data["net_sales"] / prep_data["quantity"]
-
-    return prep_data
+        "Total",
+    ],
+    "constants": {"nhs_or_private": "", "practice_code": ""},
+    "derived": [
+        ("year_month", "year_month", ["Year", "Month"]),
+        ("net_unit_price", "divide", ["net_sales", "quantity"]),
+    ],
+    "row_id": "customer_product_cube_uuid",
+    "output_columns": LECA_MAPPING["output_columns"],
+}
 
-def preprocess_leca_transactor(raw_data: pd.DataFrame, als_lab: str) -> pd.DataFrame:
+def preprocess_leca_greatlab(raw_data: pd.DataFrame, als_lab: str, source_file: str = None) -> pd.DataFrame:
     """
-
-    :param raw_data:
-    :param als_lab:
-    :return:
+    Preprocess raw data from a single lab from the Great Lab reports.
+    :param raw_data: DataFrame containing the raw data for a single lab from Great Lab.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :return prep_data: DataFrame containing preprocessed data for a single lab from Great Lab.
     """
-    prep_data = raw_data.copy(deep=True)
-
-    # prep_data.columns = [
-    #     "Practice",
-    #     "Invoice.Date",
-    #     "Invoice.AccountName",
-    #     "Prac",
-    #     "Acct",
-    #     "Item",
-    #     "SKU",
-    #     "CAT",
-    #     "SubCat",
-    #     "Mat",
-    #     "Stan",
-    #     "Product count",
-    #     "Revenue",
-    #     "Tax",
-    #     "Total"
-    # ]
-
-    # Rename columns
-    prep_data = prep_data.rename(
-        columns={            
-            "Practice": "practice_name",
-            "Invoice.AccountReference": "customer_id",
-            "Invoice.AccountName": "customer_name",
-            "InvoiceItem.ProductAccountReference2": "product_code",
-            "Product": "product_description",            
-            "InvoiceItem.Quantity": "quantity",
-            "InvoiceItem.AmountNet":"net_sales"
-        }
-    )
-
-    # Add unique row identifier
-    prep_data["customer_product_cube_uuid"] = prep_data.apply(
-        lambda _: uuid.uuid4(), axis=1
-    )
-    prep_data["customer_product_cube_uuid"] = prep_data[
-        "customer_product_cube_uuid"
-    ].astype(str)
-
-    # Combine year and month into single datetime column
-    prep_data["year_month"] = pd.to_datetime(prep_data["Invoice.Date"])
-    
-    # Add labels for raw data system source and dental lab source
-    prep_data["system_source"] = "Leca"
-    prep_data["als_lab"] = als_lab
-    
-
-    prep_data["nhs_or_private"] = ""
-    prep_data["practice_code"] = ""
-
-    # Drop extraneous columns and reorder columns
-    prep_data = prep_data[
-        [
-            "customer_product_cube_uuid",
-            "year_month",
-            "system_source",
-            "als_lab",
-            "practice_code",
-            "practice_name",
-            "customer_id",
-            "customer_name",
-            "product_code",
-            "product_description",
-            "quantity",
-            "net_sales",
-            "nhs_or_private"
-        ]
-    ]
-
-    # Add columns for the net unit price
-    prep_data["net_unit_price"] = prep_data["net_sales"] / prep_data["quantity"]
+    return mapping.apply_mapping(raw_data, LECA_GREATLAB_MAPPING, als_lab, source_file)
+
+LECA_TRANSACTOR_MAPPING = {
+    "system_source": "Leca",
+    "rename": {
+        "Practice": "practice_name",
+        "Invoice.AccountReference": "customer_id",
+        "Invoice.AccountName": "customer_name",
+        "InvoiceItem.ProductAccountReference2": "product_code",
+        "Product": "product_description",
+        "InvoiceItem.Quantity": "quantity",
+        "InvoiceItem.AmountNet": "net_sales",
+        "Invoice.Date": "year_month",
+    },
+    "dates": {"year_month": []},
+    "constants": {"nhs_or_private": "", "practice_code": ""},
+    "derived": [("net_unit_price", "divide", ["net_sales", "quantity"])],
+    "row_id": "customer_product_cube_uuid",
+    "output_columns": LECA_MAPPING["output_columns"],
+}
 
-    return prep_data
+def preprocess_leca_transactor(raw_data: pd.DataFrame, als_lab: str, source_file: str = None) -> pd.DataFrame:
+    """
+    Preprocess raw data from a single lab from the Leca Transactor reports.
+    :param raw_data: DataFrame containing the raw data for a single lab from Leca Transactor.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the file the data was read from, used in the row IDs.
+    :return prep_data: DataFrame containing preprocessed data for a single lab from Leca Transactor.
+    """
+    return mapping.apply_mapping(raw_data, LECA_TRANSACTOR_MAPPING, als_lab, source_file)
 
 lookup_preprocess_function  = {
         "Schema_1":preprocess_labtrac_new,
@@ -790,78 +513,75 @@ lookup_preprocess_function  = {
         "Schema_12":preprocess_leca_transactor,
 }
 
+# Mapping spec run by each preprocess function, keyed by function name like the lookups in mysettings
+lookup_mapping_spec = {
+    "preprocess_labtrac_new": LABTRAC_NEW_MAPPING,
+    "preprocess_labtrac_old": LABTRAC_OLD_MAPPING,
+    "preprocess_transactor": TRANSACTOR_MAPPING,
+    "preprocess_leca": LECA_MAPPING,
+    "prep_transactor_passion_dental_design": PASSION_DENTAL_DESIGN_MAPPING,
+    "preprocess_leca_greatlab": LECA_GREATLAB_MAPPING,
+    "preprocess_leca_transactor": LECA_TRANSACTOR_MAPPING,
+}
+
+def parse_ashford_invoiced_dates(prep_data: pd.DataFrame, formats=()) -> pd.DataFrame:
+    """
+    Drop the Ashford rows with an empty (1899) invoiced date and parse the rest, dropping the rows whose date cannot
+    be parsed.
+    :param formats: Formats to try first, passed to dates.parse_dates.
+    """
+    prep_data = prep_data.loc[~dates.is_sentinel_date(prep_data["INVOICED DATE"])].copy()
+    invoiced = dates.parse_dates(prep_data["INVOICED DATE"], "Ashford", "INVOICED DATE", formats)
+    keep = dates.drop_failed_dates(prep_data["INVOICED DATE"].notna() & invoiced.isna(), "Ashford", "INVOICED DATE")
+    prep_data["INVOICED DATE"] = invoiced
+    return prep_data.loc[keep]
+
+def get_ashford_sources(folder_path=None, sources=None) -> list:
+    """
+    Returns the Ashford sources declared in mysettings.ASHFORD_SOURCES, each with the path of its file.
+    """
+    if folder_path is None:
+        folder_path = mysettings.ASHFORD_FOLDER_PATH
+    if sources is None:
+        sources = mysettings.ASHFORD_SOURCES
+    return [{**source, "file_path": os.path.join(folder_path, source["file_name"])} for source in sources]
+
+def clean_ashford_source(df: pd.DataFrame, source: dict, columns) -> pd.DataFrame:
+    """
+    Give one Ashford source the column names of the first source and keep the rows it contributes, as declared in
+    its mysettings.ASHFORD_SOURCES entry.
+    """
+    if source.get("add_dr_id"):
+        df.insert(0, "DR ID", "Unknown")
+    df.columns = columns
+
+    df = parse_ashford_invoiced_dates(df, source.get("date_formats", ()))
+
+    if source.get("invoiced_after"):
+        df = df.loc[df["INVOICED DATE"] > source["invoiced_after"]]
+    if source.get("invoiced_before"):
+        df = df.loc[df["INVOICED DATE"] < source["invoiced_before"]]
+    return df
+
 def preprocess_labtrac_ashford():
     """
-    Input and preprocess raw sales data from the Ashford lab, extracted from the Labtrac system.
+    Input and preprocess raw sales data from the Ashford lab, extracted from the Labtrac system. The source files are
+    declared in mysettings.ASHFORD_SOURCES and each is only read again if it changed since the last run.
     :return prep_data: DataFrame containing pre-processed data for Ashford, from Labtrac.
     """
-    ashford_2023 = pd.read_excel("data\sales_ashford\Ashford\Ashford 2023 Labtrac Data.xlsx")
-    ashford_2022 = pd.read_excel("data\sales_ashford\Ashford\Ashford 2022 Labtrac Data.xlsx")
-    ashford_2021 = pd.read_excel("data\sales_ashford\Ashford\Ashford 2021 Labtrac Data.xlsx")
-    try:
-        ashford_2023_Nov_Dec = pd.read_csv("data\sales_ashford\Ashford\Ashford 2023_Nov_Dec Labtrac Data.csv", encoding="utf-8") 
-    except:
-        ashford_2023_Nov_Dec = pd.read_csv("data\sales_ashford\Ashford\Ashford 2023_Nov_Dec Labtrac Data.csv", encoding="latin-1")
-    
-    ashford_2024_Jan_Apr = pd.read_excel("data\sales_ashford\Ashford\Ashford Data 2024_Jan_Apr Labtrac Data.xlsx")
-
-    def set_new_columns(df, new_columns):
-        """
-        For input df, takes column headers and inserts them into the dataframe as a new row, then replaces the old
-        column headers with new column headers of user's choosing.
-        """
-        print("Setting Columns")
-        df.loc[-1] = df.columns
-        df.index = df.index + 1
-        df = df.sort_index()
-        df.columns = new_columns
-
-        return df
-    
-    def add_dr_id_column(df: pd.DataFrame):
-        """
-        For input df (2021 and 2022 data), adds a new DR ID column to match 2023 data.
-        """
-        df["DR ID"] = "Unknown"
-        df_cols = df.columns.tolist()
-        df_cols = df_cols[-1:] + df_cols[:-1]
-        df = df[df_cols]
-        
-        return df
-
-    # Combine the separate yearly files together
-    new_columns = ashford_2023.columns
-    prep_data = ashford_2023.copy(deep=True)
-
-    prep_data["INVOICED DATE"] = prep_data["INVOICED DATE"].astype(str)
-    prep_data = prep_data.loc[~prep_data["INVOICED DATE"].str.contains("1899")]
-    prep_data["INVOICED DATE"] = prep_data["INVOICED DATE"].str.replace(".1", "")
-    # prep_data = prep_data.loc[~(prep_data["INVOICED DATE"] == ".1")]
-    prep_data["INVOICED DATE"] = pd.to_datetime(prep_data["INVOICED DATE"])
-
-    prep_data = prep_data.loc[prep_data["INVOICED DATE"] < "2023-11-1"]
-
-    ashford_2022 = add_dr_id_column(ashford_2022)
-    
-    for data in [ashford_2022, ashford_2021, ashford_2024_Jan_Apr]:
-        data = data.reset_index(drop=True)
-        data = set_new_columns(df=data, new_columns=new_columns)
-        print(prep_data.shape)
-        # data.to_csv(r"C:\Users\ZhiningLiu\OneDrive - Ansor\Desktop\data_0.csv")
-        prep_data = pd.concat([prep_data, data]).reset_index(drop=True)
-        print(prep_data.shape)
-    # prep_data.to_csv(r"C:\Users\ZhiningLiu\OneDrive - Ansor\Desktop\prep_data_0.csv")
-
-    ashford_2023_Nov_Dec = ashford_2023_Nov_Dec.reset_index(drop=True)
-    ashford_2023_Nov_Dec = set_new_columns(df=ashford_2023_Nov_Dec, new_columns=new_columns)
-    ashford_2023_Nov_Dec["INVOICED DATE"] = ashford_2023_Nov_Dec["INVOICED DATE"].str.rstrip(".1")
-    ashford_2023_Nov_Dec["INVOICED DATE"] = pd.to_datetime(
-        ashford_2023_Nov_Dec["INVOICED DATE"], format="%d/%m/%Y", dayfirst=True
+    sources = get_ashford_sources()
+    snapshots = snapshot.load_snapshots(
+        [source["file_path"] for source in sources],
+        snapshot.read_source,
+        "ashford",
+        build_kwargs=[{"header": 0 if source.get("header", True) else None} for source in sources],
     )
-    ashford_2023_Nov_Dec = ashford_2023_Nov_Dec.loc[ashford_2023_Nov_Dec["INVOICED DATE"] > "2023-10-31"]
-    prep_data = pd.concat([prep_data, ashford_2023_Nov_Dec]).reset_index(drop=True)
 
-    # prep_data.to_csv(r"C:\Users\ZhiningLiu\OneDrive - Ansor\Desktop\prep_data-1.csv")
+    # Combine the separate yearly files together
+    new_columns = snapshots[0].columns
+    prep_data = pd.concat(
+        [clean_ashford_source(df, source, new_columns) for df, source in zip(snapshots, sources)]
+    ).reset_index(drop=True)
 
     # Fill in null values in the product description column
     prep_data["PRODUCT DESC"] = prep_data["PRODUCT DESC"].fillna(
@@ -874,24 +594,6 @@ def preprocess_labtrac_ashford():
     prep_data["PRACTICE"] = prep_data["PRACTICE"].astype(str)
     prep_data["CASE NUMBER"] = prep_data["CASE NUMBER"].astype(str)
     prep_data["STATUS"] = prep_data["STATUS"].astype(str)
-    # prep_data["DATE IN"] = pd.to_datetime(
-    #     prep_data["DATE IN"], format="%d/%m/%Y"
-    # )
-    # prep_data["DUE DATE"] = pd.to_datetime(
-    #     prep_data["DUE DATE"], format="%d/%m/%Y"
-    # )
-    # prep_data.to_csv(r"C:\Users\ZhiningLiu\OneDrive - Ansor\Desktop\prep_data-2.csv")
-    prep_data["INVOICED DATE"] = prep_data["INVOICED DATE"].astype(str)
-    prep_data = prep_data.loc[~prep_data["INVOICED DATE"].str.contains("1899")]
-    prep_data["INVOICED DATE"] = prep_data["INVOICED DATE"].str.replace(".1", "")
-    # prep_data = prep_data.loc[~(prep_data["INVOICED DATE"] == ".1")]
-    prep_data["INVOICED DATE"] = pd.to_datetime(prep_data["INVOICED DATE"])
-    # prep_data["INVOICED DATE"] = prep_data["INVOICED DATE"].str.rstrip(".1")
-    # prep_data = prep_data.loc[~prep_data["INVOICED DATE"].str.contains("1899")]
-
-    # prep_data["INVOICED DATE"] = pd.to_datetime(
-    #     prep_data["INVOICED DATE"], format="%d/%m/%Y"
-    # )
     prep_data["PRODUCT ID"] = prep_data["PRODUCT ID"].astype(str)
     prep_data["PRODUCT DESC"] = prep_data["PRODUCT DESC"].astype(str)
     prep_data["UNIT"] = prep_data["UNIT"].astype(int)
@@ -901,13 +603,6 @@ def preprocess_labtrac_ashford():
     prep_data["PRICE"] = prep_data["PRICE"].str.replace(",", "")
     prep_data["PRICE"] = prep_data["PRICE"].astype(float)
 
-    # Add unique row identifier
-    prep_data["order_uuid"] = prep_data.apply(lambda _: uuid.uuid4(), axis=1)
-    prep_data["order_uuid"] = prep_data["order_uuid"].astype(str)
-
-    # Remove any rows with dates prior to 2021
-    # prep_data = prep_data.loc[prep_data["INVOICED DATE"] > pd.Timestamp(2021, 1, 1)]
-
     # Add ALS lab identifier and system source
     prep_data["als_lab"] = "Ashford"
     prep_data["system_source"] = "Labtrac"
@@ -932,9 +627,16 @@ def preprocess_labtrac_ashford():
             "PRICE": "net_sales",
         }
     )
+
+    # Add deterministic unique row identifier
+    with profiling.stage("row_ids", "ashford") as counts:
+        prep_data["order_uuid"] = row_id.generate_row_ids(prep_data, "Ashford", "ashford")
+        counts["rows_out"] = len(prep_data)
+
     prep_data = prep_data[
         [
             "order_uuid",
+            "order_id",
             "order_invoiced_date",
             "system_source",
             "als_lab",
@@ -953,94 +655,108 @@ def preprocess_labtrac_ashford():
 
     return prep_data
 
-def preprocess_evident_densign(als_lab: str) -> pd.DataFrame:
+def get_densign_files(folder_path=None) -> list:
     """
-    Input and preprocess raw data from a single lab from the Evident system.
-    :param als_lab: Str name of the ALS dental lab the data is from.
-    :return prep_data: DataFrame containing preprocessed data for a single lab from Evident.
+    Returns the monthly Evident report workbooks for Densign, in file name order. Excel lock files (~$...) are
+    skipped.
     """
-    # Find all filepaths of data files for the given lab using Evident
-    folder_path = "data\sales_densign\densign"
-    file_path_list = [
-        os.path.join(folder_path, file_path) for file_path in os.listdir(folder_path)
+    if folder_path is None:
+        folder_path = mysettings.DENSIGN_FOLDER_PATH
+    return [
+        os.path.join(folder_path, file_name)
+        for file_name in sorted(os.listdir(folder_path))
+        if Path(file_name).suffix.lower() in (".xlsx", ".xls") and not file_name.startswith("~$")
     ]
 
-    # Download and clean and join the monthly reports together
-    df_list = []
-    for file_path in tqdm(file_path_list):
-        # Load in the data for the month
-        df = pd.read_excel(file_path)
-
-        # Extract the month that the data is from
-        date_str = df["Densign Lab"].values[1]
-        first_date = dparser.parse(date_str.split("-")[0], fuzzy=True)
-
-        # Remove extraneous rows at the top of the original Excel file and set the correct column headers
-        df = df.iloc[5:, :].reset_index(drop=True)
-        df.columns = df.iloc[0, :]
-        df = df.iloc[1:, :].reset_index(drop=True)
-
-        # Fill in the missing values in the first three columns, to convert from Excel template format to data table
-        if (
-            "Customer Code" in df.columns
-            and "Customer Name" not in df.columns
-            and "Group" not in df.columns
-        ):
-            df[["Customer Code", "Dentist Name", "Practice Name"]] = df[
-                ["Customer Code", "Dentist Name", "Practice Name"]
-            ].ffill(axis=0)
-        elif (
-            "Customer Name" in df.columns
-            and "Customer Code" not in df.columns
-            and "Group" not in df.columns
-        ):
-            df[["Customer Name", "Dentist Name", "Practice Name"]] = df[
-                ["Customer Name", "Dentist Name", "Practice Name"]
-            ].ffill(axis=0)
-            df = df.rename(columns={"Customer Name": "Customer Code"})
-        elif (
-            "Group" in df.columns
-            and "Customer Code" not in df.columns
-            and "Customer Name" not in df.columns
-        ):
-            df[["Group", "Dentist Name", "Practice Name"]] = df[
-                ["Group", "Dentist Name", "Practice Name"]
-            ].ffill(axis=0)
-            df = df.rename(columns={"Group": "Customer Code"})
-
-        df = df.dropna(axis=0, how="any", subset="Item")
-
-        # Add date column
-        df["year_month"] = first_date
-
-        # Drop the % columns
-        df = df.drop(
-            columns=[
-                "%",
-                "Alloy",
-                "COGS Alloy",
-                "Tax",
-            ]
-        )
-
-        # Ensure all rows are correctly ordered
-        df = df[
-            [
-                "Customer Code",
-                "Dentist Name",
-                "Practice Name",
-                "Item",
-                "Product Pieces",
-                "Remake Pieces",
-                "Revenue",
-                "Total",
-                "year_month",
-            ]
+def clean_densign_month(file_path) -> pd.DataFrame:
+    """
+    Read and clean one monthly Evident report for Densign, converting it from the Excel template layout to a data
+    table. Run by snapshot.load_snapshots, which caches the result.
+    :param file_path: Path of the monthly Excel report.
+    :return df: DataFrame with the month's customer, product and sales columns and its year_month.
+    """
+    # Load in the data for the month
+    df = pd.read_excel(file_path)
+
+    # Extract the month that the data is from
+    date_str = df["Densign Lab"].values[1]
+    first_date = dparser.parse(date_str.split("-")[0], fuzzy=True)
+
+    # Remove extraneous rows at the top of the original Excel file and set the correct column headers
+    df = df.iloc[5:, :].reset_index(drop=True)
+    df.columns = df.iloc[0, :]
+    df = df.iloc[1:, :].reset_index(drop=True)
+
+    # Fill in the missing values in the first three columns, to convert from Excel template format to data table
+    if (
+        "Customer Code" in df.columns
+        and "Customer Name" not in df.columns
+        and "Group" not in df.columns
+    ):
+        df[["Customer Code", "Dentist Name", "Practice Name"]] = df[
+            ["Customer Code", "Dentist Name", "Practice Name"]
+        ].ffill(axis=0)
+    elif (
+        "Customer Name" in df.columns
+        and "Customer Code" not in df.columns
+        and "Group" not in df.columns
+    ):
+        df[["Customer Name", "Dentist Name", "Practice Name"]] = df[
+            ["Customer Name", "Dentist Name", "Practice Name"]
+        ].ffill(axis=0)
+        df = df.rename(columns={"Customer Name": "Customer Code"})
+    elif (
+        "Group" in df.columns
+        and "Customer Code" not in df.columns
+        and "Customer Name" not in df.columns
+    ):
+        df[["Group", "Dentist Name", "Practice Name"]] = df[
+            ["Group", "Dentist Name", "Practice Name"]
+        ].ffill(axis=0)
+        df = df.rename(columns={"Group": "Customer Code"})
+
+    df = df.dropna(axis=0, how="any", subset="Item")
+
+    # Add date column
+    df["year_month"] = first_date
+
+    # Drop the % columns
+    df = df.drop(
+        columns=[
+            "%",
+            "Alloy",
+            "COGS Alloy",
+            "Tax",
         ]
+    )
 
-        # Add to the list of cleaned dfs, ready to be joined together after all monthly data files have been cleaned
-        df_list.append(df)
+    # Ensure all rows are correctly ordered
+    df = df[
+        [
+            "Customer Code",
+            "Dentist Name",
+            "Practice Name",
+            "Item",
+            "Product Pieces",
+            "Remake Pieces",
+            "Revenue",
+            "Total",
+            "year_month",
+        ]
+    ]
+
+    # Numeric columns are read from the data rows of an object column, so give them their own types
+    return df.infer_objects()
 
+def preprocess_evident_densign(als_lab: str) -> pd.DataFrame:
+    """
+    Input and preprocess raw data from a single lab from the Evident system. Each monthly report is only read and
+    cleaned again if it changed since the last run, and new months are read in parallel.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :return prep_data: DataFrame containing preprocessed data for a single lab from Evident.
+    """
+    # Load the cleaned monthly reports and join them together
+    df_list = snapshot.load_snapshots(get_densign_files(), clean_densign_month, "densign")
     prep_data = pd.concat(df_list)
 
     # Remove any trailing spaces from the product codes
@@ -1064,13 +780,10 @@ def preprocess_evident_densign(als_lab: str) -> pd.DataFrame:
     prep_data["system_source"] = "Evident"
     prep_data["als_lab"] = als_lab
 
-    # Add unique row identifier
-    prep_data["customer_product_cube_uuid"] = prep_data.apply(
-        lambda _: uuid.uuid4(), axis=1
-    )
-    prep_data["customer_product_cube_uuid"] = prep_data[
-        "customer_product_cube_uuid"
-    ].astype(str)
+    # Add deterministic unique row identifier
+    with profiling.stage("row_ids", "densign") as counts:
+        prep_data["customer_product_cube_uuid"] = row_id.generate_row_ids(prep_data, als_lab, "densign")
+        counts["rows_out"] = len(prep_data)
 
     # Fill the product id column
     prep_data["product_id"] = prep_data["product_description"]
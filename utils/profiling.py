@@ -0,0 +1,198 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+from . import mysettings
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS is not recorded
+    resource = None
+
+folder_path = mysettings.RAW_FOLDER_PATH
+
+# (stage, file, func_name) -> totals over every time the stage ran for that file and function
+stage_records = {}
+run_started = {"time": datetime.now(), "wall": time.perf_counter(), "cpu": time.process_time()}
+
+def get_peak_rss_mb():
+    """
+    Returns the largest resident set size this process has reached so far, in MB, or None if it is not available.
+    """
+    # On Linux ru_maxrss carries over from the parent into forked and spawned processes, VmHWM does not
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def add_record(record):
+    key = (record["stage"], record["file"], record["func_name"])
+    totals = stage_records.get(key)
+    if totals is None:
+        stage_records[key] = dict(record)
+        return
+
+    totals["calls"] += record["calls"]
+    totals["wall_seconds"] += record["wall_seconds"]
+    totals["cpu_seconds"] += record["cpu_seconds"]
+    for name in ["rows_in", "rows_out"]:
+        if record[name] is not None:
+            totals[name] = (totals[name] or 0) + record[name]
+    if record["peak_rss_mb"] is not None:
+        totals["peak_rss_mb"] = max(totals["peak_rss_mb"] or 0, record["peak_rss_mb"])
+
+@contextmanager
+def stage(name, file=None, func_name=None):
+    """
+    Record the wall time, CPU time and peak RSS of a block of code as a pipeline stage. The block can set "rows_in"
+    and "rows_out" on the yielded dict. Repeated runs of a stage for the same file and function, e.g. one per chunk,
+    are added together.
+    :param name: Str name of the stage, e.g. "csv_read" or "transform".
+    :param file: Path of the file the stage works on, if any.
+    :param func_name: Name of the preprocess or mapping function the stage runs, if any.
+    """
+    counts = {"rows_in": None, "rows_out": None}
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield counts
+    finally:
+        add_record({
+            "stage": name,
+            "file": str(file) if file is not None else None,
+            "func_name": func_name,
+            "calls": 1,
+            "wall_seconds": time.perf_counter() - wall,
+            "cpu_seconds": time.process_time() - cpu,
+            "rows_in": counts["rows_in"],
+            "rows_out": counts["rows_out"],
+            "peak_rss_mb": get_peak_rss_mb(),
+        })
+
+def profiled(name):
+    """
+    Decorator recording every call of a function as a stage, e.g. @profiling.profiled("combine").
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, func_name=func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def profile_iter(iterable, name, file=None, func_name=None):
+    """
+    Iterate over an iterable of DataFrames, e.g. CSV chunks, recording the time taken to produce each one as a stage
+    with the rows produced as rows_out.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name, file, func_name) as counts:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            counts["rows_out"] = len(item)
+        yield item
+
+def clear_records():
+    """
+    Clear the stage records. Used as the initializer of worker processes, which start with a copy of the main
+    process's records when forked and would otherwise hand them back to be counted again.
+    """
+    stage_records.clear()
+
+def pop_records() -> list:
+    """
+    Returns the stage records and clears them, so a worker process can hand its records back to the main process.
+    """
+    records = list(stage_records.values())
+    clear_records()
+    return records
+
+def merge_records(records):
+    for record in records:
+        add_record(record)
+
+def get_stage_totals(records) -> dict:
+    totals = {}
+    for record in records:
+        stage_totals = totals.setdefault(
+            record["stage"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows_in": 0, "rows_out": 0}
+        )
+        for name in ["calls", "wall_seconds", "cpu_seconds", "rows_in", "rows_out"]:
+            stage_totals[name] += record[name] or 0
+    return totals
+
+def write_run_report(output_file=None):
+    """
+    Write the stage records of this run as JSON, by default to files/<raw folder>/run_report.json, and print the
+    time spent in each stage. Stages run in worker processes are included once their records have been merged.
+    Stages nest (e.g. transform runs inside preprocess), so their times do not add up to the run time.
+    :return report: Dict written to the report.
+    """
+    if output_file is None:
+        last_folder = os.path.basename(folder_path)
+        output_file = Path(f"files/{last_folder}/run_report.json")
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+    records = list(stage_records.values())
+    report = {
+        "started": run_started["time"].isoformat(timespec="seconds"),
+        "finished": datetime.now().isoformat(timespec="seconds"),
+        "wall_seconds": time.perf_counter() - run_started["wall"],
+        "cpu_seconds": time.process_time() - run_started["cpu"],
+        "peak_rss_mb": get_peak_rss_mb(),
+        "stage_totals": get_stage_totals(records),
+        "stages": records,
+    }
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+
+    for name, totals in report["stage_totals"].items():
+        print(
+            f"{name}: {totals['wall_seconds']:.2f}s wall, {totals['cpu_seconds']:.2f}s CPU, "
+            f"{totals['rows_out']} rows out ({totals['calls']} calls)"
+        )
+    print(f"Run report written to {output_file}")
+    return report
+
+@contextmanager
+def cprofile(output_file=None, enabled=True):
+    """
+    Run a block of code under cProfile and dump the stats to output_file (default files/<raw folder>/profile.prof),
+    to be read with pstats or snakeviz. Only the calling process is profiled, not the worker processes.
+    """
+    if not enabled:
+        yield
+        return
+
+    if output_file is None:
+        last_folder = os.path.basename(folder_path)
+        output_file = Path(f"files/{last_folder}/profile.prof")
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_file)
+        print(f"cProfile stats written to {output_file}")
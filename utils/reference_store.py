@@ -0,0 +1,77 @@
+from pathlib import Path
+import os
+import pandas as pd
+from . import mysettings, manifest, io_utils, profiling
+
+def get_reference_file(name):
+    """
+    Returns the path of a compiled reference table, e.g. data/reference/woodford.arrow.
+    """
+    return f"{mysettings.REFERENCE_FOLDER_PATH}/{name}.arrow"
+
+def write_reference(df: pd.DataFrame, reference_file):
+    """
+    Write a reference table as an uncompressed Arrow IPC (Feather) file, so it can be memory mapped when read.
+    """
+    import pyarrow.feather as feather
+
+    Path(reference_file).parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so a failed run never leaves a half-written table behind
+    tmp_reference_file = f"{reference_file}.tmp"
+    feather.write_feather(
+        io_utils.make_arrow_compatible(df.reset_index(drop=True)), tmp_reference_file, compression="uncompressed"
+    )
+    os.replace(tmp_reference_file, reference_file)
+
+def read_reference(reference_file) -> pd.DataFrame:
+    """
+    Read a reference table written by write_reference. The file is memory mapped, so processes reading the same
+    table share its pages through the OS file cache.
+    """
+    import pyarrow.feather as feather
+
+    return feather.read_table(reference_file, memory_map=True).to_pandas()
+
+def load_reference(name, source_files, build, build_kwargs=None, pipeline_manifest=None) -> tuple:
+    """
+    Returns a reference table built from source files, e.g. a lab's NHS-private mapping from its Excel price lists.
+    The table is compiled once into an Arrow file recorded in the pipeline manifest with the content hash of each
+    source, and only built again when a source changes, the build arguments change or
+    mysettings.REFERENCE_VERSION[name] is bumped.
+    :param name: Str name of the table, used as the file name and the REFERENCE_VERSION key.
+    :param source_files: List of source file paths, passed to build in order.
+    :param build: Function taking the source file paths and build_kwargs and returning a DataFrame.
+    :param build_kwargs: Optional dict of keyword arguments for build.
+    :param pipeline_manifest: manifest.PipelineManifest to record the table in. If None, one is loaded and saved.
+    :return df, rebuilt: The table, and whether it was built in this call.
+    """
+    save_manifest = pipeline_manifest is None
+    if pipeline_manifest is None:
+        pipeline_manifest = manifest.PipelineManifest()
+
+    build_kwargs = build_kwargs or {}
+    version = mysettings.REFERENCE_VERSION.get(name, 1)
+    source_hashes = [[str(source_file), pipeline_manifest.hash(source_file)] for source_file in source_files]
+
+    if pipeline_manifest.is_unchanged(
+        "reference", name, sources=source_hashes, version=version, build_kwargs=build_kwargs
+    ):
+        with profiling.stage("reference_read", get_reference_file(name)) as counts:
+            df = read_reference(pipeline_manifest.get("reference", name)["output_file"])
+            counts["rows_out"] = len(df)
+        return df, False
+
+    print(f"Compiling reference table {name}")
+    with profiling.stage("reference_build", get_reference_file(name), build.__name__) as counts:
+        df = build(*source_files, **build_kwargs)
+        write_reference(df, get_reference_file(name))
+        counts["rows_out"] = len(df)
+
+    pipeline_manifest.record(
+        "reference", name, sources=source_hashes, version=version, build_kwargs=build_kwargs,
+        output_file=get_reference_file(name),
+    )
+    if save_manifest:
+        pipeline_manifest.save()
+    # Read back, so a rebuilt table has the same types as one read from the store
+    return read_reference(get_reference_file(name)), True
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+import hashlib
+import numpy as np
+import pandas as pd
+from . import dedup
+
+# Canonical columns that identify a sales row, in the names used by the preprocess functions' output. Only the
+# columns present in the frame are used.
+KEY_COLUMNS = [
+    "order_invoiced_date",
+    "year_month",
+    "practice_code",
+    "practice_name",
+    "ship_id",
+    "customer_id",
+    "customer_name",
+    "product_code",
+    "product_description",
+    "quantity",
+    "net_sales",
+]
+
+# (als_lab, source_file) -> {row hash: occurrences seen so far}, for files being processed in chunks
+chunk_occurrences = {}
+
+@contextmanager
+def chunked_row_ids(als_lab, source_file):
+    """
+    While active, generate_row_ids calls for this lab and source file carry the occurrence count of identical rows
+    over from one chunk to the next, so IDs stay unique across all chunks of the file.
+    """
+    chunk_occurrences[(als_lab, source_file)] = {}
+    try:
+        yield
+    finally:
+        chunk_occurrences.pop((als_lab, source_file), None)
+
+def get_key_columns(df: pd.DataFrame, key_cols=None):
+    if key_cols is None:
+        key_cols = KEY_COLUMNS
+    return [col for col in key_cols if col in df.columns]
+
+def hash_key_column(values: pd.Series) -> np.ndarray:
+    """
+    Hash a key column as normalized strings (see dedup.normalize_text), so a value gets the same hash whether its
+    column was read as int, float or str. The type of a column can differ between the chunks of a file, e.g. when
+    only some chunks have empty values. Dates are hashed as they are. Each distinct value is normalized once.
+    :return hashes: uint64 array aligned to values.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+    codes, uniques = pd.factorize(values)
+    # factorize gives empty values the code -1, which picks the hash of "" at the end
+    normalized = dedup.normalize_text(pd.Series(uniques, dtype=object)).tolist() + [""]
+    return pd.util.hash_array(np.array(normalized, dtype=object))[codes]
+
+def source_seed(als_lab, source_file) -> np.uint64:
+    """
+    Returns a 64-bit seed for an (ALS lab, source file) pair, stable across runs and machines (unlike hash()).
+    """
+    digest = hashlib.sha1(f"{als_lab}|{source_file}".encode("utf-8")).digest()
+    return np.frombuffer(digest[:8], dtype="<u8")[0]
+
+def generate_row_ids(df: pd.DataFrame, als_lab, source_file=None, key_cols=None, as_int=False):
+    """
+    Generate deterministic row IDs by hashing the ALS lab, the source file and each row's key columns in bulk.
+    Re-running the pipeline on the same file gives the same IDs, so outputs can be diffed and deduplicated.
+    Identical rows within a file are told apart by their occurrence number, so every ID in a file is unique. Key
+    values are compared as normalized strings, see hash_key_column.
+    :param df: DataFrame to generate IDs for.
+    :param als_lab: Str name of the ALS dental lab the data is from.
+    :param source_file: Str name of the source file the rows were read from.
+    :param key_cols: Columns to hash. Defaults to the KEY_COLUMNS present in df.
+    :param as_int: If True return uint64 IDs, otherwise fixed width 16 character hex strings.
+    :return row_ids: Series of IDs aligned to df's index.
+    """
+    key_cols = get_key_columns(df, key_cols)
+    if len(key_cols) > 0:
+        column_hashes = pd.DataFrame({col: hash_key_column(df[col]) for col in key_cols})
+        row_hash = pd.util.hash_pandas_object(column_hashes, index=False).to_numpy()
+    else:
+        row_hash = np.zeros(len(df), dtype="uint64")
+
+    row_hash = row_hash ^ source_seed(als_lab, source_file)
+    occurrence = pd.Series(row_hash).groupby(row_hash).cumcount().to_numpy()
+
+    seen = chunk_occurrences.get((als_lab, source_file))
+    if seen is not None:
+        hashes, counts = np.unique(row_hash, return_counts=True)
+        offsets = np.fromiter((seen.get(h, 0) for h in hashes.tolist()), dtype="int64", count=len(hashes))
+        occurrence = occurrence + offsets[np.searchsorted(hashes, row_hash)]
+        seen.update(zip(hashes.tolist(), (offsets + counts).tolist()))
+
+    ids = pd.util.hash_pandas_object(
+        pd.DataFrame({"row_hash": row_hash, "occurrence": occurrence}), index=False
+    ).to_numpy()
+
+    if as_int:
+        return pd.Series(ids, index=df.index, dtype="uint64")
+    return pd.Series(format_row_ids(ids), index=df.index)
+
+def format_row_ids(ids: np.ndarray) -> np.ndarray:
+    """
+    Format uint64 IDs as 16 character lowercase hex strings without a Python-level loop.
+    """
+    hex_ids = np.ascontiguousarray(ids, dtype=">u8").tobytes().hex().encode("ascii")
+    return np.frombuffer(hex_ids, dtype="S16").astype(str)
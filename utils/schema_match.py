@@ -0,0 +1,176 @@
+from pathlib import Path
+import os
+import re
+import pandas as pd
+from . import schema_utils, mapping, mysettings, pre_process_function
+
+# Columns pandas names itself for blank header cells, e.g. the trailing "Unnamed: 58" of Schema_4
+UNNAMED_COLUMN = re.compile(r"^Unnamed: \d+$")
+
+folder_path = mysettings.RAW_FOLDER_PATH
+
+def normalize_header(columns) -> frozenset:
+    """
+    Returns the set of named columns of a header, ignoring the "Unnamed: n" columns.
+    """
+    return frozenset(str(col) for col in columns if not UNNAMED_COLUMN.match(str(col)))
+
+def build_schema_index(schemas=None) -> tuple:
+    """
+    Index the known schemas that have a preprocess function by their named columns.
+    :return known_headers, column_index: Dict of schema key -> normalized header, and dict of column -> schema keys
+    with that column, so a header is only scored against schemas it shares a column with.
+    """
+    if schemas is None:
+        schemas = schema_utils.lookup_schema()
+
+    known_headers = {}
+    column_index = {}
+    for key, columns in schemas.items():
+        header = normalize_header(columns)
+        # Schemas with no named columns, e.g. Schema_9 whose header is in the first row, cannot be scored
+        if len(header) == 0 or key not in pre_process_function.lookup_preprocess_function:
+            continue
+        known_headers[key] = header
+        for col in header:
+            column_index.setdefault(col, []).append(key)
+    return known_headers, column_index
+
+known_headers, column_index = build_schema_index()
+known_columns = schema_utils.lookup_schema()
+
+# Tuple of columns -> match result, so each distinct header is matched once per run
+match_results = {}
+
+def score_header(header, known_header) -> tuple:
+    """
+    :return containment, jaccard: Share of the known schema's named columns found in the header, and the number of
+    named columns in both divided by the number in either.
+    """
+    common = len(header & known_header)
+    return common / len(known_header), common / len(header | known_header)
+
+def is_compatible(columns, schema_type) -> bool:
+    """
+    Whether the preprocess function of a schema can read a file with these columns: it must have the column count
+    the mapping spec checks for, if any, and every column of the schema that the spec reads.
+    """
+    func = pre_process_function.lookup_preprocess_function[schema_type]
+    spec = pre_process_function.lookup_mapping_spec[func.__name__]
+
+    if spec.get("columns") and len(columns) != len(spec["columns"]):
+        return False
+    if spec.get("expected_columns") is not None and len(columns) != spec["expected_columns"]:
+        return False
+
+    usecols = mapping.get_source_usecols(spec)
+    if usecols is not None:
+        # Only the columns this schema has, as a spec can read alternative names, e.g. Date or CompletedDate
+        required = usecols & set(known_columns[schema_type])
+        if not required <= set(columns):
+            return False
+    return True
+
+def match_header(columns) -> dict:
+    """
+    Score a header that matches no known schema exactly against the known schemas, ignoring "Unnamed: n" columns.
+    A schema is a candidate when its containment is at least mysettings.SCHEMA_MATCH_MIN_CONTAINMENT, its Jaccard
+    similarity at least mysettings.SCHEMA_MATCH_MIN_JACCARD, and its preprocess function can read the columns.
+    :param columns: List of column headers.
+    :return result: Dict with the status, "matched" when the best candidates all use the same preprocess function,
+    "ambiguous" when candidates within mysettings.SCHEMA_MATCH_AMBIGUITY_MARGIN of the best Jaccard use different
+    preprocess functions, or "no_match". schema_type is the matched schema key, or None. best_schema, containment,
+    jaccard, missing_columns and extra_columns describe the best scoring schema even when it is not a candidate.
+    """
+    cache_key = tuple(columns)
+    if cache_key in match_results:
+        return match_results[cache_key]
+
+    header = normalize_header(columns)
+    scores = {}
+    for col in header:
+        for key in column_index.get(col, []):
+            if key not in scores:
+                scores[key] = score_header(header, known_headers[key])
+    ranked = sorted(scores.items(), key=lambda item: (item[1][1], item[1][0]), reverse=True)
+
+    candidates = [
+        (key, (containment, jaccard)) for key, (containment, jaccard) in ranked
+        if containment >= mysettings.SCHEMA_MATCH_MIN_CONTAINMENT
+        and jaccard >= mysettings.SCHEMA_MATCH_MIN_JACCARD
+        and is_compatible(columns, key)
+    ]
+
+    result = {
+        "status": "no_match",
+        "schema_type": None,
+        "best_schema": None,
+        "containment": None,
+        "jaccard": None,
+        "candidates": [key for key, _ in candidates],
+        "missing_columns": [],
+        "extra_columns": [],
+    }
+    if candidates:
+        best_key, (_, best_jaccard) = candidates[0]
+        close_functions = {
+            pre_process_function.lookup_preprocess_function[key].__name__
+            for key, (_, jaccard) in candidates
+            if jaccard >= best_jaccard - mysettings.SCHEMA_MATCH_AMBIGUITY_MARGIN
+        }
+        if len(close_functions) == 1:
+            result["status"] = "matched"
+            result["schema_type"] = best_key
+        else:
+            result["status"] = "ambiguous"
+    elif ranked:
+        best_key = ranked[0][0]
+    else:
+        match_results[cache_key] = result
+        return result
+
+    result["best_schema"] = best_key
+    result["containment"], result["jaccard"] = scores[best_key]
+    result["missing_columns"] = sorted(known_headers[best_key] - header)
+    result["extra_columns"] = sorted(header - known_headers[best_key])
+    match_results[cache_key] = result
+    return result
+
+def write_match_report(files, output_file=None):
+    """
+    Write the match result of every file whose header matched no known schema exactly, by default to
+    files/<raw folder>/schema_match_report.csv, so the ambiguous and unmatched files can be given a schema by hand.
+    :param files: List of (file path, schema key the file was given, column headers).
+    :return df: DataFrame written to the report, or None if there were no such files.
+    """
+    if len(files) == 0:
+        return None
+
+    rows = []
+    for file, schema_type, columns in files:
+        result = match_header(columns)
+        rows.append({
+            "file_name": file,
+            "schema_type": schema_type,
+            "status": result["status"],
+            "best_schema": result["best_schema"],
+            "containment": result["containment"],
+            "jaccard": result["jaccard"],
+            "candidates": ", ".join(result["candidates"]),
+            "missing_columns": ", ".join(result["missing_columns"]),
+            "extra_columns": ", ".join(result["extra_columns"]),
+        })
+    df = pd.DataFrame(rows)
+
+    if output_file is None:
+        last_folder = os.path.basename(folder_path)
+        output_file = Path(f"files/{last_folder}/schema_match_report.csv")
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(output_file, index=False)
+
+    counts = df["status"].value_counts()
+    print(
+        f"Schema matching: {counts.get('matched', 0)} files matched, {counts.get('ambiguous', 0)} ambiguous, "
+        f"{counts.get('no_match', 0)} unmatched. Report written to {output_file}"
+    )
+    return df
@@ -15,5 +15,41 @@ def lookup_schema():
     }
     return dic
 
+def lookup_schema_dtypes():
+    """
+    Column dtypes applied by the CSV parser when reading raw files of each schema in lookup_schema. Columns holding a
+    handful of distinct values are read as categoricals, and the Transactor amounts that the preprocess functions
+    cast to float anyway are parsed as floats. Transactor product codes are read as strings, as numeric codes would
+    otherwise be read as floats (e.g. "2833.0") whenever the REPORT TOTALS row, which has no code, is in the rows
+    read. Other columns that feed the row IDs keep the parser's inferred dtype, so the IDs do not change.
+    """
+    transactor_amounts = {"code": "str", "Qty": "float64", "Net_Sales": "float64", "Tax_Sales": "float64"}
+    dic = {
+        "Schema_1": {"Category": "category", "Standard": "category", "Status": "category"},
+        "Schema_2": {"Stage": "category", "Category": "category", "Standard": "category", "Status": "category"},
+        "Schema_3": {
+            "CategoryDescription": "category",
+            "StandardDescription": "category",
+            "Status": "category",
+            "CurrencySymbol": "category",
+            "CurrencyDescription": "category",
+        },
+        "Schema_5": {
+            "PriceBand": "category",
+            "NetUnitPrice": "float64",
+            "DiscountedUnitPrice": "float64",
+            **transactor_amounts,
+        },
+        "Schema_6": transactor_amounts,
+        "Schema_7": {"NHS /Private/Independent/PPE": "category"},
+        "Schema_8": {"NHS /Private/Independent/PPE": "category"},
+        "Schema_9": {"NHS /Private/Independent/PPE": "category"},
+        "Schema_10": transactor_amounts,
+        "Schema_11": {"CAT": "category", "SUBCAT": "category", "MAT": "category", "STAN": "category"},
+        "Schema_12": {},
+    }
+    dic["Schema_4"] = dic["Schema_3"]
+    return dic
+
 def get_input_folder_list() -> list:
     return ["data_sales/densign","data_sales/ashford"]
\ No newline at end of file
@@ -0,0 +1,111 @@
+from pathlib import Path
+import hashlib
+import pandas as pd
+from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import mysettings, manifest, io_utils, encoding, profiling
+
+def get_snapshot_file(name, source_file):
+    """
+    Returns the path of the snapshot of a source file, e.g. data/snapshots/densign/Densign Jan 2024-1a2b3c4d.parquet.
+    The file name ends with a short hash of the source's full path, so sources with the same name in different
+    folders, or with different extensions, get their own snapshots.
+    """
+    path_hash = hashlib.sha1(Path(source_file).as_posix().encode("utf-8")).hexdigest()[:8]
+    return f"{mysettings.SNAPSHOT_FOLDER_PATH}/{name}/{Path(source_file).stem}-{path_hash}.parquet"
+
+def read_source(file_path, header=0) -> pd.DataFrame:
+    """
+    Read an Excel or CSV source file as it is, to be snapshotted by load_snapshots.
+    :param header: Row holding the column names, or None if the file has no header row and the columns should be
+    numbered.
+    """
+    if Path(file_path).suffix.lower() == ".csv":
+        return encoding.read_csv(file_path, header=header, low_memory=False)
+    return pd.read_excel(file_path, header=header)
+
+def build_snapshot(build, source_file, snapshot_file, build_kwargs=None) -> pd.DataFrame:
+    """
+    Build the frame for a source file and write it as a Parquet snapshot. Module level so that it can run in a worker
+    process.
+    :return df: The frame as written, with any mixed type columns converted to strings like they are read back.
+    """
+    with profiling.stage("snapshot_build", source_file, build.__name__) as counts:
+        df = io_utils.make_arrow_compatible(build(source_file, **(build_kwargs or {})))
+        # Parquet column names must be strings
+        df.columns = df.columns.map(str)
+        Path(snapshot_file).parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(snapshot_file, index=False, compression=mysettings.PARQUET_COMPRESSION)
+        counts["rows_out"] = len(df)
+    return df
+
+def build_snapshot_in_worker(*args):
+    """
+    build_snapshot for a worker process, also returning the worker's profiling stage records.
+    """
+    return build_snapshot(*args), profiling.pop_records()
+
+def load_snapshots(source_files, build, name, workers=None, build_kwargs=None) -> list:
+    """
+    Returns one DataFrame per source file, in order, built by build(source_file). Each frame is cached as a typed
+    Parquet snapshot recorded in the pipeline manifest with the source file's content hash, so a source is only
+    parsed again when it changes or when mysettings.SNAPSHOT_VERSION[name] is bumped. Sources without a valid
+    snapshot are built in parallel.
+    :param source_files: List of source file paths, e.g. Excel workbooks.
+    :param build: Module level function taking a source file path and returning a DataFrame, e.g. read_source.
+    :param name: Str name of the snapshot set, used as the snapshot folder and the SNAPSHOT_VERSION key.
+    :param workers: Number of worker processes used to build snapshots (default mysettings.SNAPSHOT_WORKERS). When
+    1 the snapshots are built serially.
+    :param build_kwargs: Optional list of keyword argument dicts for build, aligned to source_files. A snapshot is
+    also rebuilt when its arguments change.
+    :return dfs: List of DataFrames aligned to source_files.
+    """
+    if workers is None:
+        workers = mysettings.SNAPSHOT_WORKERS
+    version = mysettings.SNAPSHOT_VERSION.get(name, 1)
+    if build_kwargs is None:
+        build_kwargs = [{} for _ in source_files]
+    source_kwargs = {str(source_file): kwargs for source_file, kwargs in zip(source_files, build_kwargs)}
+
+    pipeline_manifest = manifest.PipelineManifest()
+    file_hashes = {str(source_file): pipeline_manifest.hash(source_file) for source_file in source_files}
+
+    dfs = {}
+    changed_files = []
+    for source_file in source_files:
+        if pipeline_manifest.is_unchanged(
+            "snapshot", source_file, hash=file_hashes[str(source_file)], name=name, version=version,
+            build_kwargs=source_kwargs[str(source_file)],
+        ):
+            with profiling.stage("snapshot_read", source_file) as counts:
+                dfs[str(source_file)] = pd.read_parquet(pipeline_manifest.get("snapshot", source_file)["output_file"])
+                counts["rows_out"] = len(dfs[str(source_file)])
+        else:
+            changed_files.append(source_file)
+    print(f"{name}: {len(changed_files)} of {len(source_files)} source files are new or changed")
+
+    if len(changed_files) <= 1 or (workers is not None and workers <= 1):
+        for source_file in tqdm(changed_files):
+            dfs[str(source_file)] = build_snapshot(
+                build, source_file, get_snapshot_file(name, source_file), source_kwargs[str(source_file)]
+            )
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=profiling.clear_records) as executor:
+            futures = {
+                executor.submit(
+                    build_snapshot_in_worker, build, source_file, get_snapshot_file(name, source_file), source_kwargs[str(source_file)]
+                ): source_file
+                for source_file in changed_files
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                dfs[str(futures[future])], profile_records = future.result()
+                profiling.merge_records(profile_records)
+
+    for source_file in changed_files:
+        pipeline_manifest.record(
+            "snapshot", source_file, hash=file_hashes[str(source_file)], name=name, version=version,
+            build_kwargs=source_kwargs[str(source_file)], output_file=get_snapshot_file(name, source_file),
+        )
+    pipeline_manifest.save()
+
+    return [dfs[str(source_file)] for source_file in source_files]
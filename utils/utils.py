@@ -1,9 +1,14 @@
 from pathlib import Path
+import csv
+import datetime
+import hashlib
+import json
 import pandas as pd
-from . import schema_utils, mysettings
+from . import schema_utils, mysettings, manifest, encoding, profiling, schema_match
 import os
 from tqdm import tqdm
 from openpyxl import load_workbook
+import xlrd
 
 # load_dotenv()
 # folder_path = os.environ.get('RAW_FOLDER_PATH')
@@ -23,6 +28,168 @@ def get_als_lab_folder_name(file_path):
     path_parts = Path(file_path).parts  # Get all parts of the file path
     return path_parts[2] if len(path_parts) > 1 else None  # Return second folder if it exists
 
+def make_unique_headers(header):
+    """
+    Name the header cells the way pd.read_excel does: empty cells become "Unnamed: <i>" and repeated names get a
+    ".<n>" suffix, so converted files keep matching the schemas in schema_utils.
+    """
+    counts = {}
+    columns = []
+    for i, col in enumerate(header):
+        col = f"Unnamed: {i}" if col is None else str(col)
+        cur_count = counts.get(col, 0)
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f"{col}.{cur_count}"
+            cur_count = counts.get(col, 0)
+        counts[col] = cur_count + 1
+        columns.append(col)
+    return columns
+
+# Cell text pd.read_excel reads as missing by default, and the Excel error values, which it also reads as missing
+EXCEL_NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+    "NULL", "NaN", "None", "n/a", "nan", "null", "#DIV/0!", "#NAME?", "#NULL!", "#NUM!", "#REF!", "#VALUE!",
+}
+
+def format_excel_value(value):
+    """
+    Returns a cell value as pd.read_excel reads it: missing values as None and whole number floats as ints.
+    """
+    if isinstance(value, str) and value in EXCEL_NA_VALUES:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def get_column_formats(column_types, timed_columns) -> dict:
+    """
+    Returns the columns whose values pd.read_excel would have written differently to CSV, given the types of their
+    cells: "float" for the whole numbers and booleans of a float column, written as e.g. 5.0, "int" for the booleans
+    of an integer column, written as 1 or 0, and "date" for datetime columns with no time of day, written as dates
+    only.
+    :param column_types: List of the set of value types of each column, including NoneType for empty cells.
+    :param timed_columns: Set of the positions of columns holding a datetime with a time of day.
+    :return formats: Dict of column position to "float", "int" or "date".
+    """
+    formats = {}
+    for i, types in enumerate(column_types):
+        values = types - {type(None)}
+        is_numeric = len(values) > 0 and values <= {bool, int, float}
+        if is_numeric and values != {float} and (float in values or type(None) in types):
+            formats[i] = "float"
+        elif is_numeric and values == {bool, int}:
+            formats[i] = "int"
+        elif values == {datetime.datetime} and i not in timed_columns:
+            formats[i] = "date"
+    return formats
+
+def reformat_csv_columns(input_file, output_file, formats):
+    """
+    Copy a CSV file written by stream_sheet_to_csv, rewriting the non-empty values of the columns in formats (see
+    get_column_formats).
+    """
+    booleans = {"True": "1", "False": "0"}
+    with open(input_file, "r", encoding="utf-8", newline="") as f_in, \
+            open(output_file, "w", encoding="utf-8", newline="") as f_out:
+        reader = csv.reader(f_in)
+        writer = csv.writer(f_out, lineterminator="\n")
+        writer.writerow(next(reader))
+        for row in reader:
+            for i, column_format in formats.items():
+                if row[i] == "":
+                    continue
+                if column_format == "date":
+                    row[i] = row[i][:10]
+                else:
+                    row[i] = booleans.get(row[i], row[i])
+                    if column_format == "float":
+                        row[i] = repr(float(row[i]))
+            writer.writerow(row)
+
+def stream_sheet_to_csv(sheet, csv_file):
+    """
+    Stream the rows of a read-only openpyxl worksheet straight to a CSV file. The first row is the header. Empty rows
+    are kept unless they are at the end of the sheet, and values are written as pd.read_excel followed by to_csv
+    would write them.
+    """
+    # Some exporters write a wrong sheet size into the file, which read-only mode trusts and so skips rows or columns.
+    # Without it each row is read up to its last cell, and shorter rows are padded to the header's width.
+    sheet.reset_dimensions()
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None)
+
+    if header is None:
+        with open(csv_file, "w", encoding="utf-8", newline="") as f:
+            f.write("\n")
+        return
+
+    width = len(header)
+    # pd.read_excel picks each column's type from all of its values, which decides how some of them are written, so
+    # the types are collected while streaming and the columns that need it are rewritten afterwards
+    column_types = [set() for _ in range(width)]
+    timed_columns = set()
+    tmp_csv_file = f"{csv_file}.tmp"
+
+    with open(tmp_csv_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(make_unique_headers(header))
+        blank_rows = 0
+
+        for row in rows:
+            values = [format_excel_value(value) for value in row]
+            if all(value is None for value in values):
+                # Only write blank rows once a later row holds data
+                blank_rows += 1
+                continue
+            if blank_rows > 0:
+                for types in column_types:
+                    types.add(type(None))
+                for _ in range(blank_rows):
+                    writer.writerow([""] * width)
+                blank_rows = 0
+
+            values += [None] * (width - len(values))
+            for i, (types, value) in enumerate(zip(column_types, values)):
+                types.add(type(value))
+                if isinstance(value, datetime.datetime) and value.time() != datetime.time():
+                    timed_columns.add(i)
+            writer.writerow(values)
+
+    formats = get_column_formats(column_types, timed_columns)
+    if formats:
+        reformat_csv_columns(tmp_csv_file, csv_file, formats)
+        os.remove(tmp_csv_file)
+    else:
+        os.replace(tmp_csv_file, csv_file)
+
+def xlsx_sheets_to_csv(excel_file: Path, output_folder: Path):
+    # Open the workbook once in read-only mode, which streams rows from the file instead of loading every cell
+    wb = load_workbook(excel_file, read_only=True, data_only=True)
+    csv_files = []
+    try:
+        for sheet in wb.worksheets:
+            if sheet.sheet_state == "visible":
+                csv_file = f"{output_folder}/{excel_file.name}_{sheet.title}.csv"
+                stream_sheet_to_csv(sheet, csv_file)
+                csv_files.append(csv_file)
+    finally:
+        wb.close()
+    return csv_files
+
+def xls_sheets_to_csv(excel_file: Path, output_folder: Path):
+    # openpyxl cannot read the legacy .xls format, so read it once with xlrd and reuse the open book for every sheet
+    book = xlrd.open_workbook(excel_file, on_demand=True)
+    csv_files = []
+    with pd.ExcelFile(book, engine="xlrd") as xls:
+        for sheet_name in xls.sheet_names:
+            if book.sheet_by_name(sheet_name).visibility == 0:
+                df = xls.parse(sheet_name)
+                csv_file = f"{output_folder}/{excel_file.name}_{sheet_name}.csv"
+                df.to_csv(csv_file, index=False)
+                csv_files.append(csv_file)
+    return csv_files
+
 def excel_sheets_to_csv(file: Path):
     excel_file = file
     output_folder = file.parent.joinpath(sub_folder)
@@ -30,29 +197,45 @@ def excel_sheets_to_csv(file: Path):
     output_folder.mkdir(parents=True, exist_ok=True) 
     
     try:
-        xls = pd.ExcelFile(excel_file)
-        wb = load_workbook(excel_file, data_only=True)
-
-        for sheet_name in xls.sheet_names:
-            sheet = wb[sheet_name]
-
-            if sheet.sheet_state == "visible":
-                df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                csv_file = f"{output_folder}/{excel_file.name}_{sheet_name}.csv"            
-                df.to_csv(csv_file, index=False) 
+        if excel_file.suffix.lower() == ".xls":
+            csv_files = xls_sheets_to_csv(excel_file, output_folder)
+        else:
+            csv_files = xlsx_sheets_to_csv(excel_file, output_folder)
     except:       
         error_list.append(excel_file)
+        return None
 
-def get_excel_files():
-    """Returns a list of tuples containing the parent folder name and file name for all CSV and Excel files."""
+    return csv_files
+
+@profiling.profiled("excel")
+def get_excel_files(incremental=False):
+    """
+    Converts every visible sheet of every Excel file under the raw folder to CSV.
+    :param incremental: If True, skip workbooks whose content hash matches the pipeline manifest from the last run
+    and whose converted CSV files still exist.
+    """
     valid_extensions = (".xls", ".xlsx")
     global folder_path
     folder_path = Path(folder_path)
+    pipeline_manifest = manifest.PipelineManifest()
+    skipped = 0
 
     for file in tqdm(folder_path.rglob("*")):
         if file.suffix.lower() in valid_extensions:  
+            file_hash = pipeline_manifest.hash(file)
+            if incremental and pipeline_manifest.is_unchanged("excel", file, hash=file_hash):
+                skipped += 1
+                continue
+
             print(f"Converting excel file : {str(file)}")                      
-            excel_sheets_to_csv(file)   
+            with profiling.stage("excel_convert", file):
+                csv_files = excel_sheets_to_csv(file)   
+            if csv_files is not None:
+                pipeline_manifest.record("excel", file, hash=file_hash, outputs=csv_files)
+
+    pipeline_manifest.save()
+    if skipped > 0:
+        print(f"Skipped {skipped} unchanged excel files")
 
     if len(error_list) > 0:
         last_folder = os.path.basename(folder_path)
@@ -75,6 +258,62 @@ result = {}
 files_with_duplicate_columns = []
 input_folder_paths_error_files = []
 
+def header_fingerprint(columns):
+    """
+    Returns an order-independent fingerprint of a list of column headers. Two headers with the same columns in a
+    different order share a fingerprint, matching the sorted comparison used to detect schemas.
+    """
+    joined = "\x1f".join(sorted(str(col) for col in columns))
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+# Fingerprint -> schema key indexes for the known schemas and the unknown schemas found while scanning
+schema_index = {header_fingerprint(value): key for key, value in schema.items()}
+schema_new_index = {}
+# Fingerprint -> (schema key, columns) for the headers routed to a known schema by schema_match
+schema_matched = {}
+
+def get_schema_cache_file():
+    last_folder = os.path.basename(folder_path)
+    return Path(f"files/{last_folder}/schema_cache.json")
+
+def load_schema_cache():
+    """
+    Load the header cache from previous runs and re-register the unknown schemas found then, so that
+    UNknown_Schema_N keys stay stable between runs.
+    :return file_cache: Dict of file path -> {size, mtime, fingerprint, is_unique}.
+    """
+    global schema_key
+
+    cache_file = get_schema_cache_file()
+    if not cache_file.exists():
+        return {}
+
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        print(f"⚠️ Could not read schema cache {cache_file}. Rebuilding it.")
+        return {}
+
+    for key, columns in cache.get("unknown_schemas", {}).items():
+        fingerprint = header_fingerprint(columns)
+        if fingerprint in schema_index or fingerprint in schema_new_index:
+            continue
+        # Unknown headers of earlier runs that now match a known schema are matched again when their files are read
+        if schema_match.match_header(columns)["status"] == "matched":
+            continue
+        schema_new[key] = columns
+        schema_new_index[fingerprint] = key
+        schema_key = max(schema_key, int(key.rsplit("_", 1)[1]) + 1)
+
+    return cache.get("files", {})
+
+def save_schema_cache(file_cache):
+    cache_file = get_schema_cache_file()
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, "w", encoding="utf-8") as f:
+        json.dump({"unknown_schemas": schema_new, "files": file_cache}, f)
+
 def get_schema_by_folder(input_folder):
     global schema_key
 
@@ -84,41 +323,44 @@ def get_schema_by_folder(input_folder):
     return None
 
 
-def add_header_to_dict(new_list):
+def add_header_to_dict(new_list, fingerprint=None):
     """
     Adds a list to a dictionary, checking for existing values.
 
     Args:
-        dictionary: The dictionary to which the list will be added.
-        key: The key to associate with the list in the dictionary.
-        new_list: The list to be added to the dictionary.
+        new_list: The list of column headers to be looked up or added.
+        fingerprint: Precomputed header_fingerprint of new_list, if already known.
 
     Returns:
-        - If the list already exists as a value in the dictionary, returns the key associated with the existing list.
-        - If the list does not exist, adds the key-value pair to the dictionary and returns None.
+        - If the list already exists as a known or unknown schema, returns the key associated with the existing list.
+        - If the list is close enough to a known schema (see schema_match.match_header), returns that schema's key.
+        - Otherwise, registers it as a new UNknown_Schema_N and returns the new key.
     """
     global schema_key
 
-    for existing_key, existing_value in schema.items():
-        if sorted(existing_value) == sorted(new_list):            
-            return existing_key
-    
-    for existing_key, existing_value in schema_new.items():
-        if sorted(existing_value) == sorted(new_list):            
-            return existing_key
+    if fingerprint is None:
+        fingerprint = header_fingerprint(new_list)
+
+    existing_key = schema_index.get(fingerprint) or schema_new_index.get(fingerprint)
+    if existing_key:
+        return existing_key
+    if fingerprint in schema_matched:
+        return schema_matched[fingerprint][0]
+
+    match = schema_match.match_header(new_list)
+    if match["status"] == "matched":
+        schema_matched[fingerprint] = (match["schema_type"], new_list)
+        return match["schema_type"]
 
     new_key = f'UNknown_Schema_{schema_key}'
     schema_key += 1
 
-    schema_new[new_key] = new_list    
+    schema_new[new_key] = new_list
+    schema_new_index[fingerprint] = new_key
     return new_key
 
 def get_csv_headers(file_path):    
-    try:
-        df = pd.read_csv(file_path, nrows=0, encoding="utf-8")  # Try UTF-8 first
-    except UnicodeDecodeError:
-        print(f"⚠️ Encoding error in file: {file_path}. Retrying with Latin-1.")
-        df = pd.read_csv(file_path, nrows=0, encoding="latin-1")  # Use Latin-1 as fallback
+    df = encoding.read_csv(file_path, nrows=0)
     columns = list(df.columns)
 
     if len(set(columns)) == len(columns):
@@ -126,11 +368,55 @@ def get_csv_headers(file_path):
     else:
         return columns, False    
 
+def get_cached_csv_header(file_path, file_cache):
+    """
+    Returns the header fingerprint of a CSV file, reading the header only if the file is new or has changed since
+    the last run (by size and modification time).
+    :return fingerprint, columns, is_unique: columns is None when the header was served from the cache.
+    """
+    stat = Path(file_path).stat()
+    cache_key = str(file_path)
+    cached = file_cache.get(cache_key)
+
+    if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+        fingerprint = cached["fingerprint"]
+        if not cached["is_unique"] or fingerprint in schema_index or fingerprint in schema_new_index or fingerprint in schema_matched:
+            return fingerprint, None, cached["is_unique"]
+
+    columns, is_unique = get_csv_headers(file_path)
+    fingerprint = header_fingerprint(columns)
+    file_cache[cache_key] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "fingerprint": fingerprint,
+        "is_unique": is_unique,
+    }
+    return fingerprint, columns, is_unique
+
+def get_inexact_schema_files(file_cache) -> list:
+    """
+    Returns the scanned files whose header matched no known schema exactly, for schema_match.write_match_report.
+    :return files: List of (file path, schema key, column headers).
+    """
+    files = []
+    for file, file_schema in zip(flles, schema_type):
+        cached = file_cache.get(str(file))
+        if cached is None:
+            continue
+        fingerprint = cached["fingerprint"]
+        if fingerprint in schema_matched:
+            files.append((file, file_schema, schema_matched[fingerprint][1]))
+        elif fingerprint in schema_new_index:
+            files.append((file, file_schema, schema_new[schema_new_index[fingerprint]]))
+    return files
+
+@profiling.profiled("schema")
 def get_csv_schema():   
     global  folder_path
     """Returns a list of tuples containing the parent folder name and file name for all CSV and Excel files."""
     valid_extensions = (".csv")
     folder_path = Path(folder_path)
+    file_cache = load_schema_cache()
 
     for file in folder_path.rglob("*"):
         if file.is_file() and file.suffix.lower() in valid_extensions:  
@@ -155,10 +441,10 @@ def get_csv_schema():
                 else:
                     input_folder_paths_error_files.append(file)
             else:
-                csv_column_names, is_unique = get_csv_headers(file)
+                fingerprint, csv_column_names, is_unique = get_cached_csv_header(file, file_cache)
                 
                 if is_unique:
-                    get_schema = add_header_to_dict(csv_column_names)
+                    get_schema = add_header_to_dict(csv_column_names, fingerprint)
                     schema_type.append(get_schema)
 
                     flles.append(file)
@@ -192,6 +478,12 @@ def get_csv_schema():
             for item in files_with_duplicate_columns:
                 f.write(str(item) + "\n") 
 
+    # Only keep cache entries for files that still exist
+    scanned_files = {str(file) for file in flles + files_with_duplicate_columns}
+    save_schema_cache({key: value for key, value in file_cache.items() if key in scanned_files})
+    schema_match.write_match_report(get_inexact_schema_files(file_cache))
+    encoding.report_encoding_stats("schema detection")
+
     df = pd.DataFrame(result)
 
     last_folder = os.path.basename(folder_path)    
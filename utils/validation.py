@@ -0,0 +1,166 @@
+from pathlib import Path
+import os
+import pandas as pd
+from tqdm import tqdm
+from . import mysettings, encoding, schema_utils, profiling
+
+folder_path = mysettings.RAW_FOLDER_PATH
+
+REPORT_TOTALS_LABEL = "REPORT TOTALS:"
+REPORT_TOTALS_COLUMNS = ["Qty", "Net_Sales", "Tax_Sales"]
+
+class ReportTotalsAccumulator:
+    """
+    Reconciles the quantity and sales columns of a raw Transactor report with its REPORT TOTALS row. Each chunk is
+    summed in one grouped pass (report rows and the totals row as two groups), so a report can be checked chunk by
+    chunk without holding it in memory.
+    """
+
+    def __init__(self, cols=None, tolerance=None):
+        self.cols = cols or REPORT_TOTALS_COLUMNS
+        self.tolerance = mysettings.REPORT_TOTALS_TOLERANCE if tolerance is None else tolerance
+        self.sums = pd.Series(0.0, index=self.cols)
+        self.report_totals = pd.Series(0.0, index=self.cols)
+        self.total_rows = 0
+
+    def update(self, chunk: pd.DataFrame):
+        is_total = (chunk["Description"] == REPORT_TOTALS_LABEL).to_numpy()
+        sums = chunk[self.cols].groupby(is_total).sum()
+        if False in sums.index:
+            self.sums = self.sums + sums.loc[False]
+        if True in sums.index:
+            self.report_totals = self.report_totals + sums.loc[True]
+            self.total_rows += int(is_total.sum())
+
+    def results(self) -> list:
+        """
+        Returns one dict per check: whether the report has a single REPORT TOTALS row, and whether each column's sum
+        is within the tolerance of the report total, in either direction.
+        """
+        results = [{
+            "check": "report_totals_row",
+            "column": None,
+            "expected": 1,
+            "actual": self.total_rows,
+            "difference": self.total_rows - 1,
+            "passed": self.total_rows == 1,
+        }]
+        if self.total_rows == 0:
+            return results
+
+        differences = self.sums - self.report_totals
+        for col in self.cols:
+            results.append({
+                "check": "report_totals",
+                "column": col,
+                "expected": self.report_totals[col],
+                "actual": self.sums[col],
+                "difference": differences[col],
+                "passed": bool(abs(differences[col]) <= self.tolerance),
+            })
+        return results
+
+    def check(self):
+        """
+        Raise if any check failed, describing every failed check.
+        """
+        failed = [result for result in self.results() if not result["passed"]]
+        if len(failed) == 0:
+            return
+        if failed[0]["check"] == "report_totals_row":
+            raise Exception(
+                f"Raw Transactor data has {self.total_rows} REPORT TOTALS rows, expected 1."
+            )
+        raise Exception(
+            "Totals from Transactor data do not match report totals in original raw data: "
+            + ", ".join(f"{result['column']} differs by {result['difference']:.2f}" for result in failed)
+        )
+
+def check_report_totals(raw_data: pd.DataFrame):
+    """
+    Check the sums of quantity and sales match the REPORT TOTALS row of a raw Transactor report.
+    """
+    accumulator = ReportTotalsAccumulator()
+    accumulator.update(raw_data)
+    accumulator.check()
+
+def validate_report_totals(file_path, schema_type, chunksize=None) -> list:
+    """
+    Run the REPORT TOTALS checks on a raw Transactor file, reading only the columns the checks use, chunksize rows at
+    a time.
+    :return results: List of check result dicts.
+    """
+    if chunksize is None:
+        chunksize = mysettings.VALIDATION_CHUNKSIZE
+    cols = ["Description", *REPORT_TOTALS_COLUMNS]
+    dtype = {col: "float64" for col in REPORT_TOTALS_COLUMNS}
+    dtype.update(schema_utils.lookup_schema_dtypes().get(schema_type, {}))
+
+    accumulator = ReportTotalsAccumulator()
+    with profiling.stage("validate_file", file_path) as counts:
+        counts["rows_in"] = 0
+        for chunk in encoding.read_csv_chunks(file_path, chunksize, usecols=cols, dtype=dtype):
+            accumulator.update(chunk)
+            counts["rows_in"] += len(chunk)
+    return accumulator.results()
+
+@profiling.profiled("validate")
+def validate(df, chunksize=None) -> pd.DataFrame:
+    """
+    Validate every file in the file_with_schema manifest that has reconciliation checks, without stopping at the
+    first failure. Writes files/<raw folder>/validation_report.csv with one row per file and check, and
+    validation_summary.csv with the failed checks and files per lab.
+    :param df: DataFrame returned by utils.get_csv_schema (file_name, schema_type, system_source).
+    :param chunksize: Rows read at a time (default mysettings.VALIDATION_CHUNKSIZE).
+    :return report_df: DataFrame with one row per file and check.
+    """
+    # Imported here as pre_process_function imports this module
+    from . import pre_process_function
+
+    records = []
+    for file_path, schema_type, als_lab in tqdm(df.iloc[:, :3].itertuples(index=False, name=None), total=len(df)):
+        func = pre_process_function.lookup_preprocess_function.get(schema_type)
+        spec = pre_process_function.lookup_mapping_spec.get(func.__name__) if func else None
+        if not spec or not spec.get("report_totals"):
+            continue
+
+        file_record = {"file_name": str(file_path), "schema_type": schema_type, "als_lab": als_lab}
+        try:
+            results = validate_report_totals(file_path, schema_type, chunksize)
+        except Exception as e:
+            print(f"Error validating file {file_path}: {e}")
+            records.append({**file_record, "check": "read", "passed": False, "error": repr(e)})
+            continue
+        records += [{**file_record, **result, "error": None} for result in results]
+
+    return write_validation_report(records)
+
+def write_validation_report(records) -> pd.DataFrame:
+    last_folder = os.path.basename(folder_path)
+    output_folder = Path(f"files/{last_folder}")
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    report_df = pd.DataFrame(
+        records,
+        columns=[
+            "file_name", "schema_type", "als_lab", "check", "column", "expected", "actual", "difference", "passed",
+            "error",
+        ],
+    )
+    report_df.to_csv(f"{output_folder}/validation_report.csv", index=False)
+
+    report_df["failed"] = ~report_df["passed"].astype(bool)
+    summary_df = report_df.groupby("als_lab").agg(
+        files=("file_name", "nunique"),
+        checks=("check", "size"),
+        failed_checks=("failed", "sum"),
+    )
+    summary_df["failed_files"] = report_df.loc[report_df["failed"]].groupby("als_lab")["file_name"].nunique()
+    summary_df["failed_files"] = summary_df["failed_files"].fillna(0).astype(int)
+    summary_df.to_csv(f"{output_folder}/validation_summary.csv")
+
+    print(f"validation: {summary_df['failed_files'].sum()} of {report_df['file_name'].nunique()} files failed a check")
+    if summary_df["failed_files"].sum() > 0:
+        print(summary_df.loc[summary_df["failed_files"] > 0].to_string())
+
+    return report_df.drop(columns="failed")